@@ -96,6 +96,12 @@ class NixeBot(commands.Bot):
     async def setup_hook(self):
         """Load cogs before the bot connects."""
         global _loaded_cogs
+        # Gemini pool lives on this loop; worker-thread callers hand their requests to it
+        try:
+            from nixe.helpers import gemini_client
+            gemini_client.bind_loop()
+        except Exception as e:
+            log.warning("gemini_client.bind_loop failed: %r", e)
         # Prefer project-provided loader if available
         try:
             from nixe import cogs_loader as _loader
@@ -133,6 +139,14 @@ class NixeBot(commands.Bot):
         except Exception:
             log.info("🌐 Bot ready.")
 
+    async def close(self):
+        try:
+            from nixe.helpers import gemini_client
+            await gemini_client.aclose()
+        except Exception:
+            pass
+        await super().close()
+
     async def on_message(self, message: discord.Message):
         # Always forward to command processor, but ignore other bots
         if getattr(message.author, "bot", False):
@@ -157,6 +171,12 @@ async def handle_healthz(request: web.Request):
         "loaded_cogs": _loaded_cogs,
         "python": sys.version,
     }
+    try:
+        # per-model circuit breaker state + latency percentiles (nixe.helpers.gemini_client)
+        from nixe.helpers import gemini_client
+        data["providers"] = gemini_client.health()
+    except Exception:
+        data["providers"] = None
     return web.Response(text=json.dumps(data, ensure_ascii=False), content_type="application/json")
 
 async def start_web(port: int):
@@ -4,8 +4,10 @@ import re, io
 import discord
 from discord.ext import commands
 from nixe.helpers.env_reader import get, get_int
-from nixe.helpers.phash_tools import dhash_bytes, hamming
+from nixe.helpers.phash_tools import dhash_bytes, dhash_dihedral_bytes
+from nixe.helpers.phash_index import PhashIndex
 from nixe.helpers.phash_board import get_blacklist_hashes
+from nixe.helpers import attachment_store, content_cache, hit_stats
 URL_RE = re.compile(r"https?://[\w.-]+\.[a-z]{2,}(?:/\S*)?", re.I)
 _PRESET_TEXT = {"suspicious":"Suspicious or spam account","compromised":"Compromised or hacked account","breaking":"Breaking server rules","other":"Other"}
 def _ban_reason():
@@ -33,7 +35,11 @@ class FirstTouchdownFirewall(commands.Cog):
         self.allow = {int(x) for x in (get("PHISH_FTF_ALLOW_CHANNELS","").replace(","," ").split()) if x.isdigit()}
         self.block = set(get("PHISH_BLOCK_DOMAINS","").lower().replace(","," ").split())
         self.hash_thr = int(get_int("PHISH_HASH_HAMMING_MAX",6))
-        self.hash_ref = get_blacklist_hashes()
+        # opt-in: also check the flipped/rotated dHashes (from the cached small views, no re-decode)
+        self.dihedral = get("PHISH_FTF_DIHEDRAL","0")=="1"
+        self.hash_ref = PhashIndex(get_blacklist_hashes())
+        self.hash_ref.set_priority(hit_stats.STATS.score)
+        self._prio_gen = hit_stats.STATS.generation
     def _in_scope(self, ch_id:int)->bool:
         if self.allow and ch_id in self.allow: return False
         return (not self.guard) or (ch_id in self.guard)
@@ -55,15 +61,31 @@ class FirstTouchdownFirewall(commands.Cog):
         return False
     async def _image_hit(self, m:discord.Message)->bool:
         if not self.hash_ref: return False
+        if self._prio_gen != hit_stats.STATS.generation:
+            # re-sort the linear scan so hashes that keep firing are checked first
+            self._prio_gen = hit_stats.STATS.generation
+            self.hash_ref.set_priority(hit_stats.STATS.score)
         for a in m.attachments:
             n=(a.filename or "").lower()
             if not any(n.endswith(ext) for ext in (".png",".jpg",".jpeg",".webp",".gif")): continue
-            try: b=await a.read()
+            b=await attachment_store.read(a, m)
+            if not b: continue
+            # upright (+ dihedral when enabled) dHash from one pool job / one decode
+            jobs={"dhash:gt":(dhash_bytes,(),{})}
+            if self.dihedral: jobs["dhash:gt:d8"]=(dhash_dihedral_bytes,(),{})
+            try: hs=await content_cache.hashed_many(b,jobs,att=a)
             except Exception: continue
-            hv=dhash_bytes(b)
+            hv=hs.get("dhash:gt",0)
             if hv==0: continue
-            for ref in self.hash_ref:
-                if hamming(hv,ref)<=self.hash_thr: return True
+            hit = self.hash_ref.first_within(hv,self.hash_thr)
+            if not hit and self.dihedral:
+                alts=hs.get("dhash:gt:d8") or []
+                for x in alts[1:]:
+                    hit = self.hash_ref.first_within(x,self.hash_thr)
+                    if hit: break
+            if hit:
+                hit_stats.STATS.hit(hit[0])
+                return True
         return False
     @commands.Cog.listener()
     async def on_message(self, m: discord.Message):
@@ -3,6 +3,8 @@
 a00_lpg_rate_limit_overlay
 - Provide sane defaults for Gemini Lucky Pull budgets so free plan won't rate-limit.
 - No effect on phishing (Gemini already disabled by your block overlay).
+- LPG_GEM_MAX_RPM / _MAX_CONCURRENCY / _COOLDOWN_SEC / _RETRY_ON_429 / _BACKOFF_MS
+  are enforced per model by nixe.helpers.provider_limiter for every Gemini call.
 """
 import os
 from discord.ext import commands
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+a00_phash_db_cache_overlay
+- Keeps nixe.helpers.phash_db in sync with the pHash DB board message.
+- Board edits (ours or a moderator's) refresh the cached hash set straight from
+  the gateway payload; no history scan, no extra HTTP round-trip.
+"""
+from __future__ import annotations
+import logging
+import discord
+from discord.ext import commands
+
+from nixe.helpers import phash_db
+
+log = logging.getLogger("nixe.cogs.a00_phash_db_cache_overlay")
+
+class PhashDbCacheOverlay(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        try:
+            st = await phash_db.get(self.bot)
+            log.info("[phash-db-cache] ready msg=%s phash=%d v=%d", st.message_id or "-", len(st.phash), st.version)
+        except Exception as e:
+            log.debug("[phash-db-cache] preload failed: %r", e)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        try:
+            phash_db.on_raw_message_edit(payload)
+        except Exception as e:
+            log.debug("[phash-db-cache] edit err: %r", e)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        try:
+            phash_db.on_raw_message_delete(payload)
+        except Exception:
+            pass
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(PhashDbCacheOverlay(bot))
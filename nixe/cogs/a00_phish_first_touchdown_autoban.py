@@ -6,6 +6,7 @@
 import os, re, io, discord
 from discord.ext import commands
 from collections import Counter
+from nixe.helpers import attachment_store
 
 def _getenv(k,d=""): return os.getenv(k,d)
 def _csv(v): return [x.strip() for x in (v or "").split(",") if x.strip()]
@@ -86,13 +87,9 @@ class PhishFirstTouchdownAutoban(commands.Cog):
             return False
         # sniff first bytes for WEBP magic
         webp_count = 0
-        for a in atts:
-            try:
-                data = await a.read()
-                if _is_webp_magic(data[:16]):
-                    webp_count += 1
-            except Exception:
-                pass
+        for _a, data in await attachment_store.read_many(m, atts):
+            if _is_webp_magic(data[:16]):
+                webp_count += 1
         if webp_count >= 3:
             # optional: sizes close too => stronger signal
             sizes = [getattr(a, "size", 0) for a in atts]
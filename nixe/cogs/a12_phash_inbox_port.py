@@ -2,7 +2,8 @@
 import os, json, asyncio, discord
 from discord.ext import commands
 from discord import AllowedMentions
-from nixe.helpers import img_hashing
+from nixe.helpers import img_hashing, attachment_store, hash_pool, phash_board_writer, phash_db
+from nixe.helpers.image_context import derive_many
 
 PHASH_DB_MARKER = os.getenv("PHASH_DB_MARKER", "NIXE_PHASH_DB_V1").strip()
 TARGET_THREAD_NAME = os.getenv("NIXE_PHASH_SOURCE_THREAD_NAME", "imagephising").lower()
@@ -15,31 +16,16 @@ AUG_PER = int(os.getenv("PHASH_AUGMENT_PER_FRAME", "5"))
 TILE_GRID = int(os.getenv("TILE_GRID", "3"))
 ENABLE = os.getenv("NIXE_ENABLE_HASH_PORT", "1") == "1"
 
-def _render_db(phashes, dhashes=None, tiles=None):
-    data = {"phash": phashes or []}
-    if dhashes: data["dhash"] = dhashes
-    if tiles:   data["tphash"] = tiles
-    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
-    return f"{PHASH_DB_MARKER}\n```json\n{body}\n```"
-
-def _extract_hashes_from_json_msg(msg: discord.Message):
-    if not msg or not msg.content:
-        return [], [], []
-    s = msg.content
-    i, j = s.find("{"), s.rfind("}")
-    if i != -1 and j != -1 and j > i:
-        try:
-            obj = json.loads(s[i:j+1])
-            arr_p = obj.get("phash", []) or []
-            arr_d = obj.get("dhash", []) or []
-            arr_t = obj.get("tphash", []) or []
-            P = [str(x).strip() for x in arr_p if str(x).strip()]
-            D = [str(x).strip() for x in arr_d if str(x).strip()]
-            T = [str(x).strip() for x in arr_t if str(x).strip()]
-            return P, D, T
-        except Exception:
-            return [], [], []
-    return [], [], []
+def _jobs():
+    # one pool job per image, one decode: upright pHash (board) + variants/dHash/tiles (local)
+    base = dict(max_frames=MAX_FRAMES)
+    aug = dict(max_frames=MAX_FRAMES, augment=AUGMENT, augment_per_frame=AUG_PER)
+    return [
+        (img_hashing.phash_list_from_bytes, (), base),
+        (img_hashing.phash_list_from_bytes, (), aug),
+        (img_hashing.dhash_list_from_bytes, (), aug),
+        (img_hashing.tile_phash_list_from_bytes, (), dict(grid=TILE_GRID, max_frames=4, augment=AUGMENT, augment_per_frame=3)),
+    ]
 
 class PhashInboxPort(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -55,67 +41,33 @@ class PhashInboxPort(commands.Cog):
             if (ch.name or "").lower() != TARGET_THREAD_NAME: return
             if getattr(message.author, "bot", False) or not message.attachments: return
 
-            all_p, all_d, all_t = [], [], []
+            all_p, all_x, all_d, all_t = [], [], [], []
             for att in message.attachments:
                 name = (att.filename or "").lower()
                 if not any(name.endswith(ext) for ext in IMAGE_EXTS): continue
-                try:
-                    raw = await att.read()
-                except Exception:
-                    continue
+                raw = await attachment_store.read(att, message)
                 if not raw: continue
+                res = await hash_pool.submit(derive_many, raw, _jobs())
+                for out, (ok, hs) in zip((all_p, all_x, all_d, all_t), res):
+                    if ok and hs: out.extend(hs)
 
-                hs = img_hashing.phash_list_from_bytes(raw, max_frames=MAX_FRAMES, augment=AUGMENT, augment_per_frame=AUG_PER)
-                if hs: all_p.extend(hs)
-
-                dh_func = getattr(img_hashing, "dhash_list_from_bytes", None)
-                if dh_func:
-                    ds = dh_func(raw, max_frames=MAX_FRAMES, augment=AUGMENT, augment_per_frame=AUG_PER)
-                    if ds: all_d.extend(ds)
-
-                t_func = getattr(img_hashing, "tile_phash_list_from_bytes", None)
-                if t_func:
-                    ts = t_func(raw, grid=TILE_GRID, max_frames=4, augment=AUGMENT, augment_per_frame=3)
-                    if ts: all_t.extend(ts)
-
-            if not (all_p or all_d or all_t): return
+            if not (all_p or all_x or all_d or all_t): return
 
             parent = ch.parent if hasattr(ch, "parent") else None
-            db_msg = None
-            if parent:
-                try:
-                    async for m in parent.history(limit=50):
-                        if m.author.id == self.bot.user.id and PHASH_DB_MARKER in (m.content or ""):
-                            db_msg = m; break
-                except Exception:
-                    db_msg = None
-
-            existing_p, existing_d, existing_t = ([], [], [])
-            if db_msg:
-                existing_p, existing_d, existing_t = _extract_hashes_from_json_msg(db_msg)
-
-            sp, sd, st = set(existing_p), set(existing_d), set(existing_t)
-            added_p = [h for h in all_p if h not in sp and not sp.add(h)]
-            added_d = [h for h in all_d if h not in sd and not sd.add(h)]
-            added_t = [t for t in all_t if t not in st and not st.add(t)]
-            existing_p += added_p; existing_d += added_d; existing_t += added_t
-
-            content = _render_db(existing_p, existing_d, existing_t)
-
-            if db_msg:
-                try: await db_msg.edit(content=content)
-                except Exception: pass
-            else:
-                if parent:
-                    try: db_msg = await parent.send(content)
-                    except Exception: db_msg = None
+            if not parent: return
+            # the board message (2000 chars) only carries upright pHashes; the rest stays local
+            local = phash_db.add_local(phash=all_x, dhash=all_d, tphash=all_t)
+            # one coalesced board edit per interval instead of one per inbox post
+            added, totals = phash_board_writer.queue(self.bot, phash=all_p, channel=parent)
+            added += local
+            totals["dhash"] = len(phash_db.S.dhash)
 
             if NOTIFY_THREAD and message:
                 try:
                     e = discord.Embed(title="pHash update", colour=0xFF8C00)
-                    e.add_field(name="Hashes added", value=str(len(added_p) + len(added_d) + len(added_t)), inline=True)
-                    e.add_field(name="pHash total", value=str(len(existing_p)), inline=True)
-                    e.add_field(name="dHash total", value=str(len(existing_d)), inline=True)
+                    e.add_field(name="Hashes added", value=str(added), inline=True)
+                    e.add_field(name="pHash total", value=str(totals["phash"]), inline=True)
+                    e.add_field(name="dHash total", value=str(totals["dhash"]), inline=True)
                     await message.reply(embed=e, mention_author=False, allowed_mentions=AllowedMentions.none())
                 except Exception:
                     pass
@@ -2,7 +2,8 @@
 import os, json, asyncio, discord
 from discord.ext import commands, tasks
 from discord import AllowedMentions
-from nixe.helpers import img_hashing
+from nixe.helpers import img_hashing, hash_pool, phash_board_writer, phash_backfill, phash_db
+from nixe.helpers.image_context import derive_many
 
 PHASH_DB_MARKER = os.getenv("PHASH_DB_MARKER", "NIXE_PHASH_DB_V1").strip()
 TARGET_THREAD_NAME = os.getenv("NIXE_PHASH_SOURCE_THREAD_NAME", "imagephising").lower()
@@ -17,31 +18,16 @@ AUG_PER = int(os.getenv("PHASH_AUGMENT_PER_FRAME", "5"))
 TILE_GRID = int(os.getenv("TILE_GRID", "3"))
 ENABLE = os.getenv("NIXE_ENABLE_HASH_PORT", "1") == "1"
 
-def _render_db(phashes, dhashes=None, tiles=None):
-    data = {"phash": phashes or []}
-    if dhashes: data["dhash"] = dhashes
-    if tiles:   data["tphash"] = tiles
-    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
-    return f"{PHASH_DB_MARKER}\n```json\n{body}\n```"
-
-def _extract_hashes_from_json_msg(msg: discord.Message):
-    if not msg or not msg.content:
-        return [], [], []
-    s = msg.content
-    i, j = s.find("{"), s.rfind("}")
-    if i != -1 and j != -1 and j > i:
-        try:
-            obj = json.loads(s[i:j+1])
-            arr_p = obj.get("phash", []) or []
-            arr_d = obj.get("dhash", []) or []
-            arr_t = obj.get("tphash", []) or []
-            P = [str(x).strip() for x in arr_p if str(x).strip()]
-            D = [str(x).strip() for x in arr_d if str(x).strip()]
-            T = [str(x).strip() for x in arr_t if str(x).strip()]
-            return P, D, T
-        except Exception:
-            return [], [], []
-    return [], [], []
+def _jobs():
+    # one pool job per image, one decode: upright pHash (board) + variants/dHash/tiles (local)
+    base = dict(max_frames=MAX_FRAMES)
+    aug = dict(max_frames=MAX_FRAMES, augment=AUGMENT, augment_per_frame=AUG_PER)
+    return [
+        (img_hashing.phash_list_from_bytes, (), base),
+        (img_hashing.phash_list_from_bytes, (), aug),
+        (img_hashing.dhash_list_from_bytes, (), aug),
+        (img_hashing.tile_phash_list_from_bytes, (), dict(grid=TILE_GRID, max_frames=4, augment=AUGMENT, augment_per_frame=0)),
+    ]
 
 class PhashAutoReseedPort(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -76,72 +62,43 @@ class PhashAutoReseedPort(commands.Cog):
         if not parent:
             return
 
-        db_msg = None
-        try:
-            async for m in parent.history(limit=50):
-                if m.author.id == self.bot.user.id and PHASH_DB_MARKER in (m.content or ""):
-                    db_msg = m; break
-        except Exception:
-            db_msg = None
-
-        all_p, all_d, all_t = [], [], []
-        scanned_msgs = scanned_atts = 0
-        async for m in target_thread.history(limit=LIMIT_MSGS, oldest_first=True):
-            scanned_msgs += 1
-            if not m.attachments: continue
-            for att in m.attachments:
-                name = (att.filename or "").lower()
-                if not any(name.endswith(ext) for ext in IMAGE_EXTS): continue
-                raw = await att.read()
-                if not raw: continue
-                scanned_atts += 1
-
-                hs = img_hashing.phash_list_from_bytes(raw, max_frames=MAX_FRAMES, augment=AUGMENT, augment_per_frame=AUG_PER)
-                if hs: all_p.extend(hs)
-
-                dhf = getattr(img_hashing, "dhash_list_from_bytes", None)
-                if dhf:
-                    ds = dhf(raw, max_frames=MAX_FRAMES, augment=AUGMENT, augment_per_frame=AUG_PER)
-                    if ds: all_d.extend(ds)
-
-                tfunc = getattr(img_hashing, "tile_phash_list_from_bytes", None)
-                if tfunc:
-                    ts = tfunc(raw, grid=TILE_GRID, max_frames=4, augment=AUGMENT, augment_per_frame=0)
-                    if ts: all_t.extend(ts)
-
-                if (scanned_atts % 25) == 0:
-                    await asyncio.sleep(1)
-
-        existing_p, existing_d, existing_t = ([], [], [])
-        if db_msg:
-            existing_p, existing_d, existing_t = _extract_hashes_from_json_msg(db_msg)
-
-        sp, sd, st = set(existing_p), set(existing_d), set(existing_t)
-        for h in all_p:
-            if h not in sp: existing_p.append(h); sp.add(h)
-        for h in all_d:
-            if h not in sd: existing_d.append(h); sd.add(h)
-        for t in all_t:
-            if t not in st: existing_t.append(t); st.add(t)
-
-        content = _render_db(existing_p, existing_d, existing_t)
-
-        if db_msg:
-            try: await db_msg.edit(content=content)
-            except Exception: pass
-        else:
-            try: db_msg = await parent.send(content)
-            except Exception: db_msg = None
+        all_p, all_x, all_d, all_t = [], [], [], []
+        totals = {"phash": 0, "dhash": 0}
+
+        async def handle(m, att, raw) -> int:
+            n = 0
+            res = await hash_pool.submit(derive_many, raw, _jobs())
+            for out, (ok, hs) in zip((all_p, all_x, all_d, all_t), res):
+                if ok and hs: out.extend(hs); n += len(hs)
+            return n
+
+        async def commit() -> bool:
+            # upright pHashes go to the coalescing board writer (merged with a12/rescanner
+            # additions), variants/dHash/tiles to the local store so the board message fits;
+            # the resume cursor is only saved once the board edit went through
+            if not (all_p or all_x or all_d or all_t):
+                return True
+            phash_db.add_local(phash=all_x, dhash=all_d, tphash=all_t)
+            _added, t = phash_board_writer.queue(self.bot, phash=all_p, channel=parent)
+            totals.update(t, dhash=len(phash_db.S.dhash))
+            all_p.clear(); all_x.clear(); all_d.clear(); all_t.clear()
+            return await phash_board_writer.flush(parent, force=True)
+
+        # resumes after the last processed message instead of rescanning LIMIT_MSGS on every boot
+        st = await phash_backfill.Backfill(f"a13:{target_thread.id}").run(target_thread, handle, commit, limit=LIMIT_MSGS)
+        scanned_msgs, scanned_atts = st["messages"], st["attachments"]
+        if not scanned_msgs:
+            return
 
         if NOTIFY_THREAD:
             try:
                 emb = discord.Embed(
                     title="Auto reseed selesai",
-                    description=f"Thread: {target_thread.mention}\nScanned: {scanned_msgs} msgs / {scanned_atts} attachments",
+                    description=f"Thread: {target_thread.mention}\nScanned: {scanned_msgs} msgs / {scanned_atts} attachments ({st['rate']} att/s)",
                     colour=0x00B894,
                 )
-                emb.add_field(name="Total pHash", value=str(len(existing_p)), inline=True)
-                emb.add_field(name="Total dHash", value=str(len(existing_d)), inline=True)
+                emb.add_field(name="Total pHash", value=str(totals["phash"]), inline=True)
+                emb.add_field(name="Total dHash", value=str(totals["dhash"]), inline=True)
                 m = await parent.send(embed=emb, allowed_mentions=AllowedMentions.none())
                 if LOG_TTL_SECONDS > 0:
                     await asyncio.sleep(LOG_TTL_SECONDS)
@@ -3,11 +3,14 @@
 """
 a15_lpa_neg_phash_overlay
 Safelist untuk menurunkan false positive Lucky Pull:
-- Cek pHash gambar terhadap daftar "NEGATIVE" (UI/layar bukan gacha).
-- Jika match >= LPG_NEG_MATCH_THRESHOLD => paksa benign, skip delete/mention.
+- Cek pHash (dan ahash/dhash bila ada entri-nya) gambar terhadap ``label_index``
+  (env LPG_NEG_*, file whitelist thread, lpg_memory, board phish) dalam satu query.
+- Jika label terdekat = negative dengan sim >= LPG_NEG_MATCH_THRESHOLD
+  (atau sha256 persis) => paksa benign, skip delete/mention.
 
 ENV:
-- LPG_NEG_PHASHES             : "hash1,hash2,..."
+- LPG_NEG_PHASHES / LPG_NEG_AHASHES / LPG_NEG_DHASHES / LPG_NEG_SHA256 : "hash1,hash2,..."
+- LPG_NEG_FILE                : whitelist file, hot-reloaded (see label_index)
 - LPG_NEG_MATCH_THRESHOLD     : default 0.93
 Integrasi:
 - Overlay ini hook ke event on_message, dan hanya bertindak jika
@@ -18,42 +21,49 @@ from __future__ import annotations
 import os, logging, asyncio
 import discord
 from discord.ext import commands
+from nixe.helpers import attachment_store, content_cache, img_hashing, label_index
+from nixe.helpers.hash_utils import ahash_hex_from_bytes, dhash_hex_from_bytes
 
 log = logging.getLogger("nixe.cogs.a15_lpa_neg_phash_overlay")
 
-def _parse_hashes(s: str | None) -> set[str]:
-    if not s: return set()
-    return {h.strip().lower() for h in s.split(",") if h.strip()}
-
 def _parse_float(s: str | None, default: float) -> float:
     try:
         return float(s)
     except Exception:
         return default
 
-# Hamming distance on hex pHash
-def _ham_dist_hex(a: str, b: str) -> int:
-    try:
-        return bin(int(a, 16) ^ int(b, 16)).count("1")
-    except Exception:
-        return 256  # far
-
-def _similarity_hex(a: str, b: str) -> float:
-    # 64-bit phash -> max bits = 64
-    d = _ham_dist_hex(a, b)
-    return 1.0 - (d / 64.0)
+def _radius_for(thr: float) -> int:
+    # similarity = 1 - bits/64 (64-bit phash) -> largest bit distance with sim >= thr
+    return max(0, int(64.0 * (1.0 - thr) + 1e-9))
 
 class LpaNegPhashOverlay(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.neg = _parse_hashes(os.getenv("LPG_NEG_PHASHES", ""))
         self.thr = _parse_float(os.getenv("LPG_NEG_MATCH_THRESHOLD"), 0.93)
         # cache message ids to skip by other cogs
         self.skip = set()
-        if self.neg:
-            log.warning("[lpa-neg] active: %d negative phash(es), thr=%.2f", len(self.neg), self.thr)
+        self.radius = _radius_for(self.thr)
+        n = label_index.get(force=True).count(label=label_index.NEGATIVE)
+        if n:
+            log.warning("[lpa-neg] active: %d negative hash(es), thr=%.2f", n, self.thr)
         else:
-            log.info("[lpa-neg] no negative phash set")
+            log.info("[lpa-neg] no negative hash set yet (file/thread reloads live)")
+
+    async def _queries(self, data: bytes, att, index) -> dict:
+        # ahash/dhash only when something is stored under that kind (whitelist thread / memory);
+        # every kind needed comes from one pool job / one decode
+        jobs = {"phash:1": (img_hashing.phash_list_from_bytes, (), {"max_frames": 1})}
+        if index.has("ahash"):
+            jobs["ahash:8"] = (ahash_hex_from_bytes, (8,), {})
+        if index.has("dhash"):
+            jobs["dhash:hex"] = (dhash_hex_from_bytes, (), {})
+        hv = await content_cache.hashed_many(data, jobs, att=att)
+        q = {"phash": hv.get("phash:1") or []}
+        if "ahash:8" in hv:
+            q["ahash"] = [hv["ahash:8"]]
+        if "dhash:hex" in hv:
+            q["dhash"] = [hv["dhash:hex"]]
+        return q
 
     @commands.Cog.listener("on_message")
     async def _on_message(self, message: discord.Message):
@@ -62,29 +72,29 @@ class LpaNegPhashOverlay(commands.Cog):
                 return
             # Only act in channels guarded by lucky pull (optional speed-up)
             # If you want strict scope, set LPG_GUARD_CHANNELS and check here.
-            # Compute phash using existing helper if available
-            pfunc = None
-            try:
-                from nixe.helpers.phash_board import phash_hex_from_bytes as pfunc  # type: ignore
-            except Exception:
-                pass
-            if not pfunc:
+            index = label_index.get()
+            if not index.count(label=label_index.NEGATIVE):
                 return
             # evaluate each image
             for att in message.attachments:
                 if not (att.content_type and att.content_type.startswith("image/")):
                     continue
-                data = await att.read()
-                try:
-                    h = pfunc(data)
-                except Exception:
+                data = await attachment_store.read(att, message)
+                if not data:
                     continue
-                for neg in self.neg:
-                    sim = _similarity_hex(h, neg)
-                    if sim >= self.thr:
-                        self.skip.add(message.id)
-                        log.warning("[lpa-neg] safelisted msg=%s sim=%.3f hash=%s neg=%s", message.id, sim, h, neg)
-                        return
+                hit = index.exact(content_cache.digest(data, att))
+                if hit is None:
+                    try:
+                        q = await self._queries(data, att, index)
+                    except Exception:
+                        continue
+                    # nearest label overall: a closer phish/lucky entry wins over a far negative one
+                    hit = index.nearest(q, self.radius)
+                if hit and hit.label == label_index.NEGATIVE:
+                    self.skip.add(message.id)
+                    log.warning("[lpa-neg] safelisted msg=%s sim=%.3f kind=%s neg=%s src=%s", message.id,
+                                1.0 - hit.dist / 64.0, hit.kind, hit.hash, hit.source)
+                    return
         except Exception as e:
             log.debug("[lpa-neg] error: %r", e)
 
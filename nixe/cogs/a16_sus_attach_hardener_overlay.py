@@ -4,6 +4,7 @@ import os, re, asyncio, logging, urllib.parse
 from typing import Tuple, Optional, List
 import discord
 from discord.ext import commands
+from nixe.helpers import attachment_store
 
 log = logging.getLogger("nixe.cogs.a16_sus_attach_hardener_overlay")
 
@@ -166,7 +167,7 @@ class SusAttachHardener(commands.Cog):
         for att in getattr(message, "attachments", []) or []:
             try:
                 if isinstance(att, discord.Attachment) and (att.filename or "").lower().endswith(tuple(_IMG_EXT)):
-                    b = await att.read()
+                    b = await attachment_store.read(att, message)
                     if b: blobs.append(b)
             except Exception: pass
         for emb in getattr(message, "embeds", []) or []:
@@ -204,7 +205,7 @@ class SusAttachHardener(commands.Cog):
             try:
                 if not isinstance(att, discord.Attachment): continue
                 name = att.filename or ""
-                b = await att.read()
+                b = await attachment_store.read(att, message)
                 sc, rs, mime = _score_attachment(name, b or b"")
                 total_score += sc
                 if sc: reasons.append(f"{name}:{rs}")
@@ -28,8 +28,13 @@ from pathlib import Path
 from typing import List, Set, Optional
 
 import discord
+import numpy as np
 from discord.ext import commands
 
+from nixe.helpers import attachment_store, content_cache, np_hash
+from nixe.helpers.phash_tools import dhash_bytes
+from nixe.helpers.image_context import DECODE_PX, open_image
+
 # =====================
 # KONFIGURASI DI MODUL
 # =====================
@@ -251,10 +256,13 @@ class GachaLuckGuard(commands.Cog):
             if not ((a.content_type and a.content_type.startswith("image/")) or any(a.filename.lower().endswith(ext) for ext in IMAGE_EXTS)):
                 continue
             try:
-                data = await a.read()
-                from io import BytesIO
-                img = Image.open(BytesIO(data)).convert("L")
-                d = self._dhash(img)
+                data = await attachment_store.read(a, message)
+                if not data:
+                    continue
+                # same bits as self._dhash (Pillow default resize), computed off-loop
+                d = await content_cache.hashed(data, "dhash:gt:default", dhash_bytes, None, att=a)
+                if not d:
+                    continue
                 for name, proto in self._phash_db.items():
                     if self._hamming(d, proto) <= self.cfg.phash_hamming_threshold:
                         return True
@@ -277,8 +285,8 @@ class GachaLuckGuard(commands.Cog):
                     key = str(p.relative_to(self.cfg.phash_db_dir)).replace("\\", "/")
                     if key not in db:
                         try:
-                            from PIL import Image
-                            img = Image.open(p).convert("L")
+                            # same reduced decode as the runtime dhash_bytes path
+                            img = open_image(p, DECODE_PX).convert("L")
                             db[key] = self._dhash(img)
                         except Exception:
                             pass
@@ -292,15 +300,8 @@ class GachaLuckGuard(commands.Cog):
 
     def _dhash(self, img, size=8) -> int:
         """Difference hash sederhana (64-bit)."""
-        w, h = size + 1, size
-        img = img.resize((w, h))
-        px = list(img.getdata())
-        bits = 0
-        for y in range(h):
-            row = px[y * w:(y + 1) * w]
-            for x in range(w - 1):
-                bits = (bits << 1) | (1 if row[x] > row[x + 1] else 0)
-        return bits
+        arr = np.asarray(img.convert("L").resize((size + 1, size)), dtype=np.uint8)
+        return np_hash.dhash_u64(arr, greater=True)
 
     def _hamming(self, a: int, b: int) -> int:
         return (a ^ b).bit_count()
@@ -1,7 +1,7 @@
 
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import os, json, aiohttp, logging
+import os, json, logging
 from typing import Optional
 import discord
 from discord.ext import commands
@@ -9,9 +9,22 @@ from discord.ext import commands
 log = logging.getLogger(__name__)
 
 from nixe.helpers.env_reader import get as _cfg_get
+from nixe.helpers import gemini_client
 API_KEY = _cfg_get('GEMINI_API_KEY') or os.getenv("GEMINI_API_KEY")
 DEFAULT_MODEL = _cfg_get('GEMINI_MODEL', 'gemini-2.5-flash')
 
+def _health_lines(mdl: str) -> str:
+    """Breaker state + latency per model (``gemini_client.health``), checked model first."""
+    h = gemini_client.health()
+    keys = sorted(h, key=lambda k: (k != "gemini:" + mdl, k))
+    lines = []
+    for k in keys:
+        v = h[k]
+        state = v["state"] + (f" ({v['open_for']:.0f}s left)" if v["state"] == "open" else "")
+        lines.append(f"`{k}` breaker={state} err={v['error_rate']:.0%}/{v['window_calls']} "
+                     f"lat p50={v['lat_p50']:.2f}s p90={v['lat_p90']:.2f}s wait p90={v['wait_p90']:.2f}s")
+    return "\n".join(lines) or "belum ada panggilan Gemini tercatat."
+
 class GeminiHealth(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
@@ -24,31 +37,23 @@ class GeminiHealth(commands.Cog):
             await ctx.reply("Gemini API key belum di-set (GEMINI_API_KEY/GEMINI_API_KEY).", mention_author=False)
             return
         mdl = model or DEFAULT_MODEL
-        base = "https://generativelanguage.googleapis.com/v1beta"
-        # metadata
+        # metadata (same pooled session as the classifiers, so this also warms the pool)
         try:
-            async with aiohttp.ClientSession() as sess:
-                async with sess.get(f"{base}/models/{mdl}?key={API_KEY}") as r:
-                    meta = await r.json()
+            meta = await gemini_client.get_model(mdl)
         except Exception as e:
-            await ctx.reply(f"models/{mdl}: error {e!r}", mention_author=False)
+            await ctx.reply(f"models/{mdl}: error {e!r}\n{_health_lines(mdl)}", mention_author=False)
             return
 
-        body = {
-            "contents": [{"role":"user","parts":[{"text":"Return ONLY: {\"ok\":true}"}]}],
-            "generationConfig": {"responseMimeType": "application/json"}
-        }
         try:
-            async with aiohttp.ClientSession() as sess:
-                async with sess.post(f"{base}/models/{mdl}:generateContent?key={API_KEY}", json=body) as r:
-                    data = await r.json()
+            data = await gemini_client.generate(mdl, ['Return ONLY: {"ok":true}'],
+                                                generation_config={"responseMimeType": "application/json"})
         except Exception as e:
-            await ctx.reply(f"generateContent error: {e!r}", mention_author=False)
+            await ctx.reply(f"generateContent error: {e!r}\n{_health_lines(mdl)}", mention_author=False)
             return
 
         meta_name = meta.get("name", mdl)
         mdl_id = meta.get("baseModelId", mdl)
-        await ctx.reply(f"gemini-check OK: `{meta_name}` (id=`{mdl_id}`)", mention_author=False)
+        await ctx.reply(f"gemini-check OK: `{meta_name}` (id=`{mdl_id}`)\n{_health_lines(mdl)}", mention_author=False)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(GeminiHealth(bot))
@@ -5,6 +5,7 @@ import discord
 from discord.ext import commands
 from nixe.helpers.env_reader import get as _cfg_get, get_int as _cfg_int, get_bool01 as _cfg_bool01
 from nixe.helpers.gemini_phish import classify_image_phish
+from nixe.helpers import attachment_store, gemini_client, verdict_cache
 log = logging.getLogger(__name__)
 def _compress(raw: bytes, max_px=640, min_px=384, target_kb=300, quality=75):
     try:
@@ -34,12 +35,20 @@ class ImagePhishGeminiGuard(commands.Cog):
         if not self.enabled or msg.author.bot: return
         imgs=[a for a in msg.attachments if a.content_type and a.content_type.startswith("image/")]
         if not imgs: return
-        datas=[]
-        for a in imgs[:self.max_imgs]:
-            try: datas.append(_compress(await a.read()))
-            except Exception: pass
-        if not datas: return
-        label, conf = await classify_image_phish(datas, hints="discord scam check", timeout_ms=self.timeout_ms)
+        model=_cfg_get("GEMINI_MODEL","gemini-2.5-flash")
+        if not gemini_client.available(model):
+            # breaker open (provider outage): defer, don't hold the message for the full timeout
+            log.debug("[phish-gemini] deferred: circuit open for %s", model); return
+        atts, raws=[], []
+        for a, raw in await attachment_store.read_many(msg, imgs[:self.max_imgs]):
+            if raw: atts.append(a); raws.append(raw)
+        if not raws: return
+        async def call():
+            datas=[_compress(r) for r in raws]
+            return tuple(await classify_image_phish(datas, hints="discord scam check", timeout_ms=self.timeout_ms))
+        # near-duplicate reposts reuse the verdict; failed calls ("ok", 0.0) are not cached
+        label, conf = await verdict_cache.cached(raws, "phish", model, call,
+                                                 atts=atts, store_if=lambda r: float(r[1] or 0.0) > 0.0)
         if label=="phish" and conf>=self.threshold:
             try: await msg.delete(reason=f"image phishing (gemini conf={conf:.2f})")
             except discord.Forbidden: log.warning("[phish-gemini] missing Manage Messages")
@@ -6,6 +6,8 @@ import discord
 from discord.ext import commands
 from .lpg_whitelist_thread_manager import LPGWhitelistThreadManager
 from nixe.helpers.hash_utils import ahash_hex_from_bytes, dhash_hex_from_bytes, sha256_hex
+from nixe.helpers import attachment_store, hash_pool, img_hashing, lucky_model, verdict_cache
+from nixe.helpers.image_context import derive_many
 
 log = logging.getLogger("nixe.cogs.lpg_whitelist_ingestor")
 
@@ -64,8 +66,16 @@ class LPGWhitelistIngestor(commands.Cog):
         self._guard_reload_notify = os.getenv("LPG_NEG_TOUCH_FILE") or self.cfg.get("LPG_NEG_TOUCH_FILE") or "data/lpg_neg_reload.touch"
 
     async def _ingest_bytes(self, b: bytes, meta: str) -> list[str]:
-        a = ahash_hex_from_bytes(b, 8)
-        d = dhash_hex_from_bytes(b)
+        # every hash + the model features from one pool job / one decode
+        res = await hash_pool.submit(derive_many, b, [
+            (ahash_hex_from_bytes, (8,), {}),
+            (dhash_hex_from_bytes, (), {}),
+            (img_hashing.phash_list_from_bytes, (), {"max_frames": 1}),
+            (lucky_model.features, (), {}),
+        ])
+        (a_ok, a), (d_ok, d), (p_ok, ph), (x_ok, x) = res
+        if not (a_ok and d_ok):
+            raise RuntimeError(f"hash failed: {a if not a_ok else d}")
         s = sha256_hex(b)
         lines = [
             f"ahash:{a}  # {meta}",
@@ -73,6 +83,17 @@ class LPGWhitelistIngestor(commands.Cog):
             f"sha256:{s} # {meta}",
         ]
         added = _append_if_new(self.neg_file, lines)
+        # moderator override: cached LLM verdicts for this image (and near copies) are stale now
+        try:
+            verdict_cache.invalidate((ph if p_ok else None) or [], digest=s)
+        except Exception:
+            log.debug("[lpg-wl] verdict invalidation failed", exc_info=True)
+        # moderator label = strongest training row for the local model
+        try:
+            if x_ok:
+                await asyncio.to_thread(lucky_model.record, x, 0, "whitelist", key=s)
+        except Exception:
+            log.debug("[lpg-wl] sample not recorded", exc_info=True)
         # touch flag to inform guard (mtime change)
         try:
             os.makedirs(os.path.dirname(self._guard_reload_notify), exist_ok=True)
@@ -98,7 +119,7 @@ class LPGWhitelistIngestor(commands.Cog):
             img = None
             for a in message.attachments:
                 if (getattr(a, "content_type", "") or "").startswith("image/"):
-                    img = await a.read()
+                    img = await attachment_store.read(a, message)
                     break
             if not img:
                 return
@@ -1,7 +1,8 @@
 # nixe/cogs/lucky_pull_auto.py — fix {channel} placeholder + remove extra pre-delay
-import os, time, json, random, re, logging, asyncio, discord
+import os, time, json, random, re, logging, asyncio, contextlib, discord
 from typing import Dict, List, Optional, Tuple
 from discord.ext import commands
+from nixe.helpers import attachment_store, content_cache, lucky_model, lucky_pregate, verdict_cache
 
 _log = logging.getLogger(__name__)
 
@@ -89,7 +90,9 @@ class LuckyPullAuto(commands.Cog):
         self.cool=int(_getenv("LPA_COOLDOWN_SEC","15") or 15)
         self.exec_mode=_getenv("LPA_EXECUTION_MODE","provider_first")
         self.defer=_getenv("LPA_DEFER_IF_PROVIDER_DOWN","1")=="1"
-        self.order=_getenv("LPA_PROVIDER_ORDER","gemini,groq")
+        self.order=_getenv("LPA_PROVIDER_ORDER","local,gemini,groq")  # local = nixe.helpers.lucky_model
+        self._sample_neg_max=float(_getenv("LPG_MODEL_NEG_MAX","0.2") or 0.2)
+        self._bg: set = set()   # sample-collection tasks; the loop only holds tasks weakly
         self.kw_gate=_getenv("LPA_REQUIRE_TEXT_KEYWORD","0")=="1"
 
         # Persona
@@ -115,8 +118,9 @@ class LuckyPullAuto(commands.Cog):
 
         # Non‑blocking provider controls — allow up to 15s provider time
         self._provider_timeout_ms = int(_getenv("LPA_PROVIDER_TIMEOUT_MS","15000") or "15000")
-        self._provider_conc = max(1, int(_getenv("LPA_PROVIDER_CONCURRENCY","1") or "1"))
-        self._sem = asyncio.Semaphore(self._provider_conc)
+        # 0 (default) = no local cap; provider_limiter governs Gemini calls bot-wide
+        self._provider_conc = max(0, int(_getenv("LPA_PROVIDER_CONCURRENCY","0") or "0"))
+        self._sem = asyncio.Semaphore(self._provider_conc) if self._provider_conc else contextlib.nullcontext()
 
         self._t={}
         self._ready_gate_until = time.monotonic() + 999999  # updated on_ready
@@ -155,14 +159,15 @@ class LuckyPullAuto(commands.Cog):
         return "\n".join(parts).strip()
 
     async def _first_image_bytes(self, m: discord.Message):
+        """(bytes, attachment) of the first readable image, or (None, None)."""
         for a in m.attachments:
             ct = (getattr(a, "content_type", None) or "").lower()
             name = (a.filename or "").lower()
             looks_img = ct.startswith("image/") or name.endswith((".png",".jpg",".jpeg",".webp",".gif",".bmp"))
             if looks_img:
-                try: return await a.read()
-                except Exception: continue
-        return None
+                raw = await attachment_store.read(a, m)
+                if raw: return raw, a
+        return None, None
 
     async def _provider_call_to_thread(self, func, *args):
         """Run blocking provider fn in thread with timeout to avoid heartbeat blocking."""
@@ -174,16 +179,42 @@ class LuckyPullAuto(commands.Cog):
         except Exception:
             return (None, "provider_err")
 
-    async def _classify(self, img_bytes: Optional[bytes], text: str) -> Tuple[Optional[float], str]:
+    async def _classify(self, img_bytes: Optional[bytes], text: str, att=None) -> Tuple[Optional[float], str]:
+        if img_bytes:
+            # tier 0/1 locally (filename, colour/layout); benign images never reach the provider
+            gate = await lucky_pregate.gate(img_bytes, att=att)
+            if not gate.escalate:
+                return gate.score, f"pregate:t{gate.tier}"
         if not self.BR:
             return None, "no_bridge"
         if img_bytes:
-            score, via = await self._provider_call_to_thread(self.BR.classify_with_image_bytes, img_bytes, self.order)
+            async def call():
+                res = tuple(await self._provider_call_to_thread(self.BR.classify_with_image_bytes, img_bytes, self.order))
+                if isinstance(res[0], float) and not str(res[1]).startswith("local:"):
+                    t = asyncio.create_task(self._collect_sample(img_bytes, res[0], att))
+                    self._bg.add(t); t.add_done_callback(self._bg.discard)
+                return res
+            score, via = await verdict_cache.cached(
+                img_bytes, "lpa", self.order, call, atts=[att] if att else None,
+                store_if=lambda r: isinstance(r[0], float))
             if isinstance(score, float): return score, via
         score, via = await self._provider_call_to_thread(self.BR.classify, text, self.order)
         if isinstance(score, float): return score, via
         return None, via
 
+    async def _collect_sample(self, img_bytes: bytes, score: float, att=None):
+        """Confident provider verdicts become training rows for the local model (features only)."""
+        if not lucky_model.collect_enabled():
+            return
+        y = 1 if score >= self.thr else (0 if score <= self._sample_neg_max else None)
+        if y is None:
+            return
+        try:
+            x = await content_cache.hashed(img_bytes, f"lpgfeat:{lucky_model.FEATURE_VERSION}", lucky_model.features, att=att)
+            await asyncio.to_thread(lucky_model.record, x, y, "llm", key=content_cache.digest(img_bytes, att))
+        except Exception as e:
+            _log.debug(f"[lpa] sample not recorded: {e!r}")
+
     def _pick_persona_line(self, author: discord.Member, channel: discord.abc.GuildChannel)->str:
         mp = self._lines or {}
         for _ in range(3):
@@ -205,8 +236,8 @@ class LuckyPullAuto(commands.Cog):
         text=self._collect_text(m)
 
         async with self._sem:
-            img_bytes = await self._first_image_bytes(m) if m.attachments else None
-            prob, via = await self._classify(img_bytes, text)
+            img_bytes, att = await self._first_image_bytes(m) if m.attachments else (None, None)
+            prob, via = await self._classify(img_bytes, text, att)
 
         if prob is None:
             _log.info(f"[lpa] classify: result=(deferred, --) thr={self.thr:.2f} via={via}")
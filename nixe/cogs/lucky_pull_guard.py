@@ -11,11 +11,13 @@ except Exception:
     pick_line = None
 
 try:
-    from nixe.helpers.gemini_bridge import classify_lucky_pull_bytes as classify_bytes
+    from nixe.helpers.gemini_bridge import classify_lucky_pull_bytes as classify_bytes, gemini_models
 except Exception:
     classify_bytes = None
+    gemini_models = None
 
 from nixe.helpers.thread_singleton import get_or_create_thread
+from nixe.helpers import attachment_store, gemini_client, lucky_pregate, verdict_cache
 
 log = logging.getLogger(__name__)
 
@@ -157,13 +159,22 @@ class LuckyPullGuard(commands.Cog):
         except Exception:
             await message.channel.send(text)
 
-    async def _classify(self, img_bytes: bytes):
+    async def _classify(self, img_bytes: bytes, att=None):
         if classify_bytes is None:
             return False, 0.0, "none", "bridge_unavailable"
-        try:
-            return await asyncio.get_event_loop().run_in_executor(
+        if gemini_models is not None and not gemini_client.available(gemini_models()):
+            # provider outage (circuit breaker open): defer instead of paying the full timeout
+            return False, 0.0, "none", "deferred"
+        async def call():
+            return tuple(await asyncio.get_event_loop().run_in_executor(
                 None, lambda: classify_bytes(img_bytes, timeout_ms=self.timeout_ms, providers=self.provider_order)
-            )
+            ))
+        try:
+            # reposts (also re-encoded near-duplicates) reuse the verdict; provider errors (score 0, not ok) are not cached
+            ok, score, provider, reason = await verdict_cache.cached(
+                img_bytes, "lpg", ",".join(self.provider_order), call, atts=[att],
+                store_if=lambda r: bool(r[0]) or float(r[1] or 0.0) > 0.0)
+            return bool(ok), float(score), provider, reason
         except Exception as e:
             log.error("[lpg] classify error: %s", e)
             return False, 0.0, "none", "exception"
@@ -176,11 +187,16 @@ class LuckyPullGuard(commands.Cog):
 
         imgs = [a for a in message.attachments if (a.content_type or "").startswith("image/")]
         if not imgs: return
-        first = imgs[0]
-        try: img_bytes = await first.read()
-        except Exception: return
+        img_bytes = await attachment_store.read(imgs[0], message)
+        if not img_bytes: return
+
+        # tier 0/1 locally; the provider only sees images the heuristics can't rule out
+        gate = await lucky_pregate.gate(img_bytes, att=imgs[0])
+        if not gate.escalate:
+            log.debug("[lpg] pregate benign chan=%s score=%.2f tier=%d", message.channel.id, gate.score, gate.tier)
+            return
 
-        ok, score, provider, reason = await self._classify(img_bytes)
+        ok, score, provider, reason = await self._classify(img_bytes, imgs[0])
         thr = _provider_threshold(provider)
         passed = ok and (score >= thr)
         log.warning("[lpg] chan=%s user=%s score=%.3f thr=%.3f provider=%s pass=%s reason=%s",
@@ -203,13 +219,11 @@ class LuckyPullGuard(commands.Cog):
             target = thread if thread else (self.bot.get_channel(self.redirect_channel_id) or await self.bot.fetch_channel(self.redirect_channel_id))
 
             files = []
-            for a in imgs:
-                try:
-                    if a.size and a.size > 0:
-                        b = await a.read()
-                        files.append(discord.File(io.BytesIO(b), filename=a.filename))
-                except Exception as e:
-                    log.warning("[lpg] read attach fail: %s", e)
+            for a, b in await attachment_store.read_many(message, [a for a in imgs if a.size and a.size > 0]):
+                if not b:
+                    log.warning("[lpg] read attach fail: %s", a.filename)
+                    continue
+                files.append(discord.File(io.BytesIO(b), filename=a.filename))
             desc = "Score **{:.3f}** via `{}`\nReason: {}".format(score, provider, reason)
             content = (message.author.mention if self.mention else None)
             try:
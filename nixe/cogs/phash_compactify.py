@@ -1,9 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+phash_compactify — periodic compaction of the pHash DB board.
+
+Folds near-duplicate pHash entries into radius-tagged representatives
+(``nixe.helpers.phash_compact``) and trims the board to PHASH_DB_MAX_ITEMS,
+then rewrites it through ``phash_board_writer.rewrite`` (same lock and rate
+limit as every other board edit). Matchers widen by the stored radius, so
+coverage is unchanged. Clusters are ranked by ``hit_stats`` (hashes that still
+fire survive eviction); absorbed hashes' counters fold into their representative.
+dHashes are left as they are: only ``phash_r`` is read by the matchers.
+
+Command: ``&phash-compact [dry]`` (manage_messages) — ``dry`` only reports.
+
+ENV:
+- PHASH_COMPACT_INTERVAL_H : hours between automatic runs, default 24 (0 = off)
+- PHASH_COMPACT_MIN_ITEMS  : skip automatic runs below this many pHashes, default 200
+- PHASH_COMPACT_RADIUS     : see phash_compact, default 4
+"""
 from __future__ import annotations
-import logging
-from discord.ext import commands
+import os, asyncio, logging
+from typing import Dict, List, Optional, Tuple
+from discord.ext import commands, tasks
+
+from nixe.helpers import hit_stats, phash_board_writer, phash_compact, phash_db
+
 log = logging.getLogger(__name__)
+
+try:
+    from nixe.config.phash_core import PHASH_DB_MAX_ITEMS
+except Exception:
+    PHASH_DB_MAX_ITEMS = 5000
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+INTERVAL_H = max(0, _env_int("PHASH_COMPACT_INTERVAL_H", 24))
+MIN_ITEMS = max(0, _env_int("PHASH_COMPACT_MIN_ITEMS", 200))
+
+def _fold_stats(folds: list) -> None:
+    """Move absorbed hashes' hit counters to their representative; forget evicted ones."""
+    stats = hit_stats.STATS
+    for res in folds:
+        for rep, members in res["merged"].items():
+            stats.merge(rep, members)
+        stats.drop(res["evicted"])
+    stats.save()
+
+def _compact_lists(cur: Dict[str, List[str]], extra: dict, report: dict,
+                   folds: Optional[list] = None) -> Tuple[Dict[str, List[str]], dict]:
+    extra = dict(extra)
+    extra.pop("dhash_r", None)     # written by older runs; nothing reads it
+    for kind in ("phash",):
+        res = phash_compact.compact(cur.get(kind) or [], phash_db.parse_radii(extra, kind + "_r"),
+                                    max_items=PHASH_DB_MAX_ITEMS, score=hit_stats.STATS.score)
+        if folds is not None:
+            folds.append(res)
+        cur[kind] = res["hashes"]
+        if res["radii"]:
+            extra[kind + "_r"] = res["radii"]
+        else:
+            extra.pop(kind + "_r", None)
+        report[kind] = {k: (len(v) if isinstance(v, list) else v) for k, v in res.items()
+                        if k not in ("hashes", "radii", "merged")}
+    return cur, extra
+
 class PhashCompactify(commands.Cog):
-    """Stub pHash compactify cog (import-safe for smoke)."""
-    def __init__(self, bot: commands.Bot): self.bot = bot
+    """Cluster near-duplicate board hashes and evict the excess."""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._lock = asyncio.Lock()
+        if INTERVAL_H:
+            self.compact_loop.change_interval(hours=INTERVAL_H)
+            self.compact_loop.start()
+
+    def cog_unload(self):
+        try: self.compact_loop.cancel()
+        except Exception: pass
+
+    async def run(self, *, dry: bool = False) -> dict:
+        """Compact the runtime board; returns per-kind before/after/absorbed/evicted counts."""
+        async with self._lock:
+            report: dict = {}
+            if dry:
+                st = await phash_db.get(self.bot, force=True)
+                _compact_lists({"phash": list(phash_db.board_lists()[0])},
+                               {"phash_r": dict(st.radius)}, report)
+                return report
+            folds: list = []
+            ok = await phash_board_writer.rewrite(self.bot, lambda cur, extra: _compact_lists(cur, extra, report, folds))
+            report["written"] = ok
+            if ok:
+                _fold_stats(folds)
+            if report.get("phash"):
+                log.info("[phash-compact] phash %(before)d -> %(after)d (absorbed=%(absorbed)d evicted=%(evicted)d)",
+                         report["phash"])
+            return report
+
+    @tasks.loop(hours=24)
+    async def compact_loop(self):
+        try:
+            st = await phash_db.get(self.bot)
+            if len(st.phash) < MIN_ITEMS:
+                return
+            await self.run()
+        except Exception as e:
+            log.warning("[phash-compact] run failed: %r", e)
+
+    @compact_loop.before_loop
+    async def _before(self):
+        await self.bot.wait_until_ready()
+        await asyncio.sleep(60)
+
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_messages=True)
+    @commands.command(name="phash_compact", aliases=["phash-compact"])
+    async def phash_compact_cmd(self, ctx: commands.Context, mode: str = ""):
+        """Compact the pHash DB board now; ``dry`` only reports what would change."""
+        try:
+            rep = await self.run(dry=(mode.lower() == "dry"))
+        except Exception as e:
+            await ctx.reply(f"Compaction failed: {e!r}", mention_author=False)
+            return
+        lines = []
+        for kind in ("phash",):
+            r = rep.get(kind)
+            if r:
+                lines.append(f"{kind}: {r['before']} -> {r['after']} (absorbed {r['absorbed']}, evicted {r['evicted']})")
+        if "written" in rep and not rep["written"]:
+            lines.append("board not located / edit failed; nothing written")
+        await ctx.reply("\n".join(lines) or "Nothing to compact.", mention_author=False)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(PhashCompactify(bot))
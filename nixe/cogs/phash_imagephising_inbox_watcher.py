@@ -5,6 +5,8 @@ import os, logging, asyncio, discord
 from discord.ext import commands
 from nixe.state_runtime import get_phash_ids
 from nixe.helpers.img_hashing import phash_list_from_bytes, dhash_list_from_bytes
+from nixe.helpers import attachment_store, hash_pool
+from nixe.helpers.image_context import derive_many
 
 log = logging.getLogger(__name__)
 
@@ -88,21 +90,27 @@ class PhashImagephisingWatcher(commands.Cog):
         uniq_p, uniq_d = set(), set()
         cur_p, cur_d = [], []
         for att in attchs:
-            try:
-                raw = await att.read()
-            except Exception:
-                raw = b""
+            raw = await attachment_store.read(att, message)
             if not raw:
                 continue
-            for h in phash_list_from_bytes(raw, max_frames=6):
+            try:
+                # pHash + dHash from one pool job / one decode
+                (p_ok, hs), (d_ok, ds) = await hash_pool.submit(derive_many, raw, [
+                    (phash_list_from_bytes, (), {"max_frames": 6}),
+                    (dhash_list_from_bytes, (), {"max_frames": 6}),
+                ])
+            except Exception as e:
+                log.debug("[phash-inbox] hash failed: %r", e)
+                continue
+            if not p_ok:
+                log.debug("[phash-inbox] hash failed: %s", hs)
+                continue
+            for h in hs:
                 if h not in uniq_p:
                     uniq_p.add(h); cur_p.append(h)
-            try:
-                for h in dhash_list_from_bytes(raw, max_frames=6):
-                    if h not in uniq_d:
-                        uniq_d.add(h); cur_d.append(h)
-            except Exception:
-                pass
+            for h in (ds if d_ok else []):
+                if h not in uniq_d:
+                    uniq_d.add(h); cur_d.append(h)
         tid, mid = get_phash_ids()
         runtime_msg = int(mid or DEST_MSG_ID or 0)
         if (cur_p or cur_d) and runtime_msg:
@@ -9,6 +9,9 @@ from discord.ext import commands
 from ..config.self_learning_cfg import LOG_CHANNEL_ID, PHASH_DB_MARKER, PHASH_HAMMING_MAX, PHASH_INBOX_THREAD
 from .ban_embed import build_ban_embed
 from ..helpers.banlog import get_ban_log_channel
+from ..helpers import attachment_store, content_cache, hit_stats, img_hashing
+from ..helpers.phash_index import PhashIndex, TileIndex, to_hex
+from ..helpers import phash_db
 
 log = logging.getLogger(__name__)
 
@@ -17,70 +20,64 @@ try:
 except Exception:
     _PIL_Image = None
 
-try:
-    import imagehash as _imagehash
-except Exception:
-    _imagehash = None
-
 HEX16 = re.compile(r"^[0-9a-f]{16}$", re.I)
+# Tile fallback (tphash) for cropped / padded / bordered reposts
+TILE_GRID = int(os.getenv("TILE_GRID", "3"))
+TILE_HAMMING_MAX = int(os.getenv("TILE_HAMMING_MAX", "8"))
+TILE_MIN_VOTES = int(os.getenv("TILE_MIN_VOTES", "3"))
+# Opt-in: also try the 7 flipped/rotated pHashes of the upload (same DCT, no re-decode)
+PHASH_DIHEDRAL = os.getenv("PHASH_DIHEDRAL", "0") == "1"
 
 def _inbox_names() -> Set[str]:
     return {n.strip().lower() for n in PHASH_INBOX_THREAD.split(",") if n.strip()}
 
-def _hamm(a: str, b: str) -> int:
-    return sum(1 for x, y in zip(a, b) if x != y)
-
-def _compute_phash(raw: bytes) -> Optional[str]:
-    if _PIL_Image is None or _imagehash is None:
-        return None
+async def _compute_hashes(raw: bytes, att=None, tiles: bool = False) -> dict:
+    """``phash:1`` (+ tile query, + dihedral pHashes when opted in) from one pool job / one decode."""
+    if _PIL_Image is None or img_hashing.np_hash is None or not raw:
+        return {}
+    jobs = {"phash:1": (img_hashing.phash_list_from_bytes, (), {"max_frames": 1})}
+    if tiles:
+        jobs[f"tiles:{TILE_GRID}"] = (img_hashing.tile_query_from_bytes, (TILE_GRID,), {"max_frames": 1})
+    if PHASH_DIHEDRAL:
+        jobs["phash:d8"] = (img_hashing.phash_dihedral_list_from_bytes, (), {})
     try:
-        im = _PIL_Image.open(BytesIO(raw)).convert("RGB")
-        return str(_imagehash.phash(im))
+        return await content_cache.hashed_many(raw, jobs, att=att)
     except Exception:
-        return None
+        return {}
 
 def _extract_db_hashes_from_content(content: str) -> List[str]:
-    m = re.search(r"```json\\s*(\\{.*?\\})\\s*```", content or "", re.I | re.S)
-    if not m:
-        return []
-    try:
-        obj = json.loads(m.group(1))
-        arr = obj.get("phash") or obj.get("items") or []
-        out = []
-        for it in arr:
-            if isinstance(it, str) and HEX16.match(it): out.append(it)
-            elif isinstance(it, dict):
-                h = it.get("hash")
-                if isinstance(h, str) and HEX16.match(h): out.append(h)
-        return out
-    except Exception:
-        return []
+    return phash_db.parse_board(content)[0]
 
 class NixePhashMatchGuard(commands.Cog):
     """Default: only Test Ban embed on match (no autoban) to avoid false positives."""
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._index = PhashIndex()
+        self._index_ver = 0
+        self._prio_gen = -1
+        self._tiles = TileIndex()
+        self._tiles_src: tuple = ()
 
     def _is_inbox(self, thread: discord.Thread) -> bool:
         return thread and isinstance(thread, discord.Thread) and thread.name.lower() in _inbox_names()
 
-    async def _load_db_hashes(self, guild: discord.Guild) -> List[str]:
-        # Find the marker JSON message in parent log channel
-        ch = None
-        if LOG_CHANNEL_ID:
-            ch = guild.get_channel(LOG_CHANNEL_ID)
-        if not isinstance(ch, discord.TextChannel):
-            for c in guild.text_channels:
-                if c.name.lower() in {'nixe-only'}:
-                    ch = c; break
-        if not isinstance(ch, discord.TextChannel):
-            return []
-        async for m in ch.history(limit=100):
-            if "```json" in (m.content or ""):
-                hashes = _extract_db_hashes_from_content(m.content or "")
-                if hashes:
-                    return hashes
-        return []
+    async def _db_index(self, guild: discord.Guild) -> PhashIndex:
+        # Cached board (refreshed on edit/TTL by phash_db); index follows its version
+        await phash_db.get(self.bot, guild)
+        ver = phash_db.sync_index(self._index, self._index_ver)
+        if ver != self._index_ver or self._prio_gen != hit_stats.STATS.generation:
+            # hot hashes first in the linear scan; re-sorted only when hits or the board moved
+            self._prio_gen = hit_stats.STATS.generation
+            self._index.set_priority(hit_stats.STATS.score)
+        self._index_ver = ver
+        return self._index
+
+    def _tile_index(self) -> TileIndex:
+        # tphash changes rarely; rebuild wholesale when the board's list differs
+        if phash_db.S.tphash != self._tiles_src:
+            self._tiles_src = phash_db.S.tphash
+            self._tiles = TileIndex(self._tiles_src)
+        return self._tiles
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -97,29 +94,44 @@ class NixePhashMatchGuard(commands.Cog):
         if not imgs:
             return
 
-        h = None
+        index = await self._db_index(message.guild)
+        tiles = self._tile_index()
+        if not len(index) and not len(tiles):
+            return
+
         try:
-            raw = await imgs[0].read()
-            h = _compute_phash(raw)
+            raw = await attachment_store.read(imgs[0], message)
+            hv = await _compute_hashes(raw, imgs[0], tiles=bool(len(tiles)))
         except Exception:
             return
+        h = (hv.get("phash:1") or [None])[0]
         if not (h and HEX16.match(h)):
             return
 
-        db_hashes = await self._load_db_hashes(message.guild)
-        if not db_hashes:
-            return
-
-        matched = False
-        if PHASH_HAMMING_MAX <= 0:
-            matched = h in db_hashes
-        else:
-            for dh in db_hashes:
-                if len(dh) == len(h) and sum(1 for x,y in zip(h,dh) if x!=y) <= PHASH_HAMMING_MAX:
-                    matched = True; break
-
+        # PHASH_HAMMING_MAX is a bit distance (0 = exact match)
+        # compacted representatives reach further by their stored cluster radius
+        R = max(0, PHASH_HAMMING_MAX)
+        matched = None
+        if len(index):
+            qs = [h]
+            if PHASH_DIHEDRAL:
+                qs += [x for x in hv.get("phash:d8") or [] if x != h]
+            for q in qs:
+                matched = next((to_hex(v) for v, d in index.query(q, R + phash_db.S.max_radius)
+                                if phash_db.match_radius(to_hex(v), d, R)), None)
+                if matched:
+                    if q != h:
+                        log.info("[phash-match] flipped/rotated repost %s -> %s", h, matched)
+                    break
+        if not matched and len(tiles):
+            q = hv.get(f"tiles:{TILE_GRID}") or []
+            hit = tiles.match(q, TILE_HAMMING_MAX, TILE_MIN_VOTES) if q else None
+            if hit:
+                log.info("[phash-match] tile match votes=%d token=%s", hit[1], hit[0][:24])
+                matched = hit[0]
         if not matched:
             return
+        hit_stats.STATS.hit(matched)
 
         logch = get_ban_log_channel(message.guild)
         if not logch:
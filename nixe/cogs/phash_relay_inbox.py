@@ -4,6 +4,7 @@ import os, io, asyncio, logging
 
 import discord
 from discord.ext import commands
+from nixe.helpers import attachment_store
 
 log = logging.getLogger("nixe.cogs.phash_relay_inbox")
 
@@ -36,7 +37,9 @@ class PhashRelayInbox(commands.Cog):
             inbox = message.guild.get_channel(INBOX_ID) or await self.bot.fetch_channel(INBOX_ID)
             for att in message.attachments:
                 if _is_image(att):
-                    data = await att.read()
+                    data = await attachment_store.read(att, message)
+                    if not data:
+                        continue
                     file = discord.File(io.BytesIO(data), filename=att.filename)
                     meta = f"[relay from imgphish {IMAGEPHISH_THREAD_ID} msg {message.id}] {att.url}"
                     await inbox.send(content=meta, file=file)
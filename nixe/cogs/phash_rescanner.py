@@ -7,8 +7,9 @@ from typing import Set, Optional
 from discord.ext import commands
 from nixe.state_runtime import get_phash_ids
 
-from nixe.helpers import img_hashing
-from nixe.helpers.phash_board import get_pinned_db_message, edit_pinned_db
+from nixe.helpers import img_hashing, attachment_store, hash_pool
+from nixe.helpers.phash_board import get_pinned_db_message
+from nixe.helpers import phash_db, phash_board_writer, phash_backfill
 
 log = logging.getLogger(__name__)
 
@@ -66,13 +67,11 @@ class PhashRescanner(commands.Cog):
 
 
     async def _resolve_board_tokens(self) -> Set[str]:
-        msg = await get_pinned_db_message(self.bot)
-        existing: Set[str] = set()
-        if msg and (msg.content or ""):
-            existing |= _extract(msg.content)
-        return existing
+        # served from the cached board (refreshed on edit/TTL), no per-post fetch
+        st = await phash_db.get(self.bot)
+        return set(st.phash)
 
-    async def _run_backfill(self, limit: Optional[int]):
+    async def _run_backfill(self, limit: Optional[int], resume: bool = True):
         # resolve source thread
         src: Optional[discord.Thread] = None
         try:
@@ -100,30 +99,26 @@ class PhashRescanner(commands.Cog):
             return
 
         existing = await self._resolve_board_tokens()
-
-        new_tokens: Set[str] = set()
-        async for m in src.history(limit=limit):
-            for att in getattr(m, "attachments", ()) or ():
-                nm = (att.filename or "").lower()
-                if not any(nm.endswith(ext) for ext in IMAGE_EXTS): 
-                    continue
-                try:
-                    raw = await att.read()
-                except Exception:
-                    raw = b""
-                if not raw:
-                    continue
-                for h in img_hashing.phash_list_from_bytes(raw, max_frames=MAX_FRAMES):
-                    if h not in existing:
-                        new_tokens.add(h)
-
-        if not new_tokens:
+        found: Set[str] = set()
+
+        async def handle(m, att, raw) -> int:
+            hs = await hash_pool.submit(img_hashing.phash_list_from_bytes, raw, max_frames=MAX_FRAMES)
+            found.update(h for h in hs if h not in existing)
+            return len(hs)
+
+        async def commit() -> bool:
+            # cursor only advances once the harvested hashes are on the board
+            if not found:
+                return True
+            batch = sorted(found); found.clear(); existing.update(batch)
+            added, totals = phash_board_writer.queue(self.bot, phash=batch)
+            log.info("[phash-rescanner] backfill merge: +%d queued (board total %d)", added, totals["phash"])
+            return await phash_board_writer.flush(force=True)
+
+        st = await phash_backfill.Backfill(f"rescanner:{src.id}").run(src, handle, commit, limit=limit, resume=resume)
+        if not st["hashes"]:
             log.info("[phash-rescanner] backfill: nothing new")
-            return
-
-        merged = existing | new_tokens
-        ok = await edit_pinned_db(self.bot, merged)
-        log.info("[phash-rescanner] backfill merge: +%d -> %s", len(new_tokens), "OK" if ok else "SKIPPED")
+        return st
 
     # permissions decorator (toggleable)
     if REQ_PERM:
@@ -134,7 +129,12 @@ class PhashRescanner(commands.Cog):
     @commands.guild_only()
     @commands.command(name="phash_rescan", aliases=["phash-rescan","phashrescan","rescanphash","pr"])
     @dec_perms
-    async def phash_rescan_cmd(self, ctx: commands.Context, limit: int = 0):
+    async def phash_rescan_cmd(self, ctx: commands.Context, limit: int = 0, mode: str = ""):
+        """Rescan the source thread; resumes after the last processed message unless ``mode`` is ``full``.
+
+        ``limit`` caps the messages read: the next ``limit`` after the saved
+        cursor, or the newest ``limit`` when there is no cursor / with ``full``.
+        """
         # quick reaction feedback even if send fails
         try:
             await ctx.message.add_reaction("🔄")
@@ -152,7 +152,7 @@ class PhashRescanner(commands.Cog):
         except Exception:
             pass
         try:
-            await self._run_backfill(limit or None)
+            st = await self._run_backfill(limit or None, resume=(mode.lower() != "full"))
         except Exception as e:
             log.exception("[phash-rescanner] rescan failed: %s", e)
             try:
@@ -161,7 +161,10 @@ class PhashRescanner(commands.Cog):
                 pass
             return
         try:
-            await ctx.reply("Rescan done.", mention_author=False)
+            if st:
+                await ctx.reply("Rescan done: {messages} msgs / {attachments} attachments, {hashes} hashes in {elapsed}s ({rate} att/s).".format(**st), mention_author=False)
+            else:
+                await ctx.reply("Rescan done.", mention_author=False)
         except Exception:
             pass
         try:
@@ -200,25 +203,27 @@ class PhashRescanner(commands.Cog):
             nm = (att.filename or "").lower()
             if not any(nm.endswith(ext) for ext in IMAGE_EXTS):
                 continue
-            try:
-                raw = await att.read()
-            except Exception:
-                raw = b""
+            raw = await attachment_store.read(att, message)
             if not raw:
                 continue
-            for h in img_hashing.phash_list_from_bytes(raw, max_frames=MAX_FRAMES):
+            try:
+                hs = await hash_pool.submit(img_hashing.phash_list_from_bytes, raw, max_frames=MAX_FRAMES)
+            except Exception as e:
+                log.warning("[phash-rescanner] hash failed: %r", e)
+                continue
+            for h in hs:
                 new_tokens.add(h)
 
         if not new_tokens:
             return
 
         existing = await self._resolve_board_tokens()
-        if not existing and not (await get_pinned_db_message(self.bot)):
+        if not existing and not phash_db.S.message_id:
             # no board yet; skip
             return
 
-        merged = existing | new_tokens
-        await edit_pinned_db(self.bot, merged)
+        # coalesced with other producers; at most one board edit per interval
+        phash_board_writer.queue(self.bot, phash=sorted(new_tokens - existing))
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(PhashRescanner(bot))
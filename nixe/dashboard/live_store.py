@@ -3,56 +3,46 @@ from __future__ import annotations
 """
 live_store.py
 - Persistent pHash store for phishing images
-- In-memory cache with safe file-backed JSON: data/phish/phash.json
+- Binary snapshot + append-only journal (nixe.helpers.phash_store): data/phish/phash.u64
+  (the old data/phish/phash.json list is imported once on first use)
 - Optional bot notify hook if present
 """
-import os, json, threading
+import threading
 from pathlib import Path
 
-_lock = threading.RLock()
-_cache = None
-_store_path = Path("data/phish/phash.json")  # shared between web & bot
+from nixe.helpers.phash_store import PhashStore
 
-def _ensure_dir():
-    _store_path.parent.mkdir(parents=True, exist_ok=True)
+_lock = threading.RLock()
+_store_path = Path("data/phish/phash.u64")  # shared between web & bot
+_legacy_path = Path("data/phish/phash.json")
+_store = PhashStore(_store_path, legacy_json=_legacy_path)
 
-def _load() -> list[str]:
-    global _cache
+def get_phash() -> list[str]:
     with _lock:
-        if _cache is not None:
-            return list(_cache)
         try:
-            if _store_path.exists():
-                data = json.loads(_store_path.read_text("utf-8"))
-                _cache = [str(x) for x in (data.get("phash") if isinstance(data, dict) else data) or []]
-            else:
-                _cache = []
+            return _store.hexes()
         except Exception:
-            _cache = []
-        return list(_cache)
+            return []
 
-def _save(lst: list[str]) -> None:
-    with _lock:
-        _ensure_dir()
-        try:
-            _store_path.write_text(json.dumps({"phash": lst}, ensure_ascii=False, indent=2), encoding="utf-8")
-        except Exception:
-            pass
-
-def get_phash() -> list[str]:
-    return _load()
+def has_phash(v: str) -> bool:
+    try:
+        return str(v).strip() in _store
+    except Exception:
+        return False
 
 def add_phash(v: str) -> list[str]:
     v = str(v).strip()
     if not v:
         return get_phash()
     with _lock:
-        cur = _load()
-        if v not in cur:
-            cur.append(v)
-            _save(cur)
+        try:
+            added = _store.add(v)
+        except Exception:
+            added = False
+        cur = get_phash()
+        if added:
             _notify_bot_phash_updated(cur)
-        return list(cur)
+        return cur
 
 def _notify_bot_phash_updated(cur: list[str]) -> None:
     """Best-effort notify running bot process (optional)."""
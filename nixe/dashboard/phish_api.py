@@ -2,6 +2,8 @@ import os
 import os, json, time
 from flask import Blueprint, request, jsonify
 from PIL import Image
+from nixe.helpers.phash_store import PhashStore
+from nixe.helpers.image_context import DECODE_PX, open_image
 # v20: try import imagehash; fallback to Pillow-only aHash to avoid ImportError during smoketests
 try:
     import imagehash as _imagehash_mod  # pip install ImageHash
@@ -23,31 +25,59 @@ except Exception:
 
 
 DATA_DIR = os.environ.get("SATPAMBOT_DATA_DIR", "data")
-PHASH_JSON = os.path.join(DATA_DIR, "phish_phash.json")
+PHASH_JSON = os.path.join(DATA_DIR, "phish_phash.json")      # legacy list, imported once
+PHASH_BIN = os.path.join(DATA_DIR, "phish_phash.u64")
+PHASH_META = os.path.join(DATA_DIR, "phish_phash.meta.jsonl")  # append-only {hash, filename, ts}
 HASH_TXT = os.environ.get("SATPAMBOT_PHASH_TXT", "blacklist_image_hashes.txt")
 
 phish_api = Blueprint("phish_api", __name__)
+_store = PhashStore(PHASH_BIN, legacy_json=PHASH_JSON)
 
 def _ensure_files():
     os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(PHASH_JSON):
-        with open(PHASH_JSON, "w", encoding="utf-8") as f:
-            json.dump({"hashes": []}, f, ensure_ascii=False)
+    if not os.path.exists(PHASH_META):
+        _migrate()
     if not os.path.exists(HASH_TXT):
         open(HASH_TXT, "a", encoding="utf-8").close()
 
+def _migrate():
+    # first run on the binary store: carry filename/ts of legacy JSON items over
+    # to the metadata journal and resync the plain-text export once; after this
+    # both files are append-only
+    items = []
+    try:
+        with open(PHASH_JSON, "r", encoding="utf-8") as f:
+            items = [h for h in (json.load(f).get("hashes") or []) if isinstance(h, dict)]
+    except Exception:
+        pass
+    with open(PHASH_META, "a", encoding="utf-8") as f:
+        for it in items:
+            f.write(json.dumps(it, ensure_ascii=False) + "\n")
+    try:
+        with open(HASH_TXT, "w", encoding="utf-8") as out:
+            for h in _store.hexes():
+                out.write(h + "\n")
+    except Exception:
+        pass
+
+def _load_meta():
+    meta = {}
+    try:
+        with open(PHASH_META, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    it = json.loads(line)
+                    meta.setdefault(it["hash"], it)
+                except Exception:
+                    continue
+    except FileNotFoundError:
+        pass
+    return meta
+
 def _load():
     _ensure_files()
-    with open(PHASH_JSON, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            data = {"hashes": []}
-    return data
-
-def _save(data):
-    with open(PHASH_JSON, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    meta = _load_meta()
+    return {"hashes": [meta.get(h) or h for h in _store.hexes()]}
 
 @phish_api.route("/dashboard/api/phash/list", methods=["GET"])
 def phash_list():
@@ -65,35 +95,34 @@ def phash_upload():
     if not files:
         return jsonify({"error": "no files"}), 400
 
-    data = _load()
-    known = set([h["hash"] if isinstance(h, dict) else h for h in data.get("hashes", [])])
     added, skipped = [], []
 
     for f in files:
         try:
-            img = Image.open(f.stream).convert("RGB")
+            # pixel cap before decode; hash from a reduced (draft/reduce) decode
+            img = open_image(f.stream, DECODE_PX).convert("RGB")
             ph = str(compute_hash(img))
-            if ph in known:
+            if not _store.add(ph):
                 skipped.append(ph)
                 continue
             item = {"hash": ph, "filename": f.filename, "ts": int(time.time())}
-            data.setdefault("hashes", []).append(item)
-            known.add(ph)
             added.append(item)
         except Exception:
             skipped.append(f"{f.filename or 'file'}:error")
             continue
 
-    _save(data)
-
-    try:
-        with open(HASH_TXT, "w", encoding="utf-8") as out:
-            for it in data["hashes"]:
-                out.write((it["hash"] if isinstance(it, dict) else str(it)) + "\n")
-    except Exception:
-        pass
+    if added:
+        try:
+            with open(PHASH_META, "a", encoding="utf-8") as out:
+                for it in added:
+                    out.write(json.dumps(it, ensure_ascii=False) + "\n")
+            with open(HASH_TXT, "a", encoding="utf-8") as out:
+                for it in added:
+                    out.write(it["hash"] + "\n")
+        except Exception:
+            pass
 
-    return jsonify({"added": added, "skipped": skipped, "total": len(data.get("hashes", []))})
+    return jsonify({"added": added, "skipped": skipped, "total": len(_store)})
 
 def register_phish_routes(app):
     app.register_blueprint(phish_api)
\ No newline at end of file
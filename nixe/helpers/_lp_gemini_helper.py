@@ -1,7 +1,8 @@
 
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import os, base64, json, logging, aiohttp
+import os, base64, json, logging
+from nixe.helpers import attachment_store, gemini_client, verdict_cache
 
 log = logging.getLogger(__name__)
 
@@ -26,41 +27,22 @@ def _b64(raw: bytes, limit: int) -> str:
 async def _call(model: str, parts: list) -> dict | None:
     if not model:
         return None
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
-    body = {
-        "contents": [{"role":"user","parts": parts}],
-        "generationConfig": {"responseMimeType":"application/json"}
-    }
+    # pooled keep-alive session shared with every other Gemini caller
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=GEMINI_TIMEOUT)) as sess:
-            async with sess.post(url, json=body) as resp:
-                if resp.status != 200:
-                    log.warning("gemini http %s on %s", resp.status, model)
-                    return None
-                return await resp.json()
-    except Exception as e:
+        return await gemini_client.generate(model, parts, generation_config={"responseMimeType": "application/json"},
+                                            timeout=GEMINI_TIMEOUT, key=GEMINI_API_KEY)
+    except gemini_client.GeminiError as e:
+        if e.status:
+            log.warning("gemini http %s on %s", e.status, model)
+            return None
         log.warning("gemini error on %s: %r", model, e)
         return None
-
-async def gemini_judge_images(attachments, model: str | None = None):
-    if not GEMINI_API_KEY:
-        return None
-    parts = [{"text": VISION_PROMPT}]
-    added = 0
-    for a in attachments:
-        try:
-            raw = await a.read()
-        except Exception:
-            raw = None
-        if not raw:
-            continue
-        parts.append({"inline_data":{"mime_type":"image/png","data": _b64(raw, GEMINI_MAX_BYTES)}})
-        added += 1
-        if added >= 2: break
-    if added == 0:
+    except Exception as e:
+        log.warning("gemini error on %s: %r", model, e)
         return None
 
-    for mdl in [model or DEFAULT_GEMINI_MODEL, GEMINI_FALLBACK, GEMINI_FALLBACK2]:
+async def _judge(parts: list, models: list):
+    for mdl in models:
         data = await _call(mdl, parts)
         if not data: 
             continue
@@ -79,3 +61,25 @@ async def gemini_judge_images(attachments, model: str | None = None):
             except Exception:
                 pass
     return None
+
+async def gemini_judge_images(attachments, model: str | None = None):
+    if not GEMINI_API_KEY:
+        return None
+    parts = [{"text": VISION_PROMPT}]
+    raws, atts = [], []
+    for a in attachments:
+        raw = await attachment_store.read(a)
+        if not raw:
+            continue
+        parts.append({"inline_data":{"mime_type":"image/png","data": _b64(raw, GEMINI_MAX_BYTES)}})
+        raws.append(raw); atts.append(a)
+        if len(raws) >= 2: break
+    if not raws:
+        return None
+
+    models = [model or DEFAULT_GEMINI_MODEL, GEMINI_FALLBACK, GEMINI_FALLBACK2]
+    async def call():
+        return await _judge(parts, models)
+    # near-duplicate reposts reuse the verdict; None (all models failed) is not cached
+    res = await verdict_cache.cached(raws, "lp_judge", models[0], call, atts=atts, store_if=lambda r: r is not None)
+    return tuple(res) if res else None
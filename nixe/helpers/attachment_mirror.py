@@ -1,5 +1,6 @@
 # nixe/helpers/attachment_mirror.py — silent + resilient
 import io, os, discord
+from nixe.helpers import attachment_store
 def _env_int(key: str, default: int = 0) -> int:
     try: return int(os.getenv(key, str(default)))
     except Exception: return default
@@ -19,8 +20,8 @@ async def mirror_attachments_for_log(bot: discord.Client, message: discord.Messa
             try: await dest.join()
             except Exception: pass
         files=[]
-        for att in message.attachments:
-            data=await att.read()
+        for att, data in await attachment_store.read_many(message):
+            if not data: continue
             files.append(discord.File(io.BytesIO(data), filename=att.filename))
         if not files: return None
         return await dest.send(content=f"[mirror:{reason}] id={message.id}", files=files)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+attachment_store — fetch-once attachment bytes shared by every on_message guard.
+
+discord.py dispatches on_message to every cog at once, and each guard used to
+call ``Attachment.read()`` on its own. This store keys downloads by message id +
+attachment id so the first caller starts the download and everyone else awaits
+the same future. Downloads are bounded by a semaphore; entries are evicted after
+``ATTACH_STORE_TTL_SEC`` (the message has been handled by then) or when the
+store holds more than ``ATTACH_STORE_MAX_MESSAGES`` messages.
+
+ENV:
+- ATTACH_FETCH_CONCURRENCY   : parallel downloads, default 4
+- ATTACH_STORE_TTL_SEC       : seconds an entry stays cached, default 30
+- ATTACH_STORE_MAX_MESSAGES  : messages kept at once, default 64
+"""
+from __future__ import annotations
+import os, asyncio, logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+MAX_CONCURRENCY = max(1, _env_int("ATTACH_FETCH_CONCURRENCY", 4))
+TTL_SEC = max(1, _env_int("ATTACH_STORE_TTL_SEC", 30))
+MAX_MESSAGES = max(1, _env_int("ATTACH_STORE_MAX_MESSAGES", 64))
+
+# message id -> {attachment id -> Future[bytes]}
+_entries: "OrderedDict[int, Dict[int, asyncio.Future]]" = OrderedDict()
+_sem: Optional[asyncio.Semaphore] = None
+_sem_loop = None
+
+def _get_sem() -> asyncio.Semaphore:
+    global _sem, _sem_loop
+    loop = asyncio.get_running_loop()
+    if _sem is None or _sem_loop is not loop:
+        _sem = asyncio.Semaphore(MAX_CONCURRENCY); _sem_loop = loop
+    return _sem
+
+async def _download(att) -> bytes:
+    async with _get_sem():
+        try:
+            data = await att.read()
+        except Exception as e:
+            log.debug("[attach-store] read failed id=%s: %r", getattr(att, "id", None), e)
+            return b""
+    return bytes(data or b"")
+
+def _bucket(message_id: int) -> Dict[int, asyncio.Future]:
+    b = _entries.get(message_id)
+    if b is not None:
+        _entries.move_to_end(message_id)
+        return b
+    b = {}
+    _entries[message_id] = b
+    while len(_entries) > MAX_MESSAGES:
+        _entries.popitem(last=False)
+    try:
+        asyncio.get_running_loop().call_later(TTL_SEC, evict, message_id)
+    except RuntimeError:
+        pass
+    return b
+
+def _key(att, message) -> int:
+    mid = getattr(message, "id", None)
+    return int(mid) if mid else int(getattr(att, "id", 0) or 0)
+
+async def read(att, message=None) -> bytes:
+    """Return the attachment bytes, downloading at most once per message.
+
+    Returns ``b""`` when the download fails, so callers can ``if not raw: continue``.
+    The same ``bytes`` object is handed to every cog asking for this attachment.
+    """
+    aid = getattr(att, "id", None)
+    if aid is None:
+        try: return bytes(await att.read() or b"")
+        except Exception: return b""
+    bucket = _bucket(_key(att, message))
+    fut = bucket.get(int(aid))
+    if fut is None:
+        fut = asyncio.ensure_future(_download(att))
+        bucket[int(aid)] = fut
+    try:
+        return await asyncio.shield(fut)
+    except Exception:
+        return b""
+
+async def read_many(message, attachments: Optional[Iterable] = None) -> List[Tuple[object, bytes]]:
+    """Download several attachments of one message concurrently (bounded).
+
+    Keeps the input order; failed downloads come back as ``b""``.
+    """
+    atts = list(attachments if attachments is not None else (getattr(message, "attachments", None) or ()))
+    if not atts:
+        return []
+    datas = await asyncio.gather(*(read(a, message) for a in atts))
+    return list(zip(atts, datas))
+
+def evict(message_id: int) -> None:
+    """Drop cached bytes for a message. In-flight downloads still finish for their awaiters."""
+    _entries.pop(int(message_id or 0), None)
+
+def stats() -> dict:
+    return {
+        "messages": len(_entries),
+        "attachments": sum(len(b) for b in _entries.values()),
+        "concurrency": MAX_CONCURRENCY,
+        "ttl_sec": TTL_SEC,
+    }
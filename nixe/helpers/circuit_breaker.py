@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+circuit_breaker — per provider/model circuit breaker for LLM calls.
+
+While Gemini is down every guarded message used to pay the full provider
+timeout (15-20 s in lucky_pull_auto / lucky_pull_guard). One ``Breaker`` per key (same keys as ``provider_limiter``,
+``"gemini:<model>"``) tracks outcomes over a sliding window:
+
+- closed    : calls pass; when the window holds >= BREAKER_MIN_CALLS outcomes and
+              the error rate reaches BREAKER_ERROR_RATE the breaker opens.
+- open      : calls fail immediately (``CircuitOpen``) for BREAKER_OPEN_SEC.
+- half-open : after that, BREAKER_HALF_OPEN_PROBES calls may probe; a success
+              closes the breaker, a failure re-opens it with the open time
+              doubled (up to BREAKER_OPEN_MAX_SEC).
+
+Only provider failures count (timeouts, transport errors, 5xx). A 429 belongs
+to ``provider_limiter``, other 4xx are caller errors, and a call cancelled by
+``hedge`` says nothing about the provider; neither does a timeout whose send
+budget was under the model's p50 latency (the call spent its deadline queueing)
+or a transport error on a session that was closed under the call. Those are
+``record(None)`` and only release a half-open probe. ``gemini_client`` wraps every request; guards check
+``available(key)`` first and defer instead of queueing work that would fail.
+
+ENV:
+- BREAKER_ENABLE           : 0 = never open, default 1
+- BREAKER_WINDOW_SEC       : outcome window, default 60
+- BREAKER_MIN_CALLS        : outcomes needed before the breaker may open, default 4
+- BREAKER_ERROR_RATE       : error rate that opens it, default 0.5
+- BREAKER_OPEN_SEC         : first open period, default 30
+- BREAKER_OPEN_MAX_SEC     : cap of the doubled open period, default 300
+- BREAKER_HALF_OPEN_PROBES : concurrent probe calls while half-open, default 1
+"""
+from __future__ import annotations
+import os, time, logging
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+def _env_float(key: str, default: float) -> float:
+    try: return float(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitOpen(RuntimeError):
+    """The provider/model is failing; the call was refused without trying it."""
+
+def enabled() -> bool:
+    return os.getenv("BREAKER_ENABLE", "1") == "1"
+
+class Breaker:
+    """Sliding-window error rate -> closed / open / half-open for one key."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.window = max(1.0, _env_float("BREAKER_WINDOW_SEC", 60))
+        self.min_calls = max(1, int(_env_float("BREAKER_MIN_CALLS", 4)))
+        self.error_rate = min(1.0, max(0.01, _env_float("BREAKER_ERROR_RATE", 0.5)))
+        self.open_sec = max(1.0, _env_float("BREAKER_OPEN_SEC", 30))
+        self.open_max = max(self.open_sec, _env_float("BREAKER_OPEN_MAX_SEC", 300))
+        self.probes = max(1, int(_env_float("BREAKER_HALF_OPEN_PROBES", 1)))
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._open_until = 0.0
+        self._open_for = self.open_sec
+        self._probing = 0
+        self.counts = {"opened": 0, "rejected": 0, "failures": 0, "successes": 0}
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _open(self, now: float, why: str) -> None:
+        self.state = OPEN
+        self._open_until = now + self._open_for
+        self._probing = 0
+        self.counts["opened"] += 1
+        log.warning("[llm-breaker] %s open for %.0fs (%s)", self.key, self._open_for, why)
+
+    def _tick(self, now: float) -> None:
+        if self.state == OPEN and now >= self._open_until:
+            self.state = HALF_OPEN
+            self._probing = 0
+            log.info("[llm-breaker] %s half-open, probing", self.key)
+
+    def available(self) -> bool:
+        """Would a call be let through right now? (does not take a probe slot)"""
+        if not enabled():
+            return True
+        self._tick(time.monotonic())
+        return self.state == CLOSED or (self.state == HALF_OPEN and self._probing < self.probes)
+
+    def allow(self) -> bool:
+        """Admit one call; in half-open this takes a probe slot, returned by ``record``."""
+        if not enabled():
+            return True
+        self._tick(time.monotonic())
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self._probing < self.probes:
+            self._probing += 1
+            return True
+        self.counts["rejected"] += 1
+        return False
+
+    def record(self, ok: Optional[bool]) -> None:
+        """Outcome of an admitted call: True = success, False = provider failure, None = says nothing."""
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._probing = max(0, self._probing - 1)
+            if ok is True:
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._open_for = self.open_sec
+                log.warning("[llm-breaker] %s closed (probe ok)", self.key)
+            elif ok is False:
+                self._open_for = min(self.open_max, self._open_for * 2)
+                self._open(now, "probe failed")
+        if ok is None:
+            return
+        self.counts["successes" if ok else "failures"] += 1
+        if self.state != CLOSED:
+            return
+        self._outcomes.append((now, bool(ok)))
+        self._trim(now)
+        n = len(self._outcomes)
+        errs = sum(1 for _, good in self._outcomes if not good)
+        if n >= self.min_calls and errs / n >= self.error_rate:
+            self._open(now, f"{errs}/{n} failed in {self.window:.0f}s")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        self._tick(now)
+        self._trim(now)
+        n = len(self._outcomes)
+        errs = sum(1 for _, good in self._outcomes if not good)
+        return dict(self.counts, state=self.state, window_calls=n,
+                    error_rate=round(errs / n, 3) if n else 0.0,
+                    open_for=round(max(0.0, self._open_until - now), 1) if self.state == OPEN else 0.0)
+
+_breakers: Dict[str, Breaker] = {}
+
+def get(key: str) -> Breaker:
+    br = _breakers.get(key)
+    if br is None:
+        br = _breakers[key] = Breaker(key)
+    return br
+
+def available(keys: Iterable[str]) -> bool:
+    """True if at least one of ``keys`` would accept a call now."""
+    return any(get(k).available() for k in keys)
+
+def stats() -> dict:
+    return {k: v.stats() for k, v in _breakers.items()}
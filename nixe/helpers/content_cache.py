@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+content_cache — content-addressed cache of hashes, heuristics and verdicts.
+
+During a raid the same image is reposted dozens of times under new attachment
+ids. Everything we derive from an image is a pure function of its bytes, so
+results are keyed by ``sha256(bytes)``; the Discord attachment id is kept as a
+pre-key so guards handling the same attachment skip re-hashing the bytes.
+
+Each digest maps to a small dict of named fields, e.g. ``"phash:1"``,
+``"dhash"``, ``"color"``, ``"verdict:lpg"``. Hash/heuristic fields never expire;
+provider verdicts expire after ``LPG_GEM_CACHE_TTL_SEC``. ``memo`` also
+coalesces concurrent misses, so ten copies arriving at once cost one
+computation / one provider call. ``hashed_many`` fills every hash field a
+guard needs for one image from a single pool job (one pickle, one decode).
+
+Tiers:
+- memory : LRU of CONTENT_CACHE_MAX_ITEMS digests
+- disk   : optional, one JSON file per digest under CONTENT_CACHE_DIR, oldest
+           files pruned once the directory exceeds CONTENT_CACHE_DISK_MB
+
+ENV:
+- CONTENT_CACHE_MAX_ITEMS : in-memory digests, default 2048
+- CONTENT_CACHE_DIR       : on-disk tier directory, default "" (disabled)
+- CONTENT_CACHE_DISK_MB   : on-disk size cap, default 64
+- LPG_GEM_CACHE_TTL_SEC   : verdict TTL in seconds, default 600 (0 = don't cache verdicts)
+"""
+from __future__ import annotations
+import os, json, time, asyncio, logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from nixe.helpers.hash_utils import sha256_hex
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(float(os.getenv(key, str(default)) or default))
+    except Exception: return default
+
+MAX_ITEMS = max(16, _env_int("CONTENT_CACHE_MAX_ITEMS", 2048))
+DISK_DIR = (os.getenv("CONTENT_CACHE_DIR") or "").strip()
+DISK_CAP = max(1, _env_int("CONTENT_CACHE_DISK_MB", 64)) * 1024 * 1024
+_PREKEY_MAX = 4096
+
+def verdict_ttl() -> int:
+    """Verdict TTL; read lazily because a00_lpg_rate_limit_overlay sets the default at cog load."""
+    return max(0, _env_int("LPG_GEM_CACHE_TTL_SEC", 600))
+
+# digest -> {field: [value, expires_at]}  (expires_at 0 = never)
+_mem: "OrderedDict[str, Dict[str, list]]" = OrderedDict()
+# attachment id -> digest
+_prekey: "OrderedDict[int, str]" = OrderedDict()
+_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+_disk_bytes: Optional[int] = None
+_stats = {"hits": 0, "misses": 0, "disk_hits": 0, "coalesced": 0, "expired": 0}
+
+# ---------------------------------------------------------------- keys
+
+def digest(data: bytes, att=None) -> str:
+    """sha256 hex of ``data``; remembered per attachment id when ``att`` (or an id) is given."""
+    aid = getattr(att, "id", att)
+    try: aid = int(aid) if aid else 0
+    except Exception: aid = 0
+    if aid:
+        d = _prekey.get(aid)
+        if d is not None:
+            _prekey.move_to_end(aid)
+            return d
+    d = sha256_hex(bytes(data or b""))
+    if aid:
+        _prekey[aid] = d
+        while len(_prekey) > _PREKEY_MAX:
+            _prekey.popitem(last=False)
+    return d
+
+# ---------------------------------------------------------------- disk tier
+
+def _path(key: str) -> str:
+    return os.path.join(DISK_DIR, key[:2], key + ".json")
+
+def _disk_load(key: str) -> Optional[Dict[str, list]]:
+    if not DISK_DIR:
+        return None
+    try:
+        with open(_path(key), "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        return obj if isinstance(obj, dict) else None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.debug("[content-cache] disk read %s: %r", key[:12], e)
+        return None
+
+def _disk_usage() -> int:
+    total = 0
+    for root, _dirs, files in os.walk(DISK_DIR):
+        for fn in files:
+            try: total += os.path.getsize(os.path.join(root, fn))
+            except OSError: pass
+    return total
+
+def _disk_prune() -> None:
+    global _disk_bytes
+    files = []
+    for root, _dirs, names in os.walk(DISK_DIR):
+        for fn in names:
+            p = os.path.join(root, fn)
+            try:
+                st = os.stat(p); files.append((st.st_mtime, st.st_size, p))
+            except OSError:
+                pass
+    total = sum(f[1] for f in files)
+    target = int(DISK_CAP * 0.9)
+    files.sort()
+    for _mt, size, p in files:
+        if total <= target: break
+        try:
+            os.remove(p); total -= size
+        except OSError:
+            pass
+    _disk_bytes = total
+
+def _disk_store(key: str, entry: Dict[str, list]) -> None:
+    global _disk_bytes
+    if not DISK_DIR:
+        return
+    try:
+        p = _path(key)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        blob = json.dumps(entry, separators=(",", ":")).encode("utf-8")
+        try: old = os.path.getsize(p)
+        except OSError: old = 0
+        tmp = p + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, p)
+        if _disk_bytes is None:
+            _disk_bytes = _disk_usage()
+        else:
+            _disk_bytes += len(blob) - old
+        if _disk_bytes > DISK_CAP:
+            _disk_prune()
+    except Exception as e:
+        log.debug("[content-cache] disk write %s: %r", key[:12], e)
+
+# ---------------------------------------------------------------- core
+
+def _entry(key: str, load: bool = True) -> Optional[Dict[str, list]]:
+    e = _mem.get(key)
+    if e is not None:
+        _mem.move_to_end(key)
+        return e
+    if not load:
+        return None
+    e = _disk_load(key)
+    if e is not None:
+        _stats["disk_hits"] += 1
+        _remember(key, e)
+    return e
+
+def _remember(key: str, entry: Dict[str, list]) -> None:
+    _mem[key] = entry
+    _mem.move_to_end(key)
+    while len(_mem) > MAX_ITEMS:
+        _mem.popitem(last=False)
+
+_MISSING = object()
+
+def _lookup(key: str, field: str):
+    e = _entry(key)
+    if not e or field not in e:
+        return _MISSING
+    value, exp = e[field]
+    if exp and exp < time.time():
+        e.pop(field, None)
+        _stats["expired"] += 1
+        return _MISSING
+    return value
+
+def get(key: str, field: str, default: Any = None) -> Any:
+    """Cached ``field`` for digest ``key``, or ``default``."""
+    v = _lookup(key, field)
+    if v is _MISSING:
+        _stats["misses"] += 1
+        return default
+    _stats["hits"] += 1
+    return v
+
+def put(key: str, field: str, value: Any, ttl: Optional[float] = None) -> None:
+    """Store a JSON-serialisable ``value``; ``ttl`` seconds (None/0 = no expiry)."""
+    e = _entry(key) or {}
+    e[field] = [value, (time.time() + float(ttl)) if ttl else 0]
+    _remember(key, e)
+    _disk_store(key, e)
+
+def forget(key: str, field: Optional[str] = None) -> None:
+    """Drop one field (or the whole digest) from both tiers."""
+    e = _entry(key)
+    if e is None:
+        return
+    if field is None:
+        _mem.pop(key, None)
+        if DISK_DIR:
+            try: os.remove(_path(key))
+            except OSError: pass
+        return
+    if e.pop(field, None) is not None:
+        _disk_store(key, e)
+
+def forget_field(prefix: str) -> int:
+    """Drop every in-memory field starting with ``prefix`` (e.g. ``"verdict:"``)."""
+    n = 0
+    for key, e in list(_mem.items()):
+        drop = [f for f in e if f.startswith(prefix)]
+        for f in drop: e.pop(f, None)
+        if drop:
+            n += len(drop); _disk_store(key, e)
+    return n
+
+async def memo(key: str, field: str, compute: Callable[[], Awaitable[Any]], *,
+               ttl: Optional[float] = None, store_if: Optional[Callable[[Any], bool]] = None) -> Any:
+    """Return the cached field or ``await compute()`` once for all concurrent callers.
+
+    ``store_if(result)`` decides whether a fresh result is cached (e.g. skip
+    provider errors); exceptions from ``compute`` propagate and are not cached.
+    """
+    v = _lookup(key, field)
+    if v is not _MISSING:
+        _stats["hits"] += 1
+        return v
+    fk = (key, field)
+    fut = _inflight.get(fk)
+    if fut is not None:
+        _stats["coalesced"] += 1
+        return await asyncio.shield(fut)
+    _stats["misses"] += 1
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[fk] = fut
+    try:
+        result = await compute()
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(fk, None)
+    if store_if is None or store_if(result):
+        put(key, field, result, ttl)
+    if not fut.done(): fut.set_result(result)
+    return result
+
+async def hashed(data: bytes, field: str, fn: Callable[..., Any], *args, att=None, **kwargs) -> Any:
+    """``hash_pool.submit(fn, data, *args, **kwargs)`` memoised under ``field`` for these bytes."""
+    from nixe.helpers import hash_pool
+    return await memo(digest(data, att), field, lambda: hash_pool.submit(fn, data, *args, **kwargs))
+
+async def hashed_many(data: bytes, jobs: Dict[str, tuple], *, att=None) -> Dict[str, Any]:
+    """Several ``hashed`` fields of the same bytes from ONE pool job (one pickle, one decode).
+
+    ``jobs`` maps field -> ``(fn, args, kwargs)`` with ``fn(ctx_or_bytes, *args, **kwargs)``
+    module-level. Cached fields are returned as-is, fields another caller is
+    already computing are awaited, the rest run together through
+    ``image_context.derive_many`` and are memoised one by one. A job that fails
+    is left out of the result (and not cached); a pool failure propagates.
+    """
+    from nixe.helpers import hash_pool
+    from nixe.helpers.image_context import derive_many
+    key = digest(data, att)
+    out: Dict[str, Any] = {}
+    waits: Dict[str, asyncio.Future] = {}
+    todo: Dict[str, tuple] = {}
+    for field, job in jobs.items():
+        v = _lookup(key, field)
+        if v is not _MISSING:
+            _stats["hits"] += 1
+            out[field] = v
+        elif (key, field) in _inflight:
+            _stats["coalesced"] += 1
+            waits[field] = _inflight[(key, field)]
+        else:
+            todo[field] = job
+    if todo:
+        _stats["misses"] += len(todo)
+        loop = asyncio.get_running_loop()
+        futs = {f: loop.create_future() for f in todo}
+        for f, fut in futs.items():
+            _inflight[(key, f)] = fut
+        try:
+            res = await hash_pool.submit(derive_many, data, list(todo.values()))
+        except BaseException as e:
+            for fut in futs.values():
+                if isinstance(e, Exception):
+                    fut.set_exception(e); fut.exception()
+                else:
+                    fut.cancel()
+            raise
+        finally:
+            for f in futs:
+                _inflight.pop((key, f), None)
+        for (f, fut), (ok, value) in zip(futs.items(), res):
+            if ok:
+                put(key, f, value)
+                out[f] = value
+                fut.set_result(value)
+            else:
+                log.debug("[content-cache] %s failed: %s", f, value)
+                fut.set_exception(RuntimeError(value)); fut.exception()
+    for f, fut in waits.items():
+        try:
+            out[f] = await asyncio.shield(fut)
+        except Exception:
+            pass
+    return out
+
+async def verdict(key: str, name: str, compute: Callable[[], Awaitable[Any]], *,
+                  store_if: Optional[Callable[[Any], bool]] = None) -> Any:
+    """Provider verdict memoised as ``verdict:<name>`` for ``LPG_GEM_CACHE_TTL_SEC`` seconds."""
+    ttl = verdict_ttl()
+    if ttl <= 0:
+        return await compute()
+    return await memo(key, "verdict:" + name, compute, ttl=ttl, store_if=store_if)
+
+def stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return dict(_stats, items=len(_mem), prekeys=len(_prekey), inflight=len(_inflight),
+                hit_rate=round(_stats["hits"] / total, 4) if total else 0.0,
+                disk_dir=DISK_DIR or None, disk_bytes=_disk_bytes, verdict_ttl=verdict_ttl())
+
+def clear() -> None:
+    _mem.clear(); _prekey.clear()
@@ -3,6 +3,7 @@ from io import BytesIO
 from typing import Tuple, Dict
 from PIL import Image
 import numpy as np
+from nixe.helpers.image_context import ImageContext
 
 def _to_hsv_np(img: Image.Image) -> np.ndarray:
     if img.mode not in ("RGB","RGBA"):
@@ -47,9 +48,12 @@ def _count_vertical_edges(vmat: np.ndarray) -> Tuple[int,float]:
     reg = float(np.std(d) / max(np.mean(d), 1e-5))
     return len(centers), reg
 
-def _ratio_hsv(hsv: np.ndarray, h_lo: float, h_hi: float, s_lo: float=0.4, v_lo: float=0.4) -> float:
-    H,S,V = hsv[:,:,0]/255.0, hsv[:,:,1]/255.0, hsv[:,:,2]/255.0
-    deg = H*360.0
+def _planes(hsv: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(hue degrees, S, V) as floats; computed once per signature, shared by every ratio."""
+    return (hsv[:,:,0]/255.0)*360.0, hsv[:,:,1]/255.0, hsv[:,:,2]/255.0
+
+def _ratio_hsv(hsv: np.ndarray, h_lo: float, h_hi: float, s_lo: float=0.4, v_lo: float=0.4, planes=None) -> float:
+    deg, S, V = planes if planes is not None else _planes(hsv)
     if h_lo <= h_hi:
         hmask = (deg>=h_lo) & (deg<=h_hi)
     else:
@@ -57,32 +61,30 @@ def _ratio_hsv(hsv: np.ndarray, h_lo: float, h_hi: float, s_lo: float=0.4, v_lo:
     m = hmask & (S>=s_lo) & (V>=v_lo)
     return float(m.mean())
 
-def _ratio_in_border(hsv: np.ndarray, h_lo: float, h_hi: float, border_frac: float=0.12, s_lo: float=0.4, v_lo: float=0.4) -> float:
-    H,S,V = hsv[:,:,0]/255.0, hsv[:,:,1]/255.0, hsv[:,:,2]/255.0
-    Hdeg = H*360.0
-    hmask = (Hdeg>=h_lo)&(Hdeg<=h_hi) if h_lo<=h_hi else ((Hdeg>=h_lo)|(Hdeg<=h_hi))
-    m = hmask & (S>=s_lo) & (V>=v_lo)
+def _ratio_in_border(hsv: np.ndarray, h_lo: float, h_hi: float, border_frac: float=0.12, s_lo: float=0.4, v_lo: float=0.4,
+                     planes=None) -> float:
+    Hdeg, S, V = planes if planes is not None else _planes(hsv)
     h, w = V.shape
     b = int(max(1, w*border_frac))
-    # left & right border areas
-    border = np.zeros_like(V, dtype=bool)
-    border[:, :b] = True
-    border[:, -b:] = True
-    return float((m & border).mean())
+    # left & right border areas only
+    cols = np.r_[0:min(b, w), max(0, w-b):w] if 2*b < w else np.arange(w)
+    Hb, Sb, Vb = Hdeg[:, cols], S[:, cols], V[:, cols]
+    hmask = (Hb>=h_lo)&(Hb<=h_hi) if h_lo<=h_hi else ((Hb>=h_lo)|(Hb<=h_hi))
+    m = hmask & (Sb>=s_lo) & (Vb>=v_lo)
+    return float(m.sum()) / float(V.size)
 
-def analyze_layout_signature(image_bytes: bytes, max_px: int=1536) -> Dict[str, float]:
-    img = Image.open(BytesIO(image_bytes))
-    w, h = img.size
-    if max(w,h) > max_px:
-        scale = max_px / float(max(w,h))
-        img = img.resize((int(w*scale), int(h*scale)), Image.BILINEAR)
-    hsv = _to_hsv_np(img)
+def analyze_layout_signature(image_bytes, max_px: int=1536) -> Dict[str, float]:
+    """``image_bytes`` is raw bytes or an ImageContext (shares the cached HSV downscale)."""
+    ctx = ImageContext.of(image_bytes)
+    w, h = ctx.size
+    hsv = ctx.hsv(max_px)
     v = _grayscale_v(hsv)
     ncols, reg = _count_vertical_edges(v)
-    gold = _ratio_hsv(hsv, 25, 55, 0.35, 0.45)     # golden flame/bursts
-    purple = _ratio_hsv(hsv, 260, 320, 0.30, 0.35) # magenta/purple UIs
-    cyan_border = _ratio_in_border(hsv, 185, 205, 0.12, 0.35, 0.45)  # bluish borders on left/right
-    blue = _ratio_hsv(hsv, 200, 240, 0.25, 0.35)   # deep blue rails
+    pl = _planes(hsv)
+    gold = _ratio_hsv(hsv, 25, 55, 0.35, 0.45, pl)     # golden flame/bursts
+    purple = _ratio_hsv(hsv, 260, 320, 0.30, 0.35, pl) # magenta/purple UIs
+    cyan_border = _ratio_in_border(hsv, 185, 205, 0.12, 0.35, 0.45, pl)  # bluish borders on left/right
+    blue = _ratio_hsv(hsv, 200, 240, 0.25, 0.35, pl)   # deep blue rails
     bright = float((hsv[:,:,2] >= int(0.70*255)).mean())
     return {
         "ncols": float(ncols),
@@ -96,8 +98,8 @@ def analyze_layout_signature(image_bytes: bytes, max_px: int=1536) -> Dict[str,
         "h": float(h),
     }
 
-def is_lucky_pull_layoutlike(image_bytes: bytes) -> Tuple[bool, Dict[str,float]]:
-    m = analyze_layout_signature(image_bytes)
+def is_lucky_pull_layoutlike(image_bytes, max_px: int=1536) -> Tuple[bool, Dict[str,float]]:
+    m = analyze_layout_signature(image_bytes, max_px)
     ncols = m["ncols"]; reg = m["reg"]
     # Rules tuned for mixed styles:
     r1 = (ncols >= 7 and reg <= 0.42)                       # many evenly spaced vertical panels
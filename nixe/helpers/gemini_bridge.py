@@ -1,7 +1,8 @@
 
 # -*- coding: utf-8 -*-
 from typing import Tuple
-import os, json, base64, urllib.request, urllib.error
+import os, json, time
+from nixe.helpers import gemini_client, hedge
 
 def _detect_mime(b: bytes) -> str:
     """Detect basic image mime from header bytes."""
@@ -42,61 +43,29 @@ def _extract_json_like(txt: str) -> dict:
                     break
     return {}
 
-def _gemini_call(img_bytes: bytes, model: str, timeout: float):
-    api = os.environ.get("GEMINI_API_KEY")
-    if not api:
-        return (False, 0.0, "gemini:"+model, "GEMINI_API_KEY missing")
-    url = "https://generativelanguage.googleapis.com/v1beta/models/{m}:generateContent?key={k}".format(
-        m=model, k=api
-    )
-
-    prompt = (
-        "Return ONLY a JSON object with EXACT keys: "
-        "{"
-        "\"is_lucky\": true or false, "
-        "\"confidence\": number between 0 and 1, "
-        "\"reason\": string"
-        "}. "
-        "Classify whether the image is a gacha 'lucky pull' reveal (celebration/obtained screen)."
-    )
-
-    mime = _detect_mime(img_bytes)
-    payload = {
-        "generationConfig": {"response_mime_type": "application/json"},
-        "contents":[{
-            "role":"user",
-            "parts":[
-                {"inlineData": {"mimeType": mime, "data": base64.b64encode(bytes(img_bytes)).decode("ascii")}},
-                {"text": prompt}
-            ]
-        }]
-    }
-
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type":"application/json"}
-    )
-
-    try:
-        with urllib.request.urlopen(req, timeout=float(timeout)) as resp:
-            code = resp.getcode()
-            text = resp.read().decode("utf-8", errors="ignore")
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", "ignore")
-        return False, 0.0, "gemini:"+model, "gemini_http_{c}: {b}".format(c=e.code, b=body[:200])
-    except Exception as e:
-        return False, 0.0, "gemini:"+model, str(e)
-
-    if code != 200:
-        return False, 0.0, "gemini:"+model, "gemini_http_{c}: {b}".format(c=code, b=text[:200])
-
-    # Prefer JSON-only; fallback to text extraction
-    try:
-        data = json.loads(text)
-    except Exception:
-        data = {"text": text}
-
+_PROMPT = (
+    "Return ONLY a JSON object with EXACT keys: "
+    "{"
+    "\"is_lucky\": true or false, "
+    "\"confidence\": number between 0 and 1, "
+    "\"reason\": string"
+    "}. "
+    "Classify whether the image is a gacha 'lucky pull' reveal (celebration/obtained screen)."
+)
+
+def gemini_models():
+    """GEMINI_MODEL first, then LPG_GEMINI_FALLBACK_MODELS (csv, hedged after the primary's p90 latency)."""
+    primary = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash-lite")
+    extra = os.environ.get("LPG_GEMINI_FALLBACK_MODELS", "gemini-2.0-flash")
+    out = []
+    for m in [primary] + extra.split(","):
+        m = m.strip()
+        if m and m not in out:
+            out.append(m)
+    return out
+
+def _parse_verdict(data, model: str):
+    """``(ok, conf, provider, reason)``, or None when the reply holds no verdict JSON (loses the hedge)."""
     if isinstance(data, dict) and "candidates" in data:
         parts = (data.get("candidates") or [{}])[0].get("content", {}).get("parts", [])
         txt = ""
@@ -107,6 +76,8 @@ def _gemini_call(img_bytes: bytes, model: str, timeout: float):
         obj = _extract_json_like(txt)
     else:
         obj = data if isinstance(data, dict) else {}
+    if not isinstance(obj, dict) or "is_lucky" not in obj:
+        return None
 
     conf_raw = obj.get("confidence", 0.0)
     conf = float(conf_raw) if isinstance(conf_raw, (int, float)) else 0.0
@@ -114,15 +85,64 @@ def _gemini_call(img_bytes: bytes, model: str, timeout: float):
     reason = obj.get("reason", "ok" if ok else "not_lucky")
     return ok, conf, "gemini:"+model, reason
 
-def classify_lucky_pull_bytes(img_bytes: bytes, threshold: float = 0.75, timeout: float = 20000.0, *args, **kwargs):
+async def _gemini_async(img_bytes: bytes, model: str, timeout: float, api: str):
+    """One model, on the bot loop; raises GeminiError so the hedge can fall through to the next model."""
+    parts = [gemini_client.image_part(img_bytes, _detect_mime(img_bytes)), _PROMPT]
+    data = await gemini_client.generate(model, parts, timeout=timeout, key=api,
+                                        generation_config={"response_mime_type": "application/json"})
+    return _parse_verdict(data, model)
+
+def _gemini_call(img_bytes: bytes, model, timeout: float):
+    """``model`` = one name or a list; several models are hedged (``nixe.helpers.hedge``)."""
+    models = [model] if isinstance(model, str) else list(model)
+    api = os.environ.get("GEMINI_API_KEY")
+    if not api:
+        return (False, 0.0, "gemini:"+models[0], "GEMINI_API_KEY missing")
+    timeout = float(timeout)
+    errors = []
+
+    def attempt(m):
+        async def run():
+            try:
+                res = await _gemini_async(img_bytes, m, timeout, api)
+            except Exception as e:
+                errors.append(f"{m}: {e}")
+                raise
+            if res is None:
+                errors.append(f"{m}: unparseable reply")
+            return res
+        return "gemini:" + m, run
+
+    async def hedged():
+        res, _key = await hedge.first_valid([attempt(m) for m in models], valid=lambda r: r is not None,
+                                            deadline=time.monotonic() + timeout)
+        return res
+
+    # runs in an executor thread; the requests go through the bot loop's pooled session
+    try:
+        res = gemini_client.run_sync(hedged, timeout)
+    except Exception as e:
+        return False, 0.0, "gemini:"+models[0], str(e)
+    if res is None:
+        return False, 0.0, "gemini:"+models[0], "; ".join(errors) or "timeout"
+    return res
+
+def classify_lucky_pull_bytes(img_bytes: bytes, threshold: float = 0.75, timeout: float = 20.0, *args, **kwargs):
+    """``timeout`` in seconds; ``timeout_ms`` / ``providers`` (lucky_pull_guard) override the env defaults."""
     last_provider, last_score, last_reason = "none", 0.0, ""
-    order = _image_provider_order()
-    model_gem = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash-lite")
+    providers = kwargs.get("providers")
+    order = [str(p).strip().lower() for p in providers if str(p).strip()] if providers else _image_provider_order()
+    if kwargs.get("timeout_ms"):
+        timeout = float(kwargs["timeout_ms"]) / 1000.0
 
     for p in order:
         try:
             if p == "gemini":
-                ok, score, prov, reason = _gemini_call(img_bytes, model_gem, timeout)
+                if not gemini_client.available(gemini_models()):
+                    # every model's breaker is open: answer now instead of waiting out the timeout
+                    last_provider, last_reason = "gemini", "deferred:circuit_open"
+                    continue
+                ok, score, prov, reason = _gemini_call(img_bytes, gemini_models(), timeout)
                 last_provider, last_score, last_reason = prov, float(score), reason
                 if ok and score >= float(threshold):
                     return True, float(score), prov, reason
@@ -3,29 +3,53 @@
 Strict Gemini classifier for Lucky Pull (image bytes only).
 - Conservative: prefers NOT LUCKY if ambiguities with inventory/loadout screens.
 - Returns (score: 0..1, reason: str). Silent on failures -> (None, reason).
+- GEMINI_MODEL first, LPG_GEMINI_FALLBACK_MODELS hedged after the primary's p90
+  latency (``nixe.helpers.hedge``); the first reply that parses wins.
 """
-import os
+import os, time
+from nixe.helpers import gemini_client, hedge
+from nixe.helpers.gemini_bridge import gemini_models
 
-# Lazy import to avoid hard dependency if library missing at import time
+# Per-model handles from the shared pooled client (built once, no SDK re-configure per call)
 def _lazy_client():
     try:
-        import google.generativeai as genai
         key = os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY")
         if not key:
             return None, "no_key"
-        genai.configure(api_key=key)
-        model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
-        model = genai.GenerativeModel(model_name)
-        return model, "ok"
+        return [gemini_client.model(m) for m in gemini_models()], "ok"
     except Exception as e:
         return None, f"imp_err:{type(e).__name__}"
 
+def _score(txt: str):
+    """Reply text -> conservative lucky score, None if it cannot be read."""
+    import json, re
+    try:
+        m = re.search(r"\{.*\}", txt, flags=re.S)
+        obj = json.loads(m.group(0)) if m else json.loads(txt)
+        label = str(obj.get("label","")).lower().strip()
+        conf = float(obj.get("confidence", 0.0))
+    except Exception:
+        # Fallback heuristic from plain text
+        low = txt.lower()
+        if "not_lucky" in low or "not lucky" in low or "inventory" in low or "loadout" in low:
+            label, conf = "not_lucky", 0.3
+        elif "lucky" in low or "gacha" in low:
+            label, conf = "lucky", 0.9
+        else:
+            return None
+
+    score = conf if label == "lucky" else 1.0 - conf
+    # Clamp and bias to be conservative on not_lucky
+    if label != "lucky" and score > 0.5:
+        score = 0.4
+    return float(score)
+
 def classify_lucky_pull_bytes(img_bytes: bytes):
     try:
         # Force real attachment (do not use any internal sample)
         os.environ.setdefault("LPG_SMOKE_FORCE_SAMPLE","0")
-        model, s = _lazy_client()
-        if model is None:
+        models, s = _lazy_client()
+        if not models:
             return None, s
 
         # Rubric: VERY explicit separation Lucky vs Loadout
@@ -48,37 +72,32 @@ def classify_lucky_pull_bytes(img_bytes: bytes):
         )
         prompt = "Classify the uploaded image strictly per the rubric. Output JSON only."
 
-        # Construct Gemini call
-        from PIL import Image
-        import io
-        img = Image.open(io.BytesIO(img_bytes))
-        image_part = {"mime_type": "image/png", "data": img_bytes}
-        # Some SDKs accept raw bytes; this dict representation helps newer SDKs.
+        parts = [system, prompt, gemini_client.image_part(img_bytes)]
+        timeout = gemini_client.TIMEOUT_SEC
+        errors = []
 
-        res = model.generate_content([system, prompt, image_part])
-        txt = (res.text or "").strip()
+        def attempt(model):
+            async def run():
+                try:
+                    res = await gemini_client.generate(model, parts, timeout=timeout)
+                except Exception as e:
+                    errors.append(f"err:{type(e).__name__}")
+                    raise
+                score = _score(gemini_client.response_text(res).strip())
+                if score is None:
+                    errors.append("parse_fail")
+                return score
+            return "gemini:" + model.name, run
 
-        # Parse minimal JSON without strict dependency
-        import json, re
-        try:
-            m = re.search(r"\{.*\}", txt, flags=re.S)
-            obj = json.loads(m.group(0)) if m else json.loads(txt)
-            label = str(obj.get("label","")).lower().strip()
-            conf = float(obj.get("confidence", 0.0))
-        except Exception:
-            # Fallback heuristic from plain text
-            low = txt.lower()
-            if "not_lucky" in low or "not lucky" in low or "inventory" in low or "loadout" in low:
-                label, conf = "not_lucky", 0.3
-            elif "lucky" in low or "gacha" in low:
-                label, conf = "lucky", 0.9
-            else:
-                return None, "parse_fail"
+        async def hedged():
+            res, _key = await hedge.first_valid([attempt(m) for m in models], valid=lambda r: r is not None,
+                                                deadline=time.monotonic() + timeout)
+            return res
 
-        score = conf if label == "lucky" else 1.0 - conf
-        # Clamp and bias to be conservative on not_lucky
-        if label != "lucky" and score > 0.5:
-            score = 0.4
+        # Runs in a worker thread; the requests go through the bot loop's pooled session
+        score = gemini_client.run_sync(hedged, timeout)
+        if score is None:
+            return None, (errors[-1] if errors else "timeout")
         return float(score), f"gemini:strict"
     except Exception as e:
         return None, f"err:{type(e).__name__}"
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+gemini_client — one long-lived, pooled HTTP client for every Gemini call.
+
+Call sites used to open a fresh ``aiohttp.ClientSession`` (or a blocking
+``urllib`` request, or re-``configure`` the SDK) per attempt, paying DNS + TCP
++ TLS on every verdict. Here a single session per event loop keeps connections
+alive and reuses them:
+
+- ``TCPConnector(limit=GEMINI_POOL_SIZE, limit_per_host=...)`` caps in-flight
+  requests; aiohttp does not pipeline HTTP/1.1, so the per-host limit is the
+  number of concurrent keep-alive connections to the API host.
+- idle connections stay open GEMINI_KEEPALIVE_SEC; DNS is cached.
+- ``model(name)`` returns a cached per-model handle (endpoint URL + defaults),
+  so nothing is rebuilt per classification.
+
+Async callers ``await generate(...)``. Blocking callers already running in a
+worker thread (``run_in_executor`` / ``to_thread``) use ``generate_sync``,
+which runs the request on the bot's loop through the same pool; called from
+the loop thread itself it refuses instead of blocking the gateway. The bot
+pins its loop with ``bind_loop()`` in ``setup_hook``.
+
+The pooled session belongs to that loop only. Any other loop (a script's
+``asyncio.run``, or ``run_sync`` before the bot loop runs) gets a private
+session that the call opens and closes itself, so one thread can never close
+or replace the session another thread is using.
+
+Every ``generateContent`` goes through ``provider_limiter`` (key
+``gemini:<model>``): shared RPM bucket, concurrency cap and 429 backoff honouring
+Retry-After / retryDelay, with one retry when LPG_GEM_RETRY_ON_429=1. ``circuit_breaker`` (same key)
+refuses calls at once while the model is failing; ``health()`` reports breaker
+state and latency percentiles per model.
+
+Errors raise ``GeminiError`` (``.status`` = HTTP status, 0 for transport /
+timeout); ``response_text`` pulls the first text part out of a response.
+
+ENV:
+- GEMINI_API_KEY          : API key (sent as ``x-goog-api-key`` header)
+- GEMINI_API_BASE         : default https://generativelanguage.googleapis.com/v1beta
+- GEMINI_POOL_SIZE        : max concurrent connections, default 8
+- GEMINI_KEEPALIVE_SEC    : idle keep-alive, default 75
+- GEMINI_TIMEOUT_SEC      : default per-request timeout, default 20
+"""
+from __future__ import annotations
+import os, json, time, base64, asyncio, logging, threading, contextvars
+from typing import Any, Dict, List, Optional, Union
+try:
+    import aiohttp
+except Exception:
+    aiohttp = None
+
+from nixe.helpers import circuit_breaker, provider_limiter
+from nixe.helpers.env_reader import get as _cfg_get
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+def _env_float(key: str, default: float) -> float:
+    try: return float(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+API_BASE = (os.getenv("GEMINI_API_BASE") or "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+POOL_SIZE = max(1, _env_int("GEMINI_POOL_SIZE", 8))
+KEEPALIVE_SEC = max(1.0, _env_float("GEMINI_KEEPALIVE_SEC", 75.0))
+TIMEOUT_SEC = max(0.5, _env_float("GEMINI_TIMEOUT_SEC", 20.0))
+
+class GeminiError(RuntimeError):
+    """Non-200 reply, transport failure or timeout; ``status`` is 0 when there was no HTTP reply."""
+    def __init__(self, msg: str, status: int = 0):
+        super().__init__(msg)
+        self.status = int(status or 0)
+
+def api_key() -> str:
+    return _cfg_get("GEMINI_API_KEY", "") or os.getenv("GEMINI_API_KEY", "")
+
+def detect_mime(b: bytes) -> str:
+    if b.startswith(b"\xff\xd8\xff"): return "image/jpeg"
+    if b.startswith(b"\x89PNG\r\n\x1a\n"): return "image/png"
+    if b.startswith(b"RIFF") and b[8:12] == b"WEBP": return "image/webp"
+    if b[:6] in (b"GIF87a", b"GIF89a"): return "image/gif"
+    return "image/jpeg"
+
+def image_part(data: bytes, mime: Optional[str] = None) -> dict:
+    """REST ``inline_data`` part for raw image bytes."""
+    return {"inline_data": {"mime_type": mime or detect_mime(data), "data": base64.b64encode(bytes(data)).decode("ascii")}}
+
+def response_text(data: Optional[dict]) -> str:
+    """First text part of a ``generateContent`` response ("" if none)."""
+    for cand in (data or {}).get("candidates") or []:
+        for p in (cand.get("content") or {}).get("parts") or []:
+            if isinstance(p, dict) and "text" in p:
+                return p["text"] or ""
+    return ""
+
+class Model:
+    """Per-model handle: endpoint and default request fields, built once and reused."""
+
+    def __init__(self, name: str, *, system: Optional[str] = None, generation_config: Optional[dict] = None):
+        self.name = name
+        self.url = f"{API_BASE}/models/{name}:generateContent"
+        self.meta_url = f"{API_BASE}/models/{name}"
+        self.system = system
+        self.generation_config = dict(generation_config or {})
+
+    def body(self, parts: List[Union[str, dict]], *, system: Optional[str] = None,
+             generation_config: Optional[dict] = None) -> dict:
+        ps = [{"text": p} if isinstance(p, str) else p for p in parts]
+        body: Dict[str, Any] = {"contents": [{"role": "user", "parts": ps}]}
+        gc = dict(self.generation_config, **(generation_config or {}))
+        if gc: body["generationConfig"] = gc
+        sysmsg = system if system is not None else self.system
+        if sysmsg: body["systemInstruction"] = {"parts": [{"text": sysmsg}]}
+        return body
+
+_models: Dict[tuple, Model] = {}
+_session = None
+_session_loop = None
+_bot_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+_private: contextvars.ContextVar = contextvars.ContextVar("gemini_private_session", default=None)
+
+def model(name: str, *, system: Optional[str] = None, generation_config: Optional[dict] = None) -> Model:
+    key = (name, system, json.dumps(generation_config or {}, sort_keys=True))
+    m = _models.get(key)
+    if m is None:
+        m = _models[key] = Model(name, system=system, generation_config=generation_config)
+    return m
+
+def _new_session():
+    if aiohttp is None:
+        raise GeminiError("aiohttp not installed")
+    connector = aiohttp.TCPConnector(limit=POOL_SIZE, limit_per_host=POOL_SIZE,
+                                     keepalive_timeout=KEEPALIVE_SEC, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=TIMEOUT_SEC))
+
+def _get_session():
+    """``(session, owned)``: the bot loop's pooled session, or a private one the caller must close."""
+    global _session, _session_loop
+    own = _private.get()
+    if own is not None:
+        return own, False
+    loop = asyncio.get_running_loop()
+    if loop is not _bot_loop:
+        return _new_session(), True
+    with _lock:
+        if _session is None or _session.closed or _session_loop is not loop:
+            _session = _new_session()
+            _session_loop = loop
+            log.info("[gemini-client] session opened (pool=%d keepalive=%.0fs)", POOL_SIZE, KEEPALIVE_SEC)
+    return _session, False
+
+def bind_loop(loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    """Pin the loop that owns the pooled session and runs ``generate_sync`` work (bot ``setup_hook``)."""
+    global _bot_loop
+    _bot_loop = loop or asyncio.get_running_loop()
+
+def _retry_hint(headers, text: str) -> Optional[float]:
+    """Seconds to back off from ``Retry-After`` or Gemini's ``retryDelay`` ("7s"), if given."""
+    try:
+        ra = (headers or {}).get("Retry-After")
+        if ra: return max(0.0, float(ra))
+    except Exception:
+        pass
+    try:
+        for d in (json.loads(text).get("error") or {}).get("details") or []:
+            rd = str(d.get("retryDelay") or "")
+            if rd.endswith("s"): return max(0.0, float(rd[:-1]))
+    except Exception:
+        pass
+    return None
+
+async def _send(sess, method: str, url: str, body: Optional[dict], timeout: float, key: str):
+    try:
+        async with sess.request(method, url, json=body, timeout=aiohttp.ClientTimeout(total=max(0.1, timeout)),
+                                headers={"x-goog-api-key": key, "Content-Type": "application/json"}) as r:
+            return r.status, await r.text(), dict(r.headers)
+    except asyncio.TimeoutError:
+        raise GeminiError("timeout")
+    except Exception as e:
+        if getattr(sess, "closed", False):
+            raise GeminiError(f"session_closed: {type(e).__name__}: {e}")
+        raise GeminiError(f"{type(e).__name__}: {e}")
+
+_MIN_BUDGET = 1.0   # a send budget below this (or below the model's p50) cannot fairly time out
+
+def _blame(e: GeminiError, budget: float, lim) -> Optional[bool]:
+    """Breaker outcome of a failed send: False = the provider failed, None = the call set it up to fail."""
+    msg = str(e)
+    if msg.startswith("session_closed"):
+        return None     # our session was closed under the call (shutdown), the provider never answered
+    if msg == "timeout":
+        p50 = lim.latency(0.5, 5) if lim is not None else None
+        if budget < max(_MIN_BUDGET, p50 or 0.0):
+            return None     # most of the deadline went to queueing; a healthy model would miss it too
+    return False
+
+async def _request(method: str, url: str, *, body: Optional[dict] = None, timeout: Optional[float] = None,
+                   key: Optional[str] = None, limit_key: Optional[str] = None) -> dict:
+    key = key or api_key()
+    if not key:
+        raise GeminiError("GEMINI_API_KEY missing")
+    sess, owned = _get_session()
+    try:
+        return await _request_on(sess, method, url, body=body, timeout=timeout, key=key, limit_key=limit_key)
+    finally:
+        if owned:
+            await sess.close()
+
+async def _request_on(sess, method: str, url: str, *, body: Optional[dict], timeout: Optional[float],
+                      key: str, limit_key: Optional[str]) -> dict:
+    deadline = time.monotonic() + float(timeout or TIMEOUT_SEC)
+    lim = provider_limiter.get(limit_key) if limit_key else None
+    br = circuit_breaker.get(limit_key) if limit_key else None
+    if br is not None and not br.allow():
+        raise GeminiError(f"circuit_open: {limit_key}")
+    outcome = None      # breaker: True ok, False provider failure, None neutral (429 / 4xx / cancelled)
+    try:
+        for attempt in (0, 1):
+            try:
+                budget = deadline - time.monotonic()
+                if lim is None:
+                    status, text, headers = await _send(sess, method, url, body, budget, key)
+                else:
+                    # shared per-model quota; waiting counts against this call's timeout
+                    async with lim.slot(deadline):
+                        t0 = time.monotonic()
+                        budget = deadline - t0
+                        status, text, headers = await _send(sess, method, url, body, budget, key)
+                        if status == 200:
+                            lim.observe(time.monotonic() - t0)
+            except provider_limiter.RateLimited as e:
+                raise GeminiError(f"rate_limited: {e}", 429)
+            except GeminiError as e:
+                outcome = _blame(e, budget, lim)   # timeout / transport
+                raise
+            if status == 429 and lim is not None:
+                lim.penalize(_retry_hint(headers, text))
+                if attempt == 0 and provider_limiter.retry_on_429():
+                    continue   # the slot wait sits out the penalty, or gives up if the deadline is too close
+            if status != 200:
+                outcome = False if status >= 500 else None
+                raise GeminiError(f"gemini_http_{status}: {text[:200]}", status)
+            outcome = True
+            break
+    finally:
+        if br is not None:
+            br.record(outcome)
+    try:
+        return json.loads(text)
+    except Exception:
+        return {"text": text}
+
+async def generate(model_name: Union[str, Model], parts: List[Union[str, dict]], *, system: Optional[str] = None,
+                   generation_config: Optional[dict] = None, timeout: Optional[float] = None,
+                   key: Optional[str] = None) -> dict:
+    """POST ``generateContent`` for ``parts`` (str = text part) and return the decoded response."""
+    m = model_name if isinstance(model_name, Model) else model(model_name)
+    return await _request("POST", m.url, body=m.body(parts, system=system, generation_config=generation_config),
+                          timeout=timeout, key=key, limit_key="gemini:" + m.name)
+
+async def get_model(model_name: str, *, timeout: Optional[float] = None) -> dict:
+    """Model metadata (``GET models/<name>``)."""
+    return await _request("GET", model(model_name).meta_url, timeout=timeout)
+
+def run_sync(make_coro, timeout: float):
+    """Run ``make_coro()`` on the bot loop from a worker thread and wait up to ``timeout`` (+1s)."""
+    loop = _bot_loop
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise GeminiError("blocking Gemini call on the event loop thread; await the async API instead")
+        fut = asyncio.run_coroutine_threadsafe(make_coro(), loop)
+        try:
+            return fut.result(timeout + 1.0)
+        except GeminiError:
+            raise
+        except Exception as e:
+            fut.cancel()
+            raise GeminiError(f"{type(e).__name__}: {e}")
+    # no bot loop (scripts / tools): one private loop and session per call; the pooled one is not touched
+    async def _once():
+        sess = _new_session()
+        tok = _private.set(sess)
+        try:
+            return await make_coro()
+        finally:
+            _private.reset(tok)
+            await sess.close()
+    return asyncio.run(_once())
+
+def generate_sync(model_name: Union[str, Model], parts: List[Union[str, dict]], *, timeout: Optional[float] = None,
+                  **kw) -> dict:
+    """Blocking ``generate`` for code running in a worker thread; reuses the bot loop's pool."""
+    t = float(timeout or TIMEOUT_SEC)
+    return run_sync(lambda: generate(model_name, parts, timeout=t, **kw), t)
+
+async def aclose() -> None:
+    """Close the pooled session (bot shutdown, on the bot loop)."""
+    global _session
+    s, _session = _session, None
+    if s is not None and not s.closed:
+        try: await s.close()
+        except Exception: pass
+
+def stats() -> dict:
+    conn = getattr(_session, "connector", None) if _session is not None else None
+    return {"open": bool(_session is not None and not _session.closed), "pool": POOL_SIZE,
+            "models": len(_models), "in_use": len(getattr(conn, "_acquired", ()) or ()),
+            "limits": provider_limiter.stats(), "breakers": circuit_breaker.stats()}
+
+def health() -> Dict[str, dict]:
+    """Per ``gemini:<model>`` key: breaker state + error rate, request latency and queue wait percentiles."""
+    lims, brs = provider_limiter.stats(), circuit_breaker.stats()
+    out: Dict[str, dict] = {}
+    for k in sorted(set(lims) | set(brs)):
+        b, l = brs.get(k, {}), lims.get(k, {})
+        out[k] = {"state": b.get("state", circuit_breaker.CLOSED), "error_rate": b.get("error_rate", 0.0),
+                  "window_calls": b.get("window_calls", 0), "open_for": b.get("open_for", 0.0),
+                  "lat_p50": l.get("lat_p50", 0.0), "lat_p90": l.get("lat_p90", 0.0),
+                  "wait_p90": l.get("wait_p90", 0.0)}
+    return out
+
+def available(model_names) -> bool:
+    """True unless the breaker of every one of ``model_names`` is open (guards defer instead of calling)."""
+    names = [model_names] if isinstance(model_names, str) else [n for n in model_names if n]
+    return not names or circuit_breaker.available("gemini:" + n for n in names)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+hash_pool — run CPU-bound image hashing off the event loop.
+
+Hashing large or animated images inside ``async def on_message`` blocks the
+gateway heartbeat. ``await hash_pool.submit(fn, *args)`` runs a picklable
+module-level function (e.g. ``img_hashing.phash_list_from_bytes``) in a bounded
+``ProcessPoolExecutor`` so the work spreads across cores.
+
+- Backpressure: at most HASH_POOL_MAX_PENDING jobs queued/running; extra callers
+  wait for a slot up to the job timeout, then get ``HashPoolBusy``.
+- Per-job timeout: HASH_POOL_TIMEOUT_SEC; raises ``asyncio.TimeoutError``.
+- HASH_POOL_WORKERS=0 (or a pool that cannot start) falls back to a thread.
+
+ENV:
+- HASH_POOL_WORKERS      : worker processes, default min(2, cpu_count)
+- HASH_POOL_MAX_PENDING  : queued + running jobs, default 32
+- HASH_POOL_TIMEOUT_SEC  : per-job timeout, default 15
+"""
+from __future__ import annotations
+import os, asyncio, logging, functools
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+def _env_float(key: str, default: float) -> float:
+    try: return float(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+WORKERS = max(0, _env_int("HASH_POOL_WORKERS", min(2, os.cpu_count() or 1)))
+MAX_PENDING = max(1, _env_int("HASH_POOL_MAX_PENDING", 32))
+TIMEOUT_SEC = max(0.5, _env_float("HASH_POOL_TIMEOUT_SEC", 15.0))
+
+class HashPoolBusy(RuntimeError):
+    """Raised when the pending-job limit stays full for the whole timeout."""
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_failed = False
+_slots: Optional[asyncio.Semaphore] = None
+_slots_loop = None
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool, _pool_failed
+    if WORKERS <= 0 or _pool_failed:
+        return None
+    if _pool is None:
+        try:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS)
+            log.info("[hash-pool] started %d worker(s), max_pending=%d", WORKERS, MAX_PENDING)
+        except Exception as e:
+            log.warning("[hash-pool] process pool unavailable, using threads: %r", e)
+            _pool_failed = True
+            return None
+    return _pool
+
+def _reset_pool() -> None:
+    global _pool
+    p, _pool = _pool, None
+    if p is not None:
+        try: p.shutdown(wait=False, cancel_futures=True)
+        except Exception: pass
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots_loop is not loop:
+        _slots = asyncio.Semaphore(MAX_PENDING); _slots_loop = loop
+    return _slots
+
+async def submit(fn: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """Run ``fn(*args, **kwargs)`` in the pool and return its result.
+
+    ``fn`` must be a module-level function and its arguments picklable.
+    """
+    timeout = TIMEOUT_SEC if timeout is None else max(0.1, float(timeout))
+    slots = _get_slots()
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise HashPoolBusy(f"hash pool saturated ({MAX_PENDING} pending)")
+    try:
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        pool = _get_pool()
+        if pool is None:
+            return await asyncio.wait_for(asyncio.to_thread(call), timeout=timeout)
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(pool, call), timeout=timeout)
+        except BrokenProcessPool:
+            log.warning("[hash-pool] worker died; restarting pool")
+            _reset_pool()
+            raise
+    finally:
+        slots.release()
+
+def stats() -> dict:
+    free = _slots._value if _slots is not None else MAX_PENDING
+    return {"workers": WORKERS if not _pool_failed else 0, "pending": MAX_PENDING - free, "max_pending": MAX_PENDING}
+
+def shutdown() -> None:
+    _reset_pool()
@@ -2,12 +2,10 @@
 import io, hashlib
 from PIL import Image
 import numpy as np
+from nixe.helpers import np_hash
+from nixe.helpers.image_context import ImageContext
 
-def ahash_hex_from_bytes(b: bytes, size: int = 8) -> str:
-    im = Image.open(io.BytesIO(b)).convert("L").resize((size, size))
-    arr = np.asarray(im, dtype=np.float32)
-    avg = float(arr.mean())
-    bits = (arr >= avg).astype(np.uint8).flatten()
+def _bits_to_hex(bits) -> str:
     v = 0; out = []
     for i, bit in enumerate(bits):
         v = (v << 1) | int(bit)
@@ -17,23 +15,19 @@ def ahash_hex_from_bytes(b: bytes, size: int = 8) -> str:
         out.append(format(v, "x"))
     return "".join(out)
 
-def dhash_hex_from_bytes(b: bytes) -> str:
-    im = Image.open(io.BytesIO(b)).convert("L").resize((9, 8))
-    px = list(im.getdata())
-    w, h = im.size
-    bits = []
-    for y in range(h):
-        row = [px[y * w + x] for x in range(w)]
-        for x in range(w - 1):
-            bits.append(1 if row[x] < row[x + 1] else 0)
-    v = 0; out = []
-    for i, bit in enumerate(bits):
-        v = (v << 1) | int(bit)
-        if i % 4 == 3:
-            out.append(format(v, "x")); v = 0
-    if len(bits) % 4 != 0:
-        out.append(format(v, "x"))
-    return "".join(out)
+def ahash_hex_from_bytes(b, size: int = 8) -> str:
+    """``b`` is raw bytes or an ImageContext."""
+    arr = ImageContext.of(b).gray_array((size, size))
+    if size == 8:
+        return np_hash.to_hex(np_hash.ahash_u64(arr))
+    arr = arr.astype(np.float32)
+    avg = float(arr.mean())
+    bits = (arr >= avg).astype(np.uint8).flatten()
+    return _bits_to_hex(bits)
+
+def dhash_hex_from_bytes(b) -> str:
+    """``b`` is raw bytes or an ImageContext."""
+    return np_hash.to_hex(np_hash.dhash_u64(ImageContext.of(b).gray_array((9, 8))))
 
 def sha256_hex(b: bytes) -> str:
     import hashlib
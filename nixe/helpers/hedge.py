@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+hedge — hedged requests across fallback models / providers.
+
+Fallback chains used to be sequential: a slow primary costs its whole timeout
+before the next model is even tried. ``first_valid`` starts the primary, and if
+no answer arrives within that model's recent p90 latency it fires the next
+attempt alongside it; the first *valid* answer wins and the rest are cancelled
+(cancellation releases their ``provider_limiter`` slot and HTTP connection).
+A failed or invalid answer starts the next attempt immediately (plain fallback).
+
+Hedges stay inside the rate-limit budget: a speculative attempt is only fired
+when its limiter could start it right now (``Limiter.idle()``), otherwise we
+keep waiting on what is already in flight. Everything is bounded by the
+caller's deadline.
+
+Delay = p90 of the previous attempt's successful latency (``Limiter.observe``),
+clamped to [HEDGE_MIN_MS, deadline]; HEDGE_DEFAULT_MS until
+HEDGE_MIN_SAMPLES latencies are known.
+
+ENV:
+- HEDGE_ENABLE      : 0 = strictly sequential fallback, default 1
+- HEDGE_DEFAULT_MS  : hedge delay before enough samples exist, default 3000
+- HEDGE_MIN_MS      : lower bound of the hedge delay, default 400
+- HEDGE_MIN_SAMPLES : latencies needed before the p90 is trusted, default 10
+"""
+from __future__ import annotations
+import os, time, asyncio, logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from nixe.helpers import provider_limiter
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+DEFAULT_MS = max(0, _env_int("HEDGE_DEFAULT_MS", 3000))
+MIN_MS = max(0, _env_int("HEDGE_MIN_MS", 400))
+MIN_SAMPLES = max(1, _env_int("HEDGE_MIN_SAMPLES", 10))
+_RECHECK = 0.25     # budget re-check interval while a hedge is held back
+
+_stats = {"calls": 0, "hedged": 0, "hedge_won": 0, "fallbacks": 0, "held_back": 0, "exhausted": 0}
+
+Attempt = Tuple[str, Callable[[], Awaitable[Any]]]    # (limiter key, coroutine factory)
+
+def enabled() -> bool:
+    return os.getenv("HEDGE_ENABLE", "1") == "1"
+
+def delay_for(key: str) -> float:
+    """Seconds to wait on ``key`` before hedging: its p90 latency, or the default."""
+    p90 = provider_limiter.get(key).latency(0.9, MIN_SAMPLES)
+    sec = DEFAULT_MS / 1000.0 if p90 is None else p90
+    return max(MIN_MS / 1000.0, sec)
+
+async def first_valid(attempts: Sequence[Attempt], *, valid: Callable[[Any], bool] = lambda r: r is not None,
+                      deadline: Optional[float] = None) -> Tuple[Any, Optional[str]]:
+    """``(result, key)`` of the first valid attempt; ``(last result, None)`` if none was valid in time."""
+    _stats["calls"] += 1
+    attempts = list(attempts)
+    pending: Dict[asyncio.Task, Tuple[str, bool]] = {}    # task -> (key, started as hedge)
+    nxt = 0
+    last: Any = None
+    hedge_at = float("inf")
+
+    def launch(hedge: bool) -> None:
+        nonlocal nxt, hedge_at
+        key, make = attempts[nxt]
+        pending[asyncio.ensure_future(make())] = (key, hedge)
+        nxt += 1
+        hedge_at = (time.monotonic() + delay_for(key)) if (nxt < len(attempts) and enabled()) else float("inf")
+
+    try:
+        if attempts:
+            launch(False)
+        while pending:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            wait = min(hedge_at, deadline if deadline is not None else float("inf")) - now
+            done, _ = await asyncio.wait(list(pending), timeout=None if wait == float("inf") else max(0.0, wait),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if nxt < len(attempts) and time.monotonic() >= hedge_at:
+                    if provider_limiter.get(attempts[nxt][0]).idle():
+                        _stats["hedged"] += 1
+                        launch(True)
+                    else:
+                        _stats["held_back"] += 1
+                        hedge_at = time.monotonic() + _RECHECK
+                continue
+            for t in done:
+                key, was_hedge = pending.pop(t)
+                try:
+                    r = t.result()
+                except Exception as e:
+                    log.debug("[hedge] %s failed: %r", key, e)
+                    continue
+                if valid(r):
+                    if was_hedge:
+                        _stats["hedge_won"] += 1
+                    return r, key
+                last = r
+            if not pending and nxt < len(attempts):
+                _stats["fallbacks"] += 1
+                launch(False)
+        _stats["exhausted"] += 1
+        return last, None
+    finally:
+        for t in pending:
+            t.cancel()
+
+def stats() -> dict:
+    return dict(_stats, enabled=enabled(), default_ms=DEFAULT_MS, min_ms=MIN_MS)
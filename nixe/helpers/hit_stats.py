@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+hit_stats — per-hash hit counters for blacklist eviction.
+
+Matchers call ``hit(h)`` when a stored hash fires. For every hash we keep
+``[count, last_ts, prev_ts]`` (``prev_ts`` = the hit before the last one), which
+is enough for both eviction policies:
+
+- ``lru2`` (LRU-K, K=2): rank by the time of the 2nd most recent hit; hashes hit
+  fewer than twice rank below all others, older single hits first. One burst of
+  reposts does not keep a hash alive forever, a hash hit every day does.
+- ``lfu``: hit count decayed by HIT_STATS_HALF_LIFE_D since the last hit.
+
+``score(h)`` returns a sortable key (higher = keep); never-hit hashes all share
+the lowest key so callers can tie-break on their own order. ``hot(values)``
+orders hashes hottest first for linear scans.
+
+Persistence is cheap: counters live in memory and are written as one JSON file
+(atomic replace) at most every HIT_STATS_FLUSH_SEC, only when dirty.
+
+ENV:
+- HIT_STATS_PATH        : counters file, default data/phash_hits.json
+- HIT_STATS_POLICY      : lru2 | lfu, default lru2
+- HIT_STATS_HALF_LIFE_D : lfu decay half-life in days, default 14
+- HIT_STATS_FLUSH_SEC   : min seconds between writes, default 60
+"""
+from __future__ import annotations
+import os, json, time, logging, threading
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from nixe.helpers.phash_index import to_hex, to_int
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+PATH = os.getenv("HIT_STATS_PATH", "data/phash_hits.json")
+POLICY = (os.getenv("HIT_STATS_POLICY", "lru2") or "lru2").strip().lower()
+HALF_LIFE_SEC = max(1, _env_int("HIT_STATS_HALF_LIFE_D", 14)) * 86400
+FLUSH_SEC = max(0, _env_int("HIT_STATS_FLUSH_SEC", 60))
+
+_NEVER = (0, 0.0, 0.0)
+
+def _key(h: Union[str, int]) -> Optional[str]:
+    """Canonical key: 16-hex for 64-bit hashes, stripped lowercase string otherwise."""
+    if isinstance(h, int):
+        v = to_int(h)
+        return to_hex(v) if v is not None else None
+    return str(h or "").strip().lower() or None
+
+class HitStats:
+    """In-memory ``{hash: [count, last_ts, prev_ts]}`` with lazy JSON persistence."""
+
+    def __init__(self, path: Optional[str] = PATH, *, policy: str = POLICY, flush_sec: int = FLUSH_SEC):
+        self.path = path
+        self.policy = policy if policy in ("lru2", "lfu") else "lru2"
+        self.flush_sec = flush_sec
+        self._d: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+        self._saved_at = 0.0
+        self.generation = 0        # bumps on every hit; indexes re-sort when it moves
+
+    # ------------------------------------------------------------ persistence
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                obj = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            log.warning("[hit-stats] %s unreadable, starting empty: %r", self.path, e)
+            return
+        for h, rec in (obj.get("hits") or {}).items() if isinstance(obj, dict) else ():
+            try:
+                c, last, prev = (list(rec) + [0, 0, 0])[:3]
+                self._d[str(h)] = [int(c), float(last), float(prev)]
+            except Exception:
+                pass
+
+    def save(self) -> bool:
+        """Write the counters now (atomic replace). Returns False on I/O failure."""
+        if not self.path:
+            return True
+        with self._lock:
+            self._load()
+            data = {"v": 1, "hits": {h: [int(r[0]), round(r[1], 1), round(r[2], 1)] for h, r in self._d.items()}}
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        try:
+            d = os.path.dirname(self.path)
+            if d: os.makedirs(d, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            return True
+        except Exception as e:
+            self._dirty = True
+            log.warning("[hit-stats] save %s failed: %r", self.path, e)
+            return False
+
+    def maybe_save(self) -> None:
+        if self._dirty and time.monotonic() - self._saved_at >= self.flush_sec:
+            self.save()
+
+    # ------------------------------------------------------------ recording
+
+    def hit(self, h: Union[str, int], ts: Optional[float] = None) -> int:
+        """Record one hit of stored hash ``h``; returns its new count."""
+        k = _key(h)
+        if not k:
+            return 0
+        ts = time.time() if ts is None else float(ts)
+        with self._lock:
+            self._load()
+            r = self._d.get(k)
+            if r is None:
+                r = self._d[k] = [0, 0.0, 0.0]
+            r[0] += 1
+            r[2], r[1] = r[1], ts
+            self._dirty = True
+            self.generation += 1
+            n = int(r[0])
+        self.maybe_save()
+        return n
+
+    def merge(self, into: Union[str, int], members: Iterable[Union[str, int]]) -> None:
+        """Fold the counters of ``members`` into ``into`` (e.g. after compaction absorbed them)."""
+        k = _key(into)
+        if not k:
+            return
+        with self._lock:
+            self._load()
+            recs = [self._d.pop(m, None) for m in (_key(x) for x in members) if m and m != k]
+            recs = [r for r in recs if r]
+            if not recs:
+                return
+            r = self._d.setdefault(k, [0, 0.0, 0.0])
+            times = sorted([r[1], r[2]] + [t for x in recs for t in x[1:3]], reverse=True)
+            r[0] += sum(int(x[0]) for x in recs)
+            r[1], r[2] = times[0], times[1]
+            self._dirty = True
+
+    def drop(self, hashes: Iterable[Union[str, int]]) -> int:
+        """Forget the counters of evicted hashes; returns how many existed."""
+        n = 0
+        with self._lock:
+            self._load()
+            for k in (_key(h) for h in hashes):
+                if k and self._d.pop(k, None) is not None:
+                    n += 1
+            if n: self._dirty = True
+        return n
+
+    # ------------------------------------------------------------ ranking
+
+    def get(self, h: Union[str, int]) -> Tuple[int, float, float]:
+        """``(count, last_ts, prev_ts)``; zeros if never hit."""
+        self._load()
+        r = self._d.get(_key(h) or "")
+        return (int(r[0]), r[1], r[2]) if r else _NEVER
+
+    def score(self, h: Union[str, int], now: Optional[float] = None) -> Tuple[int, float, float]:
+        """Sortable retention key, higher = keep longer (see module docstring)."""
+        c, last, prev = self.get(h)
+        if not c:
+            return (0, 0.0, 0.0)
+        if self.policy == "lfu":
+            now = time.time() if now is None else now
+            return (1, c * 0.5 ** (max(0.0, now - last) / HALF_LIFE_SEC), last)
+        return (2, prev, last) if c >= 2 else (1, last, 0.0)
+
+    def hot(self, values: Iterable) -> List:
+        """``values`` ordered hottest first (stable for ties, never-hit keep their order)."""
+        now = time.time()
+        return sorted(values, key=lambda v: self.score(v, now), reverse=True)
+
+    def __len__(self) -> int:
+        self._load()
+        return len(self._d)
+
+STATS = HitStats()
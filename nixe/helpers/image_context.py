@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+image_context — decode an image once, derive every hash/heuristic view from it.
+
+``ImageContext.of(data)`` opens the bytes a single time and caches the derived
+views: grayscale resizes (32x32 for pHash, 9x8 for dHash, 8x8 for aHash), the
+HSV downscale used by the colour/layout heuristics and the animation frame list.
+Helpers in ``img_hashing``, ``hash_utils``, ``phash_tools``,
+``lucky_pull_color_heur`` and ``gacha_layout_heur`` accept either raw bytes or
+an ``ImageContext``.
+
+Contexts for the last few byte buffers are kept in a tiny identity-keyed LRU, so
+cogs that receive the same shared bytes from ``attachment_store`` also share
+the decode.
+
+Hash views never need the full resolution: ``luma()`` (and with it every
+``gray`` / ``gray_array`` view) comes from ``open_image(data, IMAGE_DECODE_PX)``,
+which lets libjpeg decode JPEGs at 1/2..1/8 scale via ``draft()`` and box-
+``reduce()``s other formats, keeping both sides >= IMAGE_DECODE_PX. Every open
+first checks the header size against IMAGE_MAX_PIXELS, so decompression bombs
+are rejected before any pixel is decoded.
+
+Animations are sampled, not walked frame by frame: ``frames(n)`` keeps frame 0
+plus the distinct frames displayed longest, anywhere in the animation, each
+box-reduced to a small working size (see ``_sample_frames``).
+
+ENV:
+- IMAGE_CTX_CACHE      : number of recent contexts kept, default 4
+- IMAGE_DECODE_PX      : minimum side of the reduced decode used for hashing, default 256
+- IMAGE_MAX_PIXELS     : refuse images with more pixels than this, default 64000000
+- IMAGE_FRAME_SCAN_MAX : frames inspected per animation (strided beyond), default 240
+- IMAGE_FRAME_MAX_PX   : long side of sampled frame copies, default 256
+"""
+from __future__ import annotations
+import io, os, threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+try:
+    from PIL import Image, ImageSequence
+except Exception:
+    Image = None; ImageSequence = None
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+CACHE_SIZE = max(0, _env_int("IMAGE_CTX_CACHE", 4))
+
+DECODE_PX = max(32, _env_int("IMAGE_DECODE_PX", 256))
+MAX_PIXELS = max(0, _env_int("IMAGE_MAX_PIXELS", 64_000_000))
+FRAME_SCAN_MAX = max(8, _env_int("IMAGE_FRAME_SCAN_MAX", 240))
+FRAME_MAX_PX = max(32, _env_int("IMAGE_FRAME_MAX_PX", 256))
+
+_cache: "OrderedDict[int, Tuple[bytes, ImageContext]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def open_image(src, min_px: int = 0, max_pixels: Optional[int] = None):
+    """Open ``src`` (bytes, path or file object), decoding only as much as needed.
+
+    Raises ``Image.DecompressionBombError`` when the header announces more than
+    ``max_pixels`` (default IMAGE_MAX_PIXELS; 0 = no cap). With ``min_px`` a
+    still image is decoded near that size: JPEG via ``draft()``, anything else
+    via an integer ``reduce()``; both keep each side >= ``min_px``.
+    Animations are returned as opened (frames are sampled separately).
+    """
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = io.BytesIO(src)
+    im = Image.open(src)
+    cap = MAX_PIXELS if max_pixels is None else int(max_pixels)
+    w, h = im.size
+    if cap and w * h > cap:
+        raise Image.DecompressionBombError(f"{w}x{h} exceeds {cap} pixels")
+    if not min_px or getattr(im, "is_animated", False):
+        return im
+    if im.format == "JPEG":
+        im.draft(im.mode, (min_px, min_px))
+    k = min(im.size) // int(min_px)
+    if k >= 2:
+        if im.mode == "P":
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        elif im.mode not in ("L", "LA", "RGB", "RGBA", "RGBX", "I", "F"):
+            im = im.convert("RGB")
+        im = im.reduce(k)
+    return im
+
+def _frame_sig(fr) -> bytes:
+    """Coarse 16x16 thumbnail; equal signatures = visually the same frame."""
+    th = fr.resize((16, 16), Image.NEAREST).convert("L")
+    return (np.asarray(th, dtype=np.uint8) >> 4).tobytes() if np is not None else th.tobytes()
+
+def _frame_copy(fr):
+    """Detached frame, box-reduced so the long side is <= FRAME_MAX_PX."""
+    if fr.mode == "P":
+        fr = fr.convert("RGBA" if "transparency" in fr.info else "RGB")
+    k = -(-max(fr.size) // FRAME_MAX_PX)
+    return fr.reduce(k) if k > 1 else fr.copy()
+
+def _sample_frames(im, max_frames: int) -> list:
+    """Pick up to ``max_frames`` frames of an animation without copying every frame.
+
+    - stride: at most FRAME_SCAN_MAX frames are inspected, evenly spread over
+      ``n_frames``, so late payload frames of long animations are still seen
+    - duplicates: a frame whose 16x16 signature was already seen stops right
+      there (no copy, no hash); its display time is added to the first copy
+    - keyframes: frame 0 is always kept (legacy hashes), the other slots go to
+      the distinct frames shown longest; only those are copied
+
+    There is deliberately no "animation looped, stop" shortcut: scam GIFs loop
+    a harmless spinner and show the payload once, late.
+    """
+    n = max(1, int(getattr(im, "n_frames", 1) or 1))
+    if n <= FRAME_SCAN_MAX:
+        idxs = range(n)
+    else:
+        idxs = sorted({int(round(i * (n - 1) / (FRAME_SCAN_MAX - 1))) for i in range(FRAME_SCAN_MAX)})
+    best: Dict[bytes, list] = {}   # sig -> [total_ms, first_idx, copy or None]
+    seq: List[bytes] = []
+    for i in idxs:
+        try:
+            im.seek(i)
+        except EOFError:
+            break
+        sig = _frame_sig(im)
+        seq.append(sig)
+        dur = int(im.info.get("duration") or 0) or 100
+        e = best.get(sig)
+        if e is not None:       # duplicate: exit after the signature, no copy / hash
+            e[0] += dur
+            continue
+        e = best[sig] = [dur, i, None]
+        # copy only frames that can still make the cut (frame 0 always)
+        ranked = sorted((v for k, v in best.items() if k != seq[0]), key=lambda v: (-v[0], v[1]))
+        keep = {id(v) for v in ranked[: max_frames - 1]}
+        if sig == seq[0] or id(e) in keep:
+            e[2] = _frame_copy(im)
+        for v in ranked[max_frames - 1:]:
+            v[2] = None
+    if not seq:
+        return []
+    first = seq[0]
+    # durations may have grown after the copy decision; frames not copied are re-read
+    ranked = sorted((v for k, v in best.items() if k != first), key=lambda v: (-v[0], v[1]))
+    chosen = sorted([best[first]] + ranked[: max_frames - 1], key=lambda v: v[1])
+    out = []
+    for v in chosen:
+        if v[2] is None:
+            try:
+                im.seek(v[1]); v[2] = _frame_copy(im)
+            except EOFError:
+                continue
+        out.append(v[2])
+    try: im.seek(0)
+    except Exception: pass
+    return out
+
+class ImageContext:
+    """One decoded image (or animation frame) plus its cached derived views."""
+
+    def __init__(self, data: bytes = b"", image=None):
+        self.data = data
+        self._image = image
+        self._lock = threading.RLock()
+        self._views: Dict[tuple, object] = {}
+        self._frames: Dict[int, List["ImageContext"]] = {}
+
+    @classmethod
+    def of(cls, data: Union[bytes, "ImageContext", None]) -> Optional["ImageContext"]:
+        """Return a context for ``data`` (bytes or an existing context), or None."""
+        if isinstance(data, ImageContext):
+            return data
+        if not data or Image is None:
+            return None
+        if not CACHE_SIZE:
+            return cls(data)
+        key = id(data)
+        with _cache_lock:
+            hit = _cache.get(key)
+            if hit is not None and hit[0] is data:
+                _cache.move_to_end(key)
+                return hit[1]
+            ctx = cls(data)
+            _cache[key] = (data, ctx)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+            return ctx
+
+    # ---- base image ----
+    @property
+    def image(self):
+        with self._lock:
+            if self._image is None:
+                self._image = open_image(self.data)
+            return self._image
+
+    @property
+    def small(self):
+        """Reduced decode (both sides >= IMAGE_DECODE_PX) for hash views; ``image`` for animations/frames."""
+        if not self.data:
+            return self.image
+        with self._lock:
+            if self.is_animated:
+                return self.image
+            return self._view(("small",), lambda: open_image(self.data, DECODE_PX))
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    @property
+    def is_animated(self) -> bool:
+        return bool(getattr(self.image, "is_animated", False))
+
+    def _view(self, key: tuple, build):
+        with self._lock:
+            v = self._views.get(key)
+            if v is None:
+                v = build()
+                self._views[key] = v
+            return v
+
+    def derived(self, key: tuple, build):
+        """Cache a caller-defined view (e.g. augmentation variants) under ``key``."""
+        return self._view(("ext",) + tuple(key), build)
+
+    # ---- derived views ----
+    def frames(self, max_frames: int = 6) -> List["ImageContext"]:
+        """Up to ``max_frames`` representative frames as child contexts (``[self]`` for stills).
+
+        See ``_sample_frames``: frame 0 plus the distinct frames shown longest,
+        in animation order, downscaled to IMAGE_FRAME_MAX_PX.
+        """
+        max_frames = max(1, int(max_frames))
+        with self._lock:
+            if not self.is_animated:
+                return [self]
+            out = self._frames.get(max_frames)
+            if out is None:
+                out = self._frames[max_frames] = [ImageContext(image=im) for im in _sample_frames(self.image, max_frames)]
+            return out
+
+    def thumb(self, max_px: int = 256) -> "ImageContext":
+        """Child context of the reduced decode, box-reduced so the long side is <= ``max_px`` (cheap heuristics)."""
+        def build():
+            if self.data and not self.is_animated:
+                # decode just large enough for the thumbnail (JPEG draft can go down to 1/8)
+                w, h = self.size
+                im = open_image(self.data, max(1, int(max_px) * min(w, h) // max(w, h, 1)))
+            else:
+                im = self.small
+            if im.mode == "P":
+                im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+            k = -(-max(im.size) // int(max_px))
+            return ImageContext(image=im.reduce(k) if k > 1 else im)
+        return self._view(("thumb", int(max_px)), build)
+
+    def luma(self):
+        """Grayscale ('L') of the reduced decode; what all ``gray`` views are resized from."""
+        return self._view(("L",), lambda: self.small.convert("L"))
+
+    def rgb(self):
+        return self._view(("RGB",), lambda: self.image.convert("RGB"))
+
+    def gray(self, size: Tuple[int, int] = (32, 32), resample=None):
+        """Grayscale resized to ``size``; ``resample=None`` keeps Pillow's default filter."""
+        size = (int(size[0]), int(size[1]))
+        return self._view(("gray", size, resample), lambda: self.luma().resize(size, resample))
+
+    def gray_array(self, size: Tuple[int, int] = (32, 32), resample=None):
+        """``gray(size, resample)`` as a uint8 numpy array of shape (h, w)."""
+        return self._view(("gray_np", tuple(size), resample),
+                          lambda: np.asarray(self.gray(size, resample), dtype=np.uint8))
+
+    def hsv(self, max_px: int = 768):
+        """HSV uint8 array of the image downscaled (bilinear) to at most ``max_px`` on the long side."""
+        def build():
+            img = self.image
+            w, h = img.size
+            if max(w, h) > max_px:
+                scale = max_px / float(max(w, h))
+                img = img.resize((int(w * scale), int(h * scale)), Image.BILINEAR)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            return np.array(img.convert("HSV"), dtype=np.uint8)
+        return self._view(("hsv", int(max_px)), build)
+
+def derive_many(data, jobs) -> list:
+    """Decode ``data`` once and run every ``(fn, args, kwargs)`` job on that one context.
+
+    Module-level so ``hash_pool`` can run it in a worker: the bytes are pickled
+    and decoded once for all the hashes of an image. Returns ``(True, result)``
+    or ``(False, error)`` per job, in order.
+    """
+    ctx = ImageContext.of(data) or data
+    out = []
+    for fn, args, kwargs in jobs:
+        try:
+            out.append((True, fn(ctx, *(args or ()), **(kwargs or {}))))
+        except Exception as e:
+            out.append((False, f"{type(e).__name__}: {e}"))
+    return out
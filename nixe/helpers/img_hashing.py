@@ -1,44 +1,187 @@
 import io
-from typing import List, Set
+from functools import lru_cache
+from typing import List, Optional, Set, Tuple
 try:
     from PIL import Image, ImageSequence
 except Exception:
     Image=None; ImageSequence=None
 try:
-    import imagehash
+    import numpy as np
+    from nixe.helpers import np_hash
 except Exception:
-    imagehash=None
-
-def dhash_list_from_bytes(data:bytes,max_frames:int=6)->List[str]:
-    out=[]
-    if not data or not Image: return out
-    def _d(img):
-        g=img.convert('L').resize((9,8)); px=list(g.getdata()); w,h=g.size; bits=[]
-        for y in range(h):
-            row=px[y*w:(y+1)*w]
-            for x in range(w-1): bits.append(1 if row[x]<row[x+1] else 0)
-        v=0
-        for b in bits: v=(v<<1)|b
-        return f"{v:0{len(bits)//4}x}"
-    im=Image.open(io.BytesIO(data))
-    frames=ImageSequence.Iterator(im) if getattr(im,'is_animated',False) else [im]
-    seen=set(); c=0
-    for fr in frames:
-        hs=_d(fr.copy())
-        if hs and hs not in seen: seen.add(hs); out.append(hs)
-        c+=1
-        if c>=max_frames: break
-    return out
+    np=None; np_hash=None
+from nixe.helpers.image_context import ImageContext
 
-def phash_list_from_bytes(data:bytes,max_frames:int=6)->List[str]:
-    out=[]
-    if not data or not Image or not imagehash: return out
-    im=Image.open(io.BytesIO(data))
-    frames=ImageSequence.Iterator(im) if getattr(im,'is_animated',False) else [im]
-    seen=set(); c=0
-    for fr in frames:
-        h=str(imagehash.phash(fr.copy().convert('RGB')))
+def _uniq_hex(vals)->List[str]:
+    out=[]; seen=set()
+    for v in vals:
+        h=np_hash.to_hex(v)
         if h not in seen: seen.add(h); out.append(h)
-        c+=1
-        if c>=max_frames: break
     return out
+
+# ---- registration-time augmentation ----
+# Reposts are often re-cropped, slightly rotated, mirrored, re-compressed or
+# brightened. Instead of searching wider at lookup time, the registering side
+# (a12 inbox / a13 reseed) also stores the hashes of such variants, so the
+# per-message check stays one radius query. Variants are applied in this order
+# and ``augment_per_frame`` takes the first N; photometric ones act on the
+# final small view, geometric ones on a <=AUG_WORK_PX working copy of the frame.
+AUGMENTS=("recrop","rot+","rot-","hflip","jpeg","bright+","bright-")
+AUG_WORK_PX=256
+AUG_CROP=0.06        # recrop: fraction cut from every side
+AUG_ROT_DEG=3.0
+AUG_JPEG_Q=60
+AUG_BRIGHT=24        # gray levels
+
+def _aug_work(fr:ImageContext):
+    def build():
+        im=fr.luma()
+        if max(im.size)>AUG_WORK_PX:
+            sc=AUG_WORK_PX/float(max(im.size))
+            im=im.resize((max(1,int(im.width*sc)),max(1,int(im.height*sc))),Image.BILINEAR)
+        return im
+    return fr.derived(("aug_work",),build)
+
+def _aug_image(fr:ImageContext,name:str):
+    """Geometric / re-encode variant of the frame's working copy (None for photometric ones)."""
+    def build():
+        im=_aug_work(fr); w,h=im.size
+        if name=="recrop":
+            dx,dy=int(round(w*AUG_CROP)),int(round(h*AUG_CROP))
+            return im.crop((dx,dy,max(dx+1,w-dx),max(dy+1,h-dy)))
+        if name in ("rot+","rot-"):
+            deg=AUG_ROT_DEG if name=="rot+" else -AUG_ROT_DEG
+            return im.rotate(deg,resample=Image.BICUBIC,fillcolor=int(np.asarray(im).mean()))
+        if name=="hflip":
+            return im.transpose(Image.FLIP_LEFT_RIGHT)
+        if name=="jpeg":
+            buf=io.BytesIO(); im.save(buf,"JPEG",quality=AUG_JPEG_Q)
+            return Image.open(io.BytesIO(buf.getvalue())).convert("L")
+        return None
+    return fr.derived(("aug",name),build)
+
+def _views(fr:ImageContext,size,resample=None,augment:int=0)->list:
+    """The frame's ``size`` gray view followed by its first ``augment`` variants."""
+    base=fr.gray_array(size,resample)
+    out=[base]
+    for name in AUGMENTS[:max(0,int(augment))]:
+        if name in ("bright+","bright-"):
+            d=AUG_BRIGHT if name=="bright+" else -AUG_BRIGHT
+            out.append(np.clip(base.astype(np.int16)+d,0,255).astype(np.uint8))
+        else:
+            out.append(np.asarray(_aug_image(fr,name).resize(tuple(size),resample),dtype=np.uint8))
+    return out
+
+def _n_aug(augment,augment_per_frame)->int:
+    return max(0,int(augment_per_frame)) if augment else 0
+
+def dhash_u64_from_frames(frames,augment:int=0)->"np.ndarray":
+    """uint64 dHash (``left < right``) per ImageContext frame (+ ``augment`` variants each), in a single batch."""
+    return np_hash.dhash_batch([v for fr in frames for v in _views(fr,(9,8),None,augment)])
+
+def phash_u64_from_frames(frames,augment:int=0)->"np.ndarray":
+    """uint64 pHash (32x32 LANCZOS + DCT) per ImageContext frame (+ ``augment`` variants each), in a single batch."""
+    return np_hash.phash_batch([v for fr in frames for v in _views(fr,(32,32),Image.LANCZOS,augment)])
+
+def dhash_list_from_bytes(data,max_frames:int=6,augment:bool=False,augment_per_frame:int=0)->List[str]:
+    """dHash per frame (and per variant with ``augment``); ``data`` is raw bytes or an ImageContext."""
+    if np_hash is None: return []
+    ctx=ImageContext.of(data)
+    if ctx is None: return []
+    return _uniq_hex(dhash_u64_from_frames(ctx.frames(max_frames),_n_aug(augment,augment_per_frame)))
+
+def phash_list_from_bytes(data,max_frames:int=6,augment:bool=False,augment_per_frame:int=0)->List[str]:
+    """pHash per frame (and per variant with ``augment``); ``data`` is raw bytes or an ImageContext."""
+    if np_hash is None: return []
+    ctx=ImageContext.of(data)
+    if ctx is None: return []
+    return _uniq_hex(phash_u64_from_frames(ctx.frames(max_frames),_n_aug(augment,augment_per_frame)))
+
+def phash_dihedral_list_from_bytes(data,max_frames:int=1)->List[str]:
+    """pHash of every flip/rotation of each frame (upright first), for mirrored / rotated reposts.
+
+    Query-side only: the board keeps upright hashes, the 7 extra variants come
+    from the same DCT coefficients (np_hash.dihedral_lowfreq)."""
+    if np_hash is None: return []
+    ctx=ImageContext.of(data)
+    if ctx is None: return []
+    views=[fr.gray_array((32,32),Image.LANCZOS) for fr in ctx.frames(max_frames)]
+    return _uniq_hex(np_hash.phash_dihedral_batch(views).reshape(-1)) if views else []
+
+# ---- tile pHash (tphash) ----
+# One token per frame: "<g>x<g>:" + g*g 16-hex tile pHashes (row-major); tiles
+# too flat to carry information are stored as "-"*16 so positions stay fixed.
+#
+# Matching a repost: assume the upload is the original with margins cut off
+# (crop) or added (pad/border) on each side, re-tile the upload under every
+# such hypothesis and let TileIndex vote per hypothesis. All tiles of all
+# hypotheses come from one np_hash.tile_lowfreq call (two matrix products).
+TILE_MIN_STD=4.0
+TILE_MARGINS=(0.04,0.08,0.12,0.16)   # fraction of the upload per side; + = cropped, - = padded
+_TILE_TOL=0.02                        # tiles may poke this far past the upload's edge
+_FLAT="-"*16
+
+@lru_cache(maxsize=8)
+def _tile_axis(grid:int,margins:Tuple[float,...]):
+    """Per-axis ``(ranges, in_bounds)`` for every (before, after) margin pair, ``grid`` ranges each.
+
+    Pairs: none, both sides, either side alone, each as crop (+m) or pad (-m).
+    """
+    pairs=[(0.0,0.0)]
+    for m in margins:
+        pairs+=[(m,m),(-m,-m),(m,0.0),(0.0,m),(-m,0.0),(0.0,-m)]
+    ranges=[]; ok=[]
+    for a,b in pairs:
+        lo=-a; w=(1.0+a+b)/grid
+        for i in range(grid):
+            l,h=lo+i*w,lo+(i+1)*w
+            ok.append(l>=-_TILE_TOL and h<=1.0+_TILE_TOL)
+            ranges.append((max(0.0,l),min(1.0,h)))
+    return tuple(ranges),np.array(ok),len(pairs)
+
+def tile_phash_u64_from_frames(frames,grid:int=3,margins:Tuple[float,...]=(),augment:int=0):
+    """``(hashes, valid)`` shaped (views, hypotheses, grid*grid); hypothesis 0 is the image as-is.
+
+    Views are the frames, each followed by its first ``augment`` variants.
+    """
+    ranges,ok,n=_tile_axis(grid,tuple(margins))
+    n_px=48*grid
+    views=[v for fr in frames for v in _views(fr,(n_px,n_px),Image.LANCZOS,augment)]
+    low=np_hash.tile_lowfreq(np.stack(views),ranges)
+    F=len(views)
+    hs=np_hash.phash_from_lowfreq(low)
+    valid=(np_hash.lowfreq_std(low)>=TILE_MIN_STD)&ok[None,:,None]&ok[None,None,:]
+    # (F, n*g, n*g) -> (F, n_rows*n_cols, g*g): hypothesis = (row pair, column pair)
+    def regroup(x): return x.reshape(F,n,grid,n,grid).transpose(0,1,3,2,4).reshape(F,n*n,grid*grid)
+    return regroup(hs),regroup(valid)
+
+def tile_token(hashes,mask,grid:int)->str:
+    return f"{grid}x{grid}:"+"".join(np_hash.to_hex(h) if ok else _FLAT for h,ok in zip(hashes,mask))
+
+def tile_phash_list_from_bytes(data,grid:int=3,max_frames:int=4,augment:bool=False,augment_per_frame:int=0)->List[str]:
+    """Tile-pHash token per frame (and variant) for the DB ``tphash`` array; ``data`` is raw bytes or an ImageContext."""
+    if np_hash is None: return []
+    ctx=ImageContext.of(data)
+    if ctx is None: return []
+    grid=max(1,int(grid)); out=[]; seen=set()
+    frames=ctx.frames(max_frames)
+    if not frames: return []
+    hs,valid=tile_phash_u64_from_frames(frames,grid,augment=_n_aug(augment,augment_per_frame))
+    for h,m in zip(hs[:,0],valid[:,0]):
+        if m.sum()<2: continue
+        tok=tile_token(h,m,grid)
+        if tok not in seen: seen.add(tok); out.append(tok)
+    return out
+
+def tile_query_from_bytes(data,grid:int=3,max_frames:int=1)->List[List[Optional[int]]]:
+    """Tile hashes of every crop/pad hypothesis (None = flat or off-image), for ``TileIndex.match``."""
+    if np_hash is None: return []
+    ctx=ImageContext.of(data)
+    if ctx is None: return []
+    frames=ctx.frames(max_frames)
+    if not frames: return []
+    grid=max(1,int(grid))
+    hs,valid=tile_phash_u64_from_frames(frames,grid,TILE_MARGINS)
+    hs=hs.reshape(-1,grid*grid); valid=valid.reshape(-1,grid*grid)
+    keep=valid.sum(axis=1)>=2
+    return [[int(h) if ok else None for h,ok in zip(r,m)] for r,m in zip(hs[keep],valid[keep])]
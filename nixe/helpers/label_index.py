@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+label_index — one index of labeled hashes (phish / lucky / negative).
+
+Lucky-pull false-positive suppression used to look in three places: the
+``LPG_NEG_*`` env lists (a15 overlay), the whitelist-thread file written by
+``lpg_whitelist_ingestor`` and the positive ahash memory of ``lpg_memory``.
+``LabeledIndex`` holds all of them, plus the phishing board (``phash_db``), as
+pre-parsed ``uint64`` arrays per hash kind (``phash``/``ahash``/``dhash``) with
+a label code per entry. ``nearest`` answers "closest labeled hash within
+radius" for several query hashes of several kinds in one vectorised pass;
+equal distances resolve negative > phish > lucky, so a whitelist entry wins a
+tie. ``sha256`` entries are exact-match only.
+
+Sources are refreshed independently and only when they change:
+- ``env``    : LPG_NEG_PHASHES / LPG_NEG_AHASHES / LPG_NEG_DHASHES / LPG_NEG_SHA256 (negative)
+- ``negfile``: LPG_NEG_FILE lines ``kind:hex  # meta`` (negative), on mtime change
+               or when LPG_NEG_TOUCH_FILE is touched
+- ``memory`` : ``lpg_memory.S.items`` ahashes (lucky), on ``S.version`` change
+- ``board``  : pHash DB board phash/dhash (phish), on ``phash_db`` reload
+
+``get()`` returns the shared index after a cheap staleness check (at most every
+LABEL_INDEX_CHECK_SEC).
+
+ENV:
+- LABEL_INDEX_CHECK_SEC : min seconds between source checks, default 5
+- LPG_NEG_FILE          : default data/lpg_negative_hashes.txt
+- LPG_NEG_TOUCH_FILE    : default data/lpg_neg_reload.touch
+"""
+from __future__ import annotations
+import os, time, logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+from nixe.helpers.env_reader import get as env_get
+from nixe.helpers.phash_index import _popcount64, hamming, to_hex, to_int
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+CHECK_SEC = max(0, _env_int("LABEL_INDEX_CHECK_SEC", 5))
+
+NEGATIVE, PHISH, LUCKY = "negative", "phish", "lucky"
+LABELS = (NEGATIVE, PHISH, LUCKY)          # code = position = tie-break rank
+KINDS = ("phash", "ahash", "dhash")
+
+class Hit(NamedTuple):
+    label: str
+    hash: str
+    dist: int
+    kind: str
+    source: str
+
+Entry = Tuple[str, str, int]               # (kind, label, value)
+
+class LabeledIndex:
+    """Labeled 64-bit hashes grouped by kind, replaced per source."""
+
+    def __init__(self):
+        self._src: Dict[str, List[Entry]] = {}
+        self._exact: Dict[str, Dict[str, str]] = {}      # source -> {sha256: label}
+        self._arr: Dict[str, tuple] = {}                  # kind -> (values, label codes, source codes)
+        self._counts: Dict[tuple, int] = {}
+        self._src_names: List[str] = []
+        self.sigs: Dict[str, object] = {}
+
+    def set_source(self, name: str, entries: Iterable[Entry], exact: Optional[Dict[str, str]] = None) -> int:
+        """Replace everything contributed by source ``name``; returns its entry count."""
+        ents = [(k, lb, v) for k, lb, v in entries if k in KINDS and lb in LABELS and v is not None]
+        self._src[name] = ents
+        self._exact[name] = dict(exact or {})
+        self._arr.clear(); self._counts.clear()
+        return len(ents)
+
+    def _arrays(self, kind: str):
+        a = self._arr.get(kind)
+        if a is None:
+            self._src_names = list(self._src)
+            rows = [(v, LABELS.index(lb), si) for si, s in enumerate(self._src_names)
+                    for k, lb, v in self._src[s] if k == kind]
+            if np is not None:
+                a = (np.fromiter((r[0] for r in rows), dtype=np.uint64, count=len(rows)),
+                     np.fromiter((r[1] for r in rows), dtype=np.int8, count=len(rows)),
+                     np.fromiter((r[2] for r in rows), dtype=np.int16, count=len(rows)))
+            else:
+                a = tuple(list(c) for c in zip(*rows)) if rows else ([], [], [])
+            self._arr[kind] = a
+        return a
+
+    def count(self, kind: Optional[str] = None, label: Optional[str] = None) -> int:
+        """Entries of ``kind`` (any kind incl. sha256 when None) carrying ``label``."""
+        key = (kind, label)
+        n = self._counts.get(key)
+        if n is None:
+            n = sum(1 for ents in self._src.values() for k, lb, _ in ents
+                    if (kind is None or k == kind) and (label is None or lb == label))
+            if kind in (None, "sha256"):
+                n += sum(1 for d in self._exact.values() for lb in d.values() if label is None or lb == label)
+            self._counts[key] = n
+        return n
+
+    def has(self, kind: str) -> bool:
+        return len(self._arrays(kind)[0]) > 0
+
+    def exact(self, sha: str) -> Optional[Hit]:
+        s = str(sha or "").strip().lower()
+        for name, d in self._exact.items():
+            lb = d.get(s)
+            if lb:
+                return Hit(lb, s, 0, "sha256", name)
+        return None
+
+    def nearest(self, queries: Dict[str, Iterable[Union[str, int]]], radius: Union[int, Dict[str, int]] = 0,
+                labels: Optional[Iterable[str]] = None) -> Optional[Hit]:
+        """Closest labeled hash within ``radius`` over ``{kind: [hashes]}``; ties go to the stronger label."""
+        want = {LABELS.index(lb) for lb in labels} if labels is not None else None
+        best: Optional[Tuple[int, int, Hit]] = None
+        for kind, hs in queries.items():
+            r = radius.get(kind, 0) if isinstance(radius, dict) else radius
+            qs = [q for q in (to_int(h) for h in hs or ()) if q is not None]
+            vals, codes, srcs = self._arrays(kind) if kind in KINDS else ([], [], [])
+            if not qs or not len(vals):
+                continue
+            if np is not None:
+                D = _popcount64(np.asarray(qs, dtype=np.uint64)[:, None] ^ vals[None, :]).min(axis=0)
+                ok = D <= max(0, int(r))
+                if want is not None:
+                    ok &= np.isin(codes, list(want))
+                idx = np.nonzero(ok)[0]
+                if not len(idx):
+                    continue
+                j = idx[np.lexsort((codes[idx], D[idx]))[0]]
+                d, c, s, v = int(D[j]), int(codes[j]), int(srcs[j]), int(vals[j])
+            else:
+                cand = [(min(hamming(q, v) for q in qs), c, s, v) for v, c, s in zip(vals, codes, srcs)
+                        if want is None or c in want]
+                cand = [t for t in cand if t[0] <= r]
+                if not cand:
+                    continue
+                d, c, s, v = min(cand)
+            if best is None or (d, c) < best[:2]:
+                best = (d, c, Hit(LABELS[c], to_hex(v), d, kind, self._src_names[s]))
+        return best[2] if best else None
+
+# ------------------------------------------------------------ sources
+
+def _hex_list(s: str) -> List[int]:
+    return [v for v in (to_int(x) for x in (s or "").replace(";", ",").split(",") if x.strip()) if v is not None]
+
+def _env_entries() -> Tuple[List[Entry], Dict[str, str]]:
+    ents: List[Entry] = []
+    for kind in KINDS:
+        ents += [(kind, NEGATIVE, v) for v in _hex_list(env_get("LPG_NEG_%sES" % kind.upper(), ""))]
+    exact = {s.strip().lower(): NEGATIVE for s in env_get("LPG_NEG_SHA256", "").split(",") if s.strip()}
+    return ents, exact
+
+def neg_file_path() -> str:
+    return env_get("LPG_NEG_FILE", "") or "data/lpg_negative_hashes.txt"
+
+def _touch_path() -> str:
+    return env_get("LPG_NEG_TOUCH_FILE", "") or "data/lpg_neg_reload.touch"
+
+def parse_neg_lines(lines: Iterable[str]) -> Tuple[List[Entry], Dict[str, str]]:
+    """``kind:hex  # meta`` lines (lpg_whitelist_ingestor format) -> negative entries."""
+    ents: List[Entry] = []
+    exact: Dict[str, str] = {}
+    for ln in lines:
+        s = ln.split("#", 1)[0].strip().lower()
+        kind, _, val = s.partition(":")
+        if not val:
+            continue
+        if kind == "sha256":
+            exact[val.strip()] = NEGATIVE
+        elif kind in KINDS:
+            v = to_int(val)
+            if v is not None:
+                ents.append((kind, NEGATIVE, v))
+    return ents, exact
+
+def _mtime(path: str):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _refresh(ix: LabeledIndex) -> None:
+    if "env" not in ix.sigs:
+        ents, exact = _env_entries()
+        ix.set_source("env", ents, exact)
+        ix.sigs["env"] = True
+
+    path = neg_file_path()
+    sig = (path, _mtime(path), _mtime(_touch_path()))
+    if ix.sigs.get("negfile") != sig:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                ents, exact = parse_neg_lines(f)
+        except FileNotFoundError:
+            ents, exact = [], {}
+        except Exception as e:
+            log.warning("[label-index] %s unreadable: %r", path, e)
+            ents, exact = ix._src.get("negfile", []), ix._exact.get("negfile", {})
+        n = ix.set_source("negfile", ents, exact)
+        ix.sigs["negfile"] = sig
+        log.info("[label-index] negfile reloaded: %d hash(es), %d sha256", n, len(exact))
+
+    try:
+        from nixe.helpers import lpg_memory
+        sig = lpg_memory.S.version
+        if ix.sigs.get("memory") != sig:
+            ix.set_source("memory", (("ahash", LUCKY, to_int(h)) for h in lpg_memory.S.items))
+            ix.sigs["memory"] = sig
+    except Exception as e:
+        log.debug("[label-index] lpg_memory unavailable: %r", e)
+
+    try:
+        from nixe.helpers import phash_db
+        sig = (phash_db.S.version, id(phash_db.S.dhash))
+        if ix.sigs.get("board") != sig:
+            ents = [("phash", PHISH, to_int(h)) for h in phash_db.S.phash]
+            ents += [("dhash", PHISH, to_int(h)) for h in phash_db.S.dhash]
+            ix.set_source("board", ents)
+            ix.sigs["board"] = sig
+    except Exception as e:
+        log.debug("[label-index] phash_db unavailable: %r", e)
+
+_INDEX = LabeledIndex()
+_checked = [0.0]
+
+def get(force: bool = False) -> LabeledIndex:
+    """The shared index, with changed sources reloaded."""
+    now = time.monotonic()
+    if force or not _INDEX.sigs or now - _checked[0] >= CHECK_SEC:
+        _checked[0] = now
+        _refresh(_INDEX)
+    return _INDEX
@@ -37,18 +37,32 @@ def _iter(order_csv: str):
             yield p, (_try_import("nixe.helpers.gemini_bridge_lucky_rules")
                       or _try_import("nixe.helpers.gemini_bridge")
                       or _try_import("nixe.helpers.lpg_provider"))
+        elif p == "local":
+            # offline NumPy model; answers only outside its uncertain band, else falls through
+            yield p, _try_import("nixe.helpers.lucky_model")
         elif p == "groq":
             yield p, (_try_import("nixe.helpers.groq_bridge")
                       or _try_import("nixe.helpers.lpg_provider"))
         else:
             yield p, _try_import(p)
 
+def _gemini_open() -> bool:
+    """True while the circuit breakers of all configured Gemini models are open (skip instead of timing out)."""
+    try:
+        from nixe.helpers import gemini_client
+        from nixe.helpers.gemini_bridge import gemini_models
+        return not gemini_client.available(gemini_models())
+    except Exception:
+        return False
+
 def classify_with_image_bytes(img_bytes: bytes, order: str = ""):
     try: os.environ.setdefault("LPG_SMOKE_FORCE_SAMPLE","0")
     except Exception: pass
     last = "provider_unavailable"
     for name, mod in _iter(order):
         if not mod: continue
+        if name == "gemini" and _gemini_open():
+            last = "gemini:circuit_open"; continue
         for fn_name in ("classify_lucky_pull_bytes","classify_image_bytes"):
             fn = getattr(mod, fn_name, None)
             if not fn: continue
@@ -5,7 +5,7 @@ try:
 except Exception:
     aiohttp=None
 MEM_KEY="lpg:mem:ahash:lucky"; FILE_FALLBACK="data/lpg_memory.json"
-class _S: loaded=False; dirty=False; items=[]
+class _S: loaded=False; dirty=False; items=[]; version=0  # version bumps on every change (label_index reloads)
 S=_S()
 async def _upstash_get():
     url=os.getenv("UPSTASH_REDIS_REST_URL"); tok=os.getenv("UPSTASH_REDIS_REST_TOKEN")
@@ -42,7 +42,7 @@ async def load():
     if S.loaded: return
     items=await _upstash_get()
     if items is None: items=_file_get()
-    S.items=list(dict.fromkeys(items)); S.loaded=True; S.dirty=False
+    S.items=list(dict.fromkeys(items)); S.loaded=True; S.dirty=False; S.version+=1
 async def save():
     if not S.loaded: return
     ok=await _upstash_set(S.items)
@@ -52,4 +52,4 @@ def remember(hash_hex: str, cap: int = 500):
     if hash_hex in S.items: return
     S.items.append(hash_hex); 
     if len(S.items)>cap: S.items=S.items[-cap:]
-    S.dirty=True
+    S.dirty=True; S.version+=1
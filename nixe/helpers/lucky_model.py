@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+lucky_model — offline lucky-pull classifier (NumPy logistic regression).
+
+A small local model that answers the clear cases so the LLM only sees the
+ambiguous ones. It is trained from our own labels by ``tools/train_lucky_model.py``:
+
+- ``record()`` appends labeled feature rows to LPG_MODEL_SAMPLES (JSONL, features
+  only, no image data). Rows come from moderator overrides (whitelist thread →
+  negative, ``src="whitelist"``) and confident provider verdicts
+  (``src="llm"``, collected by lucky_pull_auto when LPG_MODEL_COLLECT=1).
+- image folders: ``data/gacha_phash/prototypes`` (positive) plus any
+  ``--pos`` / ``--neg`` directories given to the CLI.
+
+Hash-only labels (lpg_memory ahashes, ``ahash:/dhash:`` lines of the negative
+file) have no pixels to featurise; they keep working as exact/near lookups in
+``label_index``.
+
+Features (``FEATURE_VERSION``), all from one ``ImageContext`` decode:
+colour signature and layout metrics of the existing heuristics on a 256px
+thumbnail, a 12-bin hue histogram of saturated pixels, and the 63 AC
+coefficients of the 8x8 low-frequency DCT of a 32x32 grey view (L2-normalised).
+
+Models are versioned files ``<dir>/lucky_lr_vNNN.npz`` (weights, standardiser,
+bands, metrics); ``<dir>/current.json`` points at the active one and is
+re-read when it changes. Scoring a feature vector is a dot product (µs);
+featurising is the heuristic pass on the thumbnail (~5-7 ms for a 1080p JPEG
+here, mostly the reduced decode).
+
+As a provider (``lpa_provider_bridge`` order name ``local``):
+``classify_lucky_pull_bytes`` returns ``(p, "ok")`` only outside the uncertain
+band (p >= high or p <= low); inside it returns ``(None, "uncertain")`` and the
+bridge moves on to the next provider (Gemini).
+
+ENV:
+- LPG_MODEL_DIR      : model directory, default data/lpg_model
+- LPG_MODEL_SAMPLES  : labeled feature rows, default data/lpg_samples.jsonl
+- LPG_MODEL_COLLECT  : 1 = record confident provider verdicts as samples, default 1
+- LPG_MODEL_SAMPLES_MAX : rows kept in the samples file, default 20000; past that it is
+                          rewritten with every moderator row plus the newest others (90%)
+- LPG_MODEL_LOW / LPG_MODEL_HIGH : override the model's decision band (default from training)
+"""
+from __future__ import annotations
+import os, json, math, time, logging, threading
+from typing import Dict, List, Optional, Sequence, Tuple
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+log = logging.getLogger(__name__)
+
+FEATURE_VERSION = 1
+THUMB_PX = 256
+HUE_BINS = 12
+
+def model_dir() -> str:
+    return os.getenv("LPG_MODEL_DIR", "data/lpg_model")
+
+def samples_path() -> str:
+    return os.getenv("LPG_MODEL_SAMPLES", "data/lpg_samples.jsonl")
+
+def collect_enabled() -> bool:
+    return os.getenv("LPG_MODEL_COLLECT", "1") == "1"
+
+# ------------------------------------------------------------------ features
+
+FEATURE_NAMES: List[str] = (
+    ["c_purple", "c_yellow", "c_bright",
+     "l_ncols", "l_reg", "l_gold", "l_purple", "l_cyan_border", "l_blue", "l_bright", "l_rule_hits", "aspect"]
+    + [f"hue{i}" for i in range(HUE_BINS)] + ["sat_mean", "val_mean"]
+    + [f"dct{u}{v}" for u in range(8) for v in range(8) if u or v]
+)
+
+def features(data) -> Optional[list]:
+    """Feature vector (list of floats, ``FEATURE_NAMES`` order) for image bytes / ImageContext; None if undecodable.
+
+    Module-level so ``hash_pool`` can run it in a worker process.
+    """
+    from PIL import Image
+    from nixe.helpers.image_context import ImageContext
+    from nixe.helpers.lucky_pull_color_heur import analyze_color_signature
+    from nixe.helpers.gacha_layout_heur import is_lucky_pull_layoutlike
+    from nixe.helpers.np_hash import dct_lowfreq
+    try:
+        ctx = ImageContext.of(data)
+        if ctx is None:
+            return None
+        thumb = ctx.thumb(THUMB_PX)
+        p, y, b = analyze_color_signature(thumb, downscale_px=THUMB_PX)
+        _ok, m = is_lucky_pull_layoutlike(thumb, max_px=THUMB_PX)
+        w, h = ctx.size
+        hsv = thumb.hsv(THUMB_PX).reshape(-1, 3).astype(np.float32) / 255.0
+        sat = hsv[:, 1] >= 0.35
+        hist = np.histogram(hsv[sat, 0], bins=HUE_BINS, range=(0.0, 1.0))[0].astype(np.float64) / max(1, len(hsv))
+        low = dct_lowfreq(thumb.gray_array((32, 32), Image.LANCZOS), 8)[0].reshape(-1)[1:]
+        low = low / (np.linalg.norm(low) or 1.0)
+        head = [p, y, b,
+                min(m["ncols"], 20.0) / 10.0, min(m["reg"], 2.0), m["gold"], m["purple"], m["cyan_border"],
+                m["blue"], m["bright"], m["rule_hits"] / 5.0, math.log(max(w, 1) / float(max(h, 1)))]
+        vec = head + hist.tolist() + [float(hsv[:, 1].mean()), float(hsv[:, 2].mean())] + low.tolist()
+        return [round(float(v), 6) for v in vec]
+    except Exception:
+        return None
+
+def features_from_file(path: str) -> Optional[list]:
+    with open(path, "rb") as f:
+        return features(f.read())
+
+# ------------------------------------------------------------------ samples
+
+_rec_lock = threading.Lock()
+_rows: Dict[str, int] = {}      # path -> row count, counted once per process
+
+def samples_max() -> int:
+    try: return max(100, int(os.getenv("LPG_MODEL_SAMPLES_MAX", "20000") or 20000))
+    except Exception: return 20000
+
+def _count_rows(path: str) -> int:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return sum(1 for _ in f)
+    except FileNotFoundError:
+        return 0
+
+def _trim(path: str, keep: int) -> int:
+    """Rewrite ``path`` with all moderator rows and the newest other rows, ``keep`` in total."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [ln for ln in f if ln.strip()]
+    mod = [i for i, ln in enumerate(lines) if '"src":"whitelist"' in ln]
+    rest = [i for i, ln in enumerate(lines) if '"src":"whitelist"' not in ln]
+    idx = set(mod[-keep:]) | set(rest[len(rest) - max(0, keep - len(mod)):])
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(lines[i] for i in sorted(idx))
+    os.replace(tmp, path)
+    log.info("[lpg-model] samples trimmed %d -> %d rows", len(lines), len(idx))
+    return len(idx)
+
+def record(x: Optional[Sequence[float]], label: int, src: str, key: str = "", path: Optional[str] = None) -> bool:
+    """Append one labeled feature row (label 1 = lucky pull, 0 = not). Features only, no pixels.
+
+    Blocking file I/O: cogs call it through ``asyncio.to_thread``.
+    """
+    if x is None or len(x) != len(FEATURE_NAMES):
+        return False
+    path = path or samples_path()
+    row = {"v": FEATURE_VERSION, "y": int(bool(label)), "src": src, "key": key, "ts": int(time.time()), "x": list(x)}
+    try:
+        d = os.path.dirname(path)
+        if d: os.makedirs(d, exist_ok=True)
+        with _rec_lock:
+            if path not in _rows:
+                _rows[path] = _count_rows(path)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row, separators=(",", ":")) + "\n")
+            _rows[path] += 1
+            cap = samples_max()
+            if _rows[path] > cap:
+                _rows[path] = _trim(path, int(cap * 0.9))
+        return True
+    except Exception as e:
+        log.debug("[lpg-model] record failed: %r", e)
+        return False
+
+# moderator labels beat provider labels for the same image
+_SRC_RANK = {"whitelist": 2, "llm": 1}
+
+def load_samples(path: Optional[str] = None) -> Tuple[list, list, Dict[str, int]]:
+    """``(X rows, y, counts per src)`` of current-version rows; one row per key, strongest source wins."""
+    path = path or samples_path()
+    best: Dict[str, dict] = {}
+    anon: List[dict] = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for ln in f:
+                try:
+                    r = json.loads(ln)
+                except Exception:
+                    continue
+                if r.get("v") != FEATURE_VERSION or len(r.get("x") or ()) != len(FEATURE_NAMES):
+                    continue
+                k = r.get("key") or ""
+                if not k:
+                    anon.append(r); continue
+                cur = best.get(k)
+                if cur is None or _SRC_RANK.get(r.get("src"), 0) >= _SRC_RANK.get(cur.get("src"), 0):
+                    best[k] = r
+    except FileNotFoundError:
+        pass
+    rows = list(best.values()) + anon
+    counts: Dict[str, int] = {}
+    for r in rows:
+        counts[r.get("src", "?")] = counts.get(r.get("src", "?"), 0) + 1
+    return [r["x"] for r in rows], [int(r["y"]) for r in rows], counts
+
+# ------------------------------------------------------------------ model
+
+class Model:
+    """Standardised logistic regression with a decision band."""
+
+    def __init__(self, w, b: float, mean, std, low: float, high: float, meta: Optional[dict] = None):
+        self.w = np.asarray(w, dtype=np.float64)
+        self.b = float(b)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        self.low, self.high = float(low), float(high)
+        self.meta = dict(meta or {})
+
+    def prob(self, x) -> "np.ndarray":
+        z = ((np.asarray(x, dtype=np.float64) - self.mean) / self.std) @ self.w + self.b
+        return 1.0 / (1.0 + np.exp(-np.clip(z, -40, 40)))
+
+    def save(self, path: str) -> None:
+        d = os.path.dirname(path)
+        if d: os.makedirs(d, exist_ok=True)
+        meta = dict(self.meta, low=self.low, high=self.high, feature_version=FEATURE_VERSION)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, w=self.w, b=np.array([self.b]), mean=self.mean, std=self.std,
+                 meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Model":
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(str(z["meta"]))
+            if int(meta.get("feature_version", 0)) != FEATURE_VERSION:
+                raise ValueError(f"feature_version {meta.get('feature_version')} != {FEATURE_VERSION}")
+            return cls(z["w"], float(z["b"][0]), z["mean"], z["std"], meta["low"], meta["high"], meta)
+
+def fit(X, y, *, l2: float = 1.0, iters: int = 30) -> Tuple["np.ndarray", float, "np.ndarray", "np.ndarray"]:
+    """Class-balanced L2 logistic regression by Newton/IRLS; returns ``(w, b, mean, std)``."""
+    X = np.asarray(X, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+    mean = X.mean(axis=0); std = X.std(axis=0); std[std < 1e-6] = 1.0
+    Z = np.hstack([(X - mean) / std, np.ones((len(X), 1))])
+    pos = max(1.0, y.sum()); neg = max(1.0, len(y) - y.sum())
+    sw = np.where(y > 0, len(y) / (2 * pos), len(y) / (2 * neg))
+    reg = np.full(Z.shape[1], l2); reg[-1] = 0.0
+    theta = np.zeros(Z.shape[1])
+    for _ in range(iters):
+        p = 1.0 / (1.0 + np.exp(-np.clip(Z @ theta, -40, 40)))
+        g = Z.T @ (sw * (p - y)) + reg * theta
+        H = (Z * (sw * p * (1 - p))[:, None]).T @ Z + np.diag(reg + 1e-9)
+        step = np.linalg.solve(H, g)
+        theta -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return theta[:-1], float(theta[-1]), mean, std
+
+def pick_band(p, y, target: float = 0.98, *, max_low: float = 0.3, min_high: float = 0.7) -> Tuple[float, float]:
+    """Loosest ``(low, high)`` with validation precision >= ``target`` on each side.
+
+    Never looser than ``[max_low, min_high]``: a small, cleanly separated holdout
+    would otherwise close the uncertain band entirely.
+    """
+    p = np.asarray(p, dtype=np.float64); y = np.asarray(y)
+    high, low = 1.0, 0.0
+    for t in np.linspace(0.99, min_high, 50):
+        sel = p >= t
+        if sel.sum() and (y[sel] == 1).mean() >= target:
+            high = float(t)
+        elif sel.sum():
+            break
+    for t in np.linspace(0.01, max_low, 50):
+        sel = p <= t
+        if sel.sum() and (y[sel] == 0).mean() >= target:
+            low = float(t)
+        elif sel.sum():
+            break
+    return round(low, 3), round(high, 3)
+
+# ------------------------------------------------------------------ active model
+
+_active: List = [None, None, 0.0]     # model, pointer signature, last check
+
+def _pointer() -> str:
+    return os.path.join(model_dir(), "current.json")
+
+def active(check_sec: float = 5.0) -> Optional[Model]:
+    """The model ``current.json`` points at (reloaded when the pointer changes)."""
+    now = time.monotonic()
+    if now - _active[2] < check_sec and _active[2]:
+        return _active[0]
+    _active[2] = now
+    ptr = _pointer()
+    try:
+        st = os.stat(ptr); sig = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        _active[0] = _active[1] = None
+        return None
+    if sig != _active[1]:
+        try:
+            with open(ptr, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            _active[0] = Model.load(os.path.join(model_dir(), info["file"]))
+            log.info("[lpg-model] loaded %s (v%s)", info["file"], info.get("version"))
+        except Exception as e:
+            log.warning("[lpg-model] cannot load model: %r", e)
+            _active[0] = None
+        _active[1] = sig
+    return _active[0]
+
+def next_version() -> int:
+    d = model_dir()
+    try:
+        vs = [int(fn[len("lucky_lr_v"):-4]) for fn in os.listdir(d) if fn.startswith("lucky_lr_v") and fn.endswith(".npz")]
+    except (OSError, ValueError):
+        vs = []
+    return max(vs, default=0) + 1
+
+def publish(model: Model, version: int) -> str:
+    """Write ``lucky_lr_vNNN.npz`` and point ``current.json`` at it; returns the file name."""
+    fn = f"lucky_lr_v{version:03d}.npz"
+    model.save(os.path.join(model_dir(), fn))
+    tmp = _pointer() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "file": fn, "created_at": int(time.time())}, f)
+    os.replace(tmp, _pointer())
+    return fn
+
+def _band(m: Model) -> Tuple[float, float]:
+    def f(k, d):
+        try: return float(os.getenv(k) or d)
+        except Exception: return d
+    return f("LPG_MODEL_LOW", m.low), f("LPG_MODEL_HIGH", m.high)
+
+def score(x) -> Optional[float]:
+    m = active()
+    if m is None or x is None:
+        return None
+    return float(m.prob(np.asarray(x, dtype=np.float64)[None, :])[0])
+
+# ------------------------------------------------------------------ provider API
+
+def classify_lucky_pull_bytes(img_bytes: bytes, *a, **kw):
+    """lpa_provider_bridge provider: ``(p, "ok")`` when confident, else ``(None, reason)``."""
+    m = active()
+    if m is None or np is None:
+        return None, "no_model"
+    x = features(img_bytes)
+    if x is None:
+        return None, "undecodable"
+    p = float(m.prob(np.asarray(x, dtype=np.float64)[None, :])[0])
+    low, high = _band(m)
+    if p >= high or p <= low:
+        return p, "ok"
+    return None, "uncertain"
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+lucky_pregate — local tiers in front of the lucky-pull LLM.
+
+Every guard used to send every image to the provider. Most chat images are
+memes and screenshots that the local heuristics already rule out, so the
+classification runs in tiers with one score contract (``Gate``):
+
+- tier 0: filename / metadata (``lucky_classifier.classify_filename``). A hint
+  ("gacha", "pull", "wish", ...) is enough to go straight to the LLM.
+- tier 1: colour + layout heuristics (``lucky_pull_color_heur``,
+  ``gacha_layout_heur``) on a thumbnail of the reduced decode, in the hash pool,
+  memoised per content digest (field ``pregate:1``).
+- tier 2: the remote LLM, only when the local score is >= LPG_ONLY_IF_HEUR_SCORE_GE.
+
+``Gate.score`` is the local lucky-pull likelihood 0..1 (merged with
+``lucky_classifier.merge_confidences``); ``Gate.escalate`` says whether the
+provider must decide. A local tier never deletes anything: low score = benign,
+anything else = ask the provider. Images the heuristics cannot decode escalate.
+
+ENV:
+- LPG_PREGATE_ENABLE        : 1 = use the local tiers, default 1
+- LPG_ONLY_IF_HEUR_SCORE_GE : escalation threshold, default 0.50 (a00_lpg_rate_limit_overlay);
+                              <= 0 escalates every image (reason "threshold_zero")
+- LPG_PREGATE_THUMB_PX      : long side of the tier-1 thumbnail, default 256
+"""
+from __future__ import annotations
+import os, logging
+from typing import NamedTuple, Optional
+
+from nixe.helpers import content_cache
+from nixe.helpers.lucky_classifier import classify_filename, merge_confidences
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+def _env_float(key: str, default: float) -> float:
+    try: return float(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+THUMB_PX = max(64, _env_int("LPG_PREGATE_THUMB_PX", 256))
+
+# layout rule hits -> score; one loose rule (e.g. purple + bright) is only "maybe"
+_LAYOUT_SCORE = (0.0, 0.55, 0.75, 0.9)
+
+class Gate(NamedTuple):
+    score: float      # local lucky-pull likelihood 0..1
+    tier: int         # last tier that ran (0 = filename, 1 = heuristics)
+    escalate: bool    # True = inconclusive locally, ask the provider (tier 2)
+    reason: str
+
+def enabled() -> bool:
+    return os.getenv("LPG_PREGATE_ENABLE", "1") == "1"
+
+def threshold() -> float:
+    """Read lazily: a00_lpg_rate_limit_overlay sets the default at cog load."""
+    return _env_float("LPG_ONLY_IF_HEUR_SCORE_GE", 0.50)
+
+def tier1_signals(data: bytes, thumb_px: int = THUMB_PX) -> Optional[dict]:
+    """Colour + layout signals on a ``thumb_px`` thumbnail; None if the image cannot be decoded.
+
+    Module-level so ``hash_pool`` can run it in a worker process.
+    """
+    from nixe.helpers.image_context import ImageContext
+    from nixe.helpers.lucky_pull_color_heur import analyze_color_signature
+    from nixe.helpers.gacha_layout_heur import is_lucky_pull_layoutlike
+    try:
+        ctx = ImageContext.of(data)
+        if ctx is None:
+            return None
+        # box-reduced thumbnail of the reduced decode (draft/reduce), never the full-resolution image
+        thumb = ctx.thumb(THUMB_PX)
+        p, y, b = analyze_color_signature(thumb, downscale_px=thumb_px)
+        _ok, m = is_lucky_pull_layoutlike(thumb, max_px=thumb_px)
+        return {"purple": round(p, 4), "yellow": round(y, 4), "bright": round(b, 4),
+                "rule_hits": int(m.get("rule_hits", 0))}
+    except Exception:
+        return None
+
+def tier1_score(sig: dict) -> float:
+    """Colour and layout signals -> 0..1; two agreeing signals get the merge boost."""
+    p, y, b = sig.get("purple", 0.0), sig.get("yellow", 0.0), sig.get("bright", 0.0)
+    # same cut-offs as is_lucky_pull_colorlike; two of three = partial match
+    met = int(p >= 0.06) + int(y >= 0.02) + int(b >= 0.35)
+    color = 0.6 if met == 3 else (0.35 if met == 2 else 0.0)
+    layout = _LAYOUT_SCORE[min(len(_LAYOUT_SCORE) - 1, int(sig.get("rule_hits", 0)))]
+    return merge_confidences(color, layout)
+
+async def gate(data: bytes, filename: str = "", *, att=None) -> Gate:
+    """Run tiers 0-1 for one image; ``escalate`` tells the caller whether to call the provider."""
+    thr = threshold()
+    if not enabled():
+        return Gate(1.0, 0, True, "pregate_off")
+    s0 = classify_filename(filename or getattr(att, "filename", "") or "")
+    if thr <= 0:
+        return Gate(s0, 0, True, "threshold_zero")
+    if s0 >= thr:
+        return Gate(s0, 0, True, "filename_hint")
+    try:
+        sig = await content_cache.hashed(data, "pregate:1", tier1_signals, THUMB_PX, att=att)
+    except Exception as e:
+        log.debug("[lpg-pregate] tier1 failed: %r", e)
+        sig = None
+    if sig is None:
+        return Gate(s0, 1, True, "undecodable")
+    s1 = merge_confidences(s0, tier1_score(sig))
+    if s1 >= thr:
+        return Gate(s1, 1, True, "heuristics")
+    return Gate(s1, 1, False, "benign")
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+np_hash — vectorised pHash / dHash / aHash / wavelet hash on prepared grayscale arrays.
+
+Every ``*_batch`` function takes N same-sized uint8 grayscale arrays stacked as
+``(N, h, w)`` and returns ``np.uint64`` hashes; the ``*_u64`` helpers do the
+same for one array and return a Python int. Bits are packed row-major, MSB
+first, so ``to_hex`` reproduces the hex strings already stored in the DB:
+
+- pHash : 32x32 LANCZOS view, 2-D DCT-II (same scaling as scipy.fftpack.dct),
+          top-left 8x8 compared with its median -> ``imagehash.phash``
+- dHash : 9x8 view, ``left < right`` (img_hashing / hash_utils) or
+          ``left > right`` with ``greater=True`` (phash_tools / gacha guard)
+- aHash : 8x8 view, ``pixel >= mean`` (hash_utils)
+- wHash : Haar block means of a square power-of-two view vs. their median
+          (``imagehash.whash`` haar mode with the max-level LL removed; blocks
+          tied exactly with the median may differ, imagehash breaks those ties
+          on float noise)
+
+pHash here is ~15x faster than ``imagehash.phash`` per frame and needs no scipy.
+
+Tile pHash (``tile_lowfreq``): the 8x8 low-frequency DCT of any set of
+sub-rectangles is ``(D @ A_rows) @ img @ (D @ A_cols).T`` where ``A`` is an
+area-average resampling matrix for one row/column range, so every tile of every
+crop hypothesis comes out of two matrix products instead of one resize + DCT
+per tile.
+
+Dihedral pHash (``dihedral_lowfreq``): mirroring the image negates every odd
+DCT column (horizontal flip) or row (vertical flip), and transposing it
+transposes the coefficients; the 90/180/270 rotations are combinations. So the
+pHashes of all 8 flips/rotations come from the coefficients already computed
+for the upright view, without another resize or DCT.
+"""
+from __future__ import annotations
+from functools import lru_cache
+from typing import Iterable, List, Sequence, Tuple, Union
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+@lru_cache(maxsize=8)
+def _dct_matrix(n: int, k: int):
+    """First ``k`` rows of the unnormalised DCT-II matrix: 2*cos(pi*u*(2x+1)/(2n))."""
+    u = np.arange(k, dtype=np.float64)[:, None]
+    x = np.arange(n, dtype=np.float64)[None, :]
+    return 2.0 * np.cos(np.pi * u * (2.0 * x + 1.0) / (2.0 * n))
+
+def _stack(arrs) -> "np.ndarray":
+    a = np.asarray(arrs)
+    if a.ndim == 2:
+        a = a[None, ...]
+    return a
+
+def pack_bits(bits) -> "np.ndarray":
+    """(N, 64) bool -> (N,) uint64, row-major MSB first."""
+    b = np.packbits(np.asarray(bits, dtype=bool).reshape(len(bits), -1), axis=1)
+    return b.view(">u8").reshape(-1).astype(np.uint64)
+
+def to_hex(v: int, bits: int = 64) -> str:
+    return f"{int(v):0{bits // 4}x}"
+
+def dct_lowfreq(arrs, hash_size: int = 8) -> "np.ndarray":
+    """(N, n, n) grayscale -> (N, hash_size, hash_size) low-frequency DCT coefficients."""
+    a = _stack(arrs).astype(np.float64)
+    D = _dct_matrix(a.shape[-1], hash_size)
+    return D @ a @ D.T
+
+def phash_from_lowfreq(low) -> "np.ndarray":
+    """(..., k, k) low-frequency coefficients -> (...) uint64 pHashes (median threshold)."""
+    lead, k = low.shape[:-2], low.shape[-1]
+    low = low.reshape(-1, k * k)
+    # flat / symmetric images have coefficients that are exactly zero in
+    # scipy's DCT but ~1e-13 here; snap them so the median ties break the same way
+    eps = np.abs(low).max(axis=1, keepdims=True) * 1e-9
+    low = np.where(np.abs(low) <= eps, 0.0, low)
+    med = np.median(low, axis=1)
+    return pack_bits(low > med[:, None]).reshape(lead)
+
+def phash_batch(arrs, hash_size: int = 8) -> "np.ndarray":
+    return phash_from_lowfreq(dct_lowfreq(arrs, hash_size))
+
+def dihedral_lowfreq(low) -> "np.ndarray":
+    """(..., k, k) coefficients -> (..., 8, k, k) for identity, hflip, vflip, rot180, transpose,
+    rot90 (cw), rot270 (cw), anti-transpose."""
+    k = low.shape[-1]
+    s = (-1.0) ** np.arange(k)
+    c, r = s[None, :], s[:, None]
+    t = np.swapaxes(low, -1, -2)
+    return np.stack([low, low * c, low * r, low * r * c, t, t * c, t * r, t * r * c], axis=-3)
+
+def phash_dihedral_batch(arrs, hash_size: int = 8) -> "np.ndarray":
+    """(N, n, n) grayscale -> (N, 8) uint64 pHashes of every flip/rotation (column 0 = upright)."""
+    return phash_from_lowfreq(dihedral_lowfreq(dct_lowfreq(arrs, hash_size)))
+
+def dhash_batch(arrs, greater: bool = False) -> "np.ndarray":
+    a = _stack(arrs)
+    left, right = a[:, :, :-1], a[:, :, 1:]
+    bits = (left > right) if greater else (left < right)
+    return pack_bits(bits.reshape(len(a), -1))
+
+def ahash_batch(arrs) -> "np.ndarray":
+    a = _stack(arrs).astype(np.float32)
+    flat = a.reshape(len(a), -1)
+    avg = flat.mean(axis=1)
+    return pack_bits(flat >= avg[:, None])
+
+def whash_batch(arrs, hash_size: int = 8) -> "np.ndarray":
+    a = _stack(arrs).astype(np.float64) / 255.0
+    n = a.shape[-1]
+    blk = max(1, n // hash_size)
+    means = a.reshape(len(a), hash_size, blk, hash_size, blk).mean(axis=(2, 4))
+    flat = (means - a.mean(axis=(1, 2))[:, None, None]).reshape(len(a), -1)
+    med = np.median(flat, axis=1)
+    return pack_bits(flat > med[:, None])
+
+@lru_cache(maxsize=16)
+def _tile_matrix(ranges: Tuple[Tuple[float, float], ...], size: int, n: int = 32, hash_size: int = 8):
+    """Stacked ``D @ A`` (len(ranges)*hash_size, size): DCT rows of each range area-resampled to ``n`` samples.
+
+    ``ranges`` are ``(lo, hi)`` fractions of the ``size``-pixel axis.
+    """
+    D = _dct_matrix(n, hash_size)
+    p = np.arange(size, dtype=np.float64)[None, :]
+    out = []
+    for lo, hi in ranges:
+        e = np.linspace(lo * size, hi * size, n + 1)
+        w = np.clip(np.minimum(e[1:, None], p + 1) - np.maximum(e[:-1, None], p), 0.0, None)
+        w /= np.maximum(w.sum(axis=1, keepdims=True), 1e-12)
+        out.append(D @ w)
+    return np.concatenate(out)
+
+def tile_lowfreq(arrs, ranges: Sequence[Tuple[float, float]], hash_size: int = 8) -> "np.ndarray":
+    """(N, s, s) grayscale -> (N, R, R, k, k) low-frequency DCT of tile ``(ranges[i] rows, ranges[j] cols)``.
+
+    Each tile is area-resampled to 32x32 first, so a tile spanning the whole
+    image is the same 32x32 view pHash would see (box filter instead of LANCZOS).
+    """
+    a = _stack(arrs).astype(np.float64)
+    M = _tile_matrix(tuple((float(lo), float(hi)) for lo, hi in ranges), a.shape[-1], 32, hash_size)
+    r, k = len(ranges), hash_size
+    low = (M @ a @ M.T).reshape(len(a), r, k, r, k)
+    return low.transpose(0, 1, 3, 2, 4)
+
+def lowfreq_std(low, n: int = 32) -> "np.ndarray":
+    """(..., k, k) unnormalised DCT coefficients of n x n tiles -> std of their low-frequency content.
+
+    Parseval on the orthonormal rescaling; cheap flatness test for tiles.
+    """
+    k = low.shape[-1]
+    sc = np.full((k, k), 1.0 / (2 * n))
+    sc[0, :] = sc[:, 0] = 1.0 / np.sqrt(8.0 * n * n)
+    sc[0, 0] = 0.0
+    return np.sqrt(((low * sc) ** 2).sum(axis=(-2, -1))) / n
+
+def phash_u64(arr) -> int:
+    return int(phash_batch(arr)[0])
+
+def dhash_u64(arr, greater: bool = False) -> int:
+    return int(dhash_batch(arr, greater=greater)[0])
+
+def ahash_u64(arr) -> int:
+    return int(ahash_batch(arr)[0])
+
+def whash_u64(arr) -> int:
+    return int(whash_batch(arr)[0])
+
+def whash_scale(size: Sequence[int], hash_size: int = 8) -> int:
+    """Square view size ``imagehash.whash`` would use for an image of ``size``."""
+    m = max(1, min(int(size[0]), int(size[1])))
+    return max(1 << (m.bit_length() - 1), hash_size)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+phash_backfill — resumable, parallel history backfill for hash harvesting.
+
+``Backfill(key).run(channel, handle, commit)`` pages ``channel.history`` oldest
+first, starting after the message id stored for ``key``, and feeds messages to
+PHASH_BACKFILL_WORKERS workers through a bounded queue. Each worker downloads
+the image attachments of a message and awaits ``handle(message, att, raw)``
+(typically a ``hash_pool`` job); the return value is counted as hashes.
+
+``limit`` caps the messages read per run. With a stored cursor that is the
+next ``limit`` messages after it; without one (first run, or ``resume=False``)
+it is the newest ``limit`` messages, as the old per-boot rescans read them,
+still processed oldest first.
+
+Checkpointing: messages complete out of order, so the cursor only advances over
+the contiguous prefix of finished messages. Every PHASH_BACKFILL_CHECKPOINT
+messages (and at the end) ``commit()`` is awaited to make the harvested hashes
+durable (e.g. a board flush); only if it succeeds is the cursor written. A
+crash therefore re-processes at most one checkpoint window, never skips one.
+
+A message whose attachment download or ``handle`` raised (CDN error, hash pool
+timeout) still lets the cursor pass, but its id is kept in the cursor entry's
+``failed`` list. The next run fetches and retries those messages first; an id
+is dropped after PHASH_BACKFILL_RETRIES failed runs (or once the message is
+gone). ``skipped`` in the stats counts messages left for a later retry.
+
+Progress (messages, attachments, hashes, attachments/s) is logged every
+PHASH_BACKFILL_PROGRESS_SEC and returned as a dict at the end.
+
+ENV:
+- PHASH_BACKFILL_WORKERS      : concurrent message workers, default 4
+- PHASH_BACKFILL_CHECKPOINT   : messages between commits, default 500
+- PHASH_BACKFILL_PROGRESS_SEC : progress log period, default 10
+- PHASH_BACKFILL_CURSOR_PATH  : cursor file, default data/phash_backfill_cursor.json
+- PHASH_BACKFILL_RETRIES      : runs a failed message is retried before it is dropped, default 3
+- PHASH_BACKFILL_FAILED_MAX   : failed ids kept per key (oldest dropped), default 1000
+"""
+from __future__ import annotations
+import os, json, time, asyncio, logging, threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+WORKERS = max(1, _env_int("PHASH_BACKFILL_WORKERS", 4))
+CHECKPOINT_EVERY = max(1, _env_int("PHASH_BACKFILL_CHECKPOINT", 500))
+PROGRESS_SEC = max(1, _env_int("PHASH_BACKFILL_PROGRESS_SEC", 10))
+CURSOR_PATH = os.getenv("PHASH_BACKFILL_CURSOR_PATH", "data/phash_backfill_cursor.json")
+RETRIES = max(1, _env_int("PHASH_BACKFILL_RETRIES", 3))
+FAILED_MAX = max(1, _env_int("PHASH_BACKFILL_FAILED_MAX", 1000))
+IMAGE_EXTS = (".png",".jpg",".jpeg",".webp",".gif",".bmp",".tif",".tiff",".heic",".heif")
+
+_file_lock = threading.Lock()
+
+# ------------------------------------------------------------ cursor file
+
+def _load_all() -> Dict[str, dict]:
+    try:
+        with open(CURSOR_PATH, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        return obj if isinstance(obj, dict) else {}
+    except Exception:
+        return {}
+
+def load_cursor(key: str) -> int:
+    """Last fully processed message id for ``key`` (0 = start from the beginning)."""
+    try: return int((_load_all().get(key) or {}).get("last_id") or 0)
+    except Exception: return 0
+
+def load_failed(key: str) -> Dict[int, int]:
+    """Message ids of ``key`` whose attachments failed -> failed runs so far."""
+    try: return {int(k): int(v) for k, v in ((_load_all().get(key) or {}).get("failed") or {}).items()}
+    except Exception: return {}
+
+def save_cursor(key: str, last_id: int, **extra) -> None:
+    with _file_lock:
+        data = _load_all()
+        data[key] = dict(data.get(key) or {}, last_id=int(last_id), ts=int(time.time()), **extra)
+        d = os.path.dirname(CURSOR_PATH)
+        if d: os.makedirs(d, exist_ok=True)
+        tmp = CURSOR_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, CURSOR_PATH)
+
+def reset_cursor(key: str) -> None:
+    with _file_lock:
+        data = _load_all()
+        if data.pop(key, None) is not None:
+            tmp = CURSOR_PATH + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp, CURSOR_PATH)
+
+# ------------------------------------------------------------ engine
+
+def _is_image(att) -> bool:
+    nm = (getattr(att, "filename", "") or "").lower()
+    ct = (getattr(att, "content_type", "") or "").lower()
+    return ct.startswith("image/") or nm.endswith(IMAGE_EXTS)
+
+class Backfill:
+    """One resumable backfill pass over a channel/thread history."""
+
+    def __init__(self, key: str, *, workers: int = WORKERS, checkpoint_every: int = CHECKPOINT_EVERY):
+        self.key = key
+        self.workers = max(1, int(workers))
+        self.checkpoint_every = max(1, int(checkpoint_every))
+        self.stats = {"messages": 0, "attachments": 0, "hashes": 0, "errors": 0, "skipped": 0,
+                      "retried": 0, "recovered": 0, "dropped": 0,
+                      "commits": 0, "cursor": 0, "elapsed": 0.0, "rate": 0.0}
+
+    async def run(self, channel, handle: Callable[[Any, Any, bytes], Awaitable[Optional[int]]],
+                  commit: Optional[Callable[[], Awaitable[Any]]] = None, *,
+                  limit: Optional[int] = None, resume: bool = True) -> Dict[str, Any]:
+        import discord
+        start_id = load_cursor(self.key) if resume else 0
+        self.stats["cursor"] = start_id
+        failed: Dict[int, int] = load_failed(self.key) if resume else {}
+        retrying: set = set()
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        order: deque = deque()       # message ids in history order, not yet committed
+        done: set = set()
+        state = {"contig": start_id, "since": 0, "last_log": time.monotonic(), "failed_dirty": False}
+        t0 = time.monotonic()
+        commit_lock = asyncio.Lock()
+
+        def _progress(final: bool = False):
+            el = time.monotonic() - t0
+            self.stats["elapsed"] = round(el, 2)
+            self.stats["rate"] = round(self.stats["attachments"] / el, 2) if el > 0 else 0.0
+            log.info("[backfill:%s] %s msgs=%d atts=%d hashes=%d err=%d skipped=%d %.1f att/s cursor=%s",
+                     self.key, "done" if final else "progress", self.stats["messages"],
+                     self.stats["attachments"], self.stats["hashes"], self.stats["errors"],
+                     self.stats["skipped"], self.stats["rate"], state["contig"])
+
+        async def _checkpoint():
+            async with commit_lock:
+                target = state["contig"]
+                if target == self.stats["cursor"] and not state["failed_dirty"]:
+                    return
+                try:
+                    ok = (await commit()) if commit else True
+                except Exception as e:
+                    log.warning("[backfill:%s] commit failed, cursor kept at %s: %r", self.key, self.stats["cursor"], e)
+                    return
+                if ok is False:
+                    log.warning("[backfill:%s] commit deferred, cursor kept at %s", self.key, self.stats["cursor"])
+                    return
+                # ids past the cursor are re-read by the next run anyway
+                keep = sorted(i for i in failed if i <= target)[-FAILED_MAX:]
+                save_cursor(self.key, target, messages=self.stats["messages"],
+                            failed={str(i): failed[i] for i in keep})
+                state["failed_dirty"] = False
+                self.stats["cursor"] = target
+                self.stats["commits"] += 1
+
+        def _settle(mid: int, bad: bool) -> None:
+            # failed messages let the cursor pass but are remembered for the next run
+            if bad:
+                tries = failed.get(mid, 0) + 1
+                if tries > RETRIES:
+                    failed.pop(mid, None)
+                    self.stats["dropped"] += 1
+                    log.warning("[backfill:%s] msg=%s still failing after %d runs; giving up", self.key, mid, tries)
+                else:
+                    failed[mid] = tries
+                    self.stats["skipped"] += 1
+                state["failed_dirty"] = True
+            elif mid in failed:
+                failed.pop(mid, None)
+                self.stats["recovered"] += 1
+                state["failed_dirty"] = True
+
+        async def _worker():
+            while True:
+                m = await q.get()
+                try:
+                    if m is None:
+                        return
+                    bad = False
+                    for att in getattr(m, "attachments", ()) or ():
+                        if not _is_image(att):
+                            continue
+                        try:
+                            raw = await att.read()
+                            if not raw:
+                                continue
+                            self.stats["attachments"] += 1
+                            n = await handle(m, att, raw)
+                            self.stats["hashes"] += int(n or 0)
+                        except Exception as e:
+                            self.stats["errors"] += 1
+                            bad = True
+                            log.debug("[backfill:%s] msg=%s att=%s failed: %r", self.key, m.id, getattr(att, "id", "?"), e)
+                    self.stats["messages"] += 1
+                    _settle(m.id, bad)
+                    if m.id in retrying:
+                        continue
+                    done.add(m.id)
+                    while order and order[0] in done:
+                        mid = order.popleft(); done.discard(mid)
+                        state["contig"] = mid; state["since"] += 1
+                    if state["since"] >= self.checkpoint_every:
+                        state["since"] = 0
+                        await _checkpoint()
+                    if time.monotonic() - state["last_log"] >= PROGRESS_SEC:
+                        state["last_log"] = time.monotonic()
+                        _progress()
+                finally:
+                    q.task_done()
+
+        tasks = [asyncio.ensure_future(_worker()) for _ in range(self.workers)]
+        try:
+            # retry messages that failed in earlier runs before resuming after the cursor
+            for mid in sorted(failed):
+                try:
+                    m = await channel.fetch_message(mid)
+                except discord.NotFound:
+                    failed.pop(mid, None); state["failed_dirty"] = True
+                    self.stats["dropped"] += 1
+                    continue
+                except Exception as e:
+                    log.debug("[backfill:%s] retry fetch msg=%s failed: %r", self.key, mid, e)
+                    _settle(mid, True)
+                    continue
+                retrying.add(mid)
+                self.stats["retried"] += 1
+                await q.put(m)
+            if limit and not start_id:
+                # no cursor yet: the newest ``limit`` messages, oldest first
+                newest = [m async for m in channel.history(limit=limit)]
+                for m in reversed(newest):
+                    order.append(m.id)
+                    await q.put(m)
+            else:
+                after = discord.Object(id=start_id) if start_id else None
+                async for m in channel.history(limit=limit, after=after, oldest_first=True):
+                    order.append(m.id)
+                    await q.put(m)
+        finally:
+            for _ in tasks:
+                await q.put(None)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await _checkpoint()
+        _progress(final=True)
+        return dict(self.stats)
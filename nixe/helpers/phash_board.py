@@ -24,4 +24,7 @@ def looks_like_phash_db(content:str)->bool:
     if not content: return False
     s=str(content).lower(); return ('phash' in s and 'db' in s) or ('token' in s and 'hash' in s) or ('blacklist' in s)
 async def get_pinned_db_message(bot): return None
-async def edit_pinned_db(bot, tokens: Iterable[str])->bool: return True
+async def edit_pinned_db(bot, tokens: Iterable[str])->bool:
+    # merged into the next coalesced board edit (nixe.helpers.phash_board_writer)
+    from nixe.helpers import phash_board_writer
+    phash_board_writer.queue(bot, phash=tokens); return True
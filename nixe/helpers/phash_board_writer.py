@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+phash_board_writer — one coalescing writer for pHash DB board edits.
+
+Producers (PhashRescanner, a12 inbox port, a13 auto-reseed, ``edit_pinned_db``)
+no longer edit the board themselves; they ``queue()`` hashes. Per board the
+writer merges pending pHash/dHash/tile hashes and flushes them in one edit:
+
+- at most once per ``PHASH_BOARD_EDIT_MIN_INTERVAL`` seconds (config/phash_core),
+- sooner once PHASH_BOARD_FLUSH_THRESHOLD new hashes are pending,
+- after a short PHASH_BOARD_FLUSH_DELAY debounce so a burst lands in one edit.
+
+Every flush re-reads the board message and merges into its current content, so
+moderator edits in between are kept (as are extra keys such as the compaction
+radii ``phash_r``; hashes already inside such a radius are not re-added).
+``rewrite`` replaces the content under the same lock, for compaction. A 429 / 5xx is retried with
+exponential backoff (honouring ``retry_after``); if all retries fail the hashes go back to pending.
+
+A board is one Discord message, so ``render`` output is capped at
+PHASH_BOARD_MAX_CHARS: hashes are added pHash first, then dHash, then tile
+tokens, while the message still fits; the rest is *parked* (logged, kept in
+memory up to PHASH_BOARD_PARKED_MAX) instead of sending an edit Discord would
+reject. Any other 4xx parks the batch as well, since retrying cannot help.
+Parked hashes are queued again after a successful ``rewrite`` (compaction
+frees room).
+
+Targets:
+- ``channel=None``  the runtime board located by ``phash_db`` (thread + message id)
+- ``channel=<ch>``  the newest bot message carrying PHASH_DB_MARKER in ``ch``;
+                    created there if missing (a12/a13 convention)
+
+ENV:
+- PHASH_BOARD_FLUSH_THRESHOLD : pending hashes that force an early flush, default 256
+- PHASH_BOARD_FLUSH_DELAY     : debounce seconds before a flush, default 5
+- PHASH_BOARD_RETRY_MAX       : attempts per flush on 429 / 5xx, default 5
+- PHASH_BOARD_MAX_CHARS       : size limit of the board message, default 2000 (Discord's limit)
+- PHASH_BOARD_PARKED_MAX      : parked hashes kept per board, default 4096
+"""
+from __future__ import annotations
+import os, json, time, asyncio, logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from nixe.helpers import phash_compact, phash_db
+from nixe.helpers.phash_index import PhashIndex
+
+log = logging.getLogger(__name__)
+
+try:
+    from nixe.config.phash_core import PHASH_BOARD_EDIT_MIN_INTERVAL
+except Exception:
+    PHASH_BOARD_EDIT_MIN_INTERVAL = 180
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+def _env_float(key: str, default: float) -> float:
+    try: return float(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+MIN_INTERVAL = max(0, int(PHASH_BOARD_EDIT_MIN_INTERVAL))
+FLUSH_THRESHOLD = max(1, _env_int("PHASH_BOARD_FLUSH_THRESHOLD", 256))
+FLUSH_DELAY = max(0.0, _env_float("PHASH_BOARD_FLUSH_DELAY", 5.0))
+RETRY_MAX = max(1, _env_int("PHASH_BOARD_RETRY_MAX", 5))
+MAX_CHARS = max(200, _env_int("PHASH_BOARD_MAX_CHARS", 2000))
+PARKED_MAX = max(0, _env_int("PHASH_BOARD_PARKED_MAX", 4096))
+MARKER = os.getenv("PHASH_DB_MARKER", "NIXE_PHASH_DB_V1").strip()
+_KINDS = ("phash", "dhash", "tphash")
+
+def render(phashes, dhashes=None, tiles=None, prefix: Optional[str] = None, extra: Optional[dict] = None) -> str:
+    data = dict(extra or {})
+    data["phash"] = list(phashes or [])
+    if dhashes: data["dhash"] = list(dhashes)
+    if tiles:   data["tphash"] = list(tiles)
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    head = prefix if prefix is not None else MARKER + "\n"
+    return f"{head}```json\n{body}\n```"
+
+def _fit(cur: Dict[str, List[str]], new: Dict[str, List[str]], prefix: Optional[str], extra: dict
+         ) -> Tuple[str, Dict[str, List[str]]]:
+    """Append ``new`` to ``cur`` (in place) as far as the rendered board stays <= MAX_CHARS.
+
+    Kinds fill in ``_KINDS`` order; returns ``(text, overflow per kind)``.
+    """
+    def text() -> str:
+        return render(cur["phash"], cur["dhash"], cur["tphash"], prefix, extra)
+    overflow = {k: [] for k in _KINDS}
+    for kind in _KINDS:
+        add = new.get(kind) or []
+        if not add:
+            continue
+        base = list(cur[kind])
+        cur[kind] = base + add
+        if len(text()) <= MAX_CHARS:
+            continue
+        lo, hi = 0, len(add)        # largest n with base + add[:n] fitting
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            cur[kind] = base + add[:mid]
+            if len(text()) <= MAX_CHARS: lo = mid
+            else: hi = mid - 1
+        cur[kind] = base + add[:lo]
+        overflow[kind] = add[lo:]
+    return text(), overflow
+
+class _Board:
+    """Pending additions and edit bookkeeping for one board target."""
+
+    def __init__(self, key: int):
+        self.key = key
+        self.channel = None
+        self.message_id = 0
+        self.pending: Dict[str, List[str]] = {k: [] for k in _KINDS}
+        self.parked: Dict[str, List[str]] = {k: [] for k in _KINDS}
+        self.known: Dict[str, set] = {k: set() for k in _KINDS}
+        self.last_edit = 0.0
+        self.edits = 0
+        self.task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    def n_pending(self) -> int:
+        return sum(len(v) for v in self.pending.values())
+
+    def park(self, hs: Dict[str, List[str]], why: str) -> int:
+        """Keep hashes that cannot be written now (bounded); returns how many were parked."""
+        n = 0
+        for k in _KINDS:
+            have = set(self.parked[k])
+            for h in hs.get(k) or ():
+                if h not in have and sum(len(v) for v in self.parked.values()) < PARKED_MAX:
+                    self.parked[k].append(h); have.add(h); n += 1
+        total = sum(len(v) for v in hs.values())
+        if total:
+            _stats["parked"] += total
+            log.warning("[phash-board-writer] board=%s %d hash(es) parked (%s)%s", self.key, total, why,
+                        f"; {total - n} dropped over PHASH_BOARD_PARKED_MAX" if total > n else "")
+        return n
+
+    def unpark(self) -> None:
+        for k in _KINDS:
+            have = set(self.pending[k])
+            self.pending[k] += [h for h in self.parked[k] if h not in have and h not in self.known[k]]
+            self.parked[k] = []
+
+    def totals(self) -> Dict[str, int]:
+        return {k: len(self.known[k] | set(self.pending[k])) for k in _KINDS}
+
+_boards: Dict[int, _Board] = {}
+_bot = None
+_stats = {"queued": 0, "edits": 0, "retries": 0, "failed": 0, "parked": 0}
+
+class _Permanent(Exception):
+    """The edit was rejected with a non-retryable status (4xx other than 429)."""
+
+def _board(channel) -> _Board:
+    key = int(getattr(channel, "id", 0) or 0)
+    b = _boards.get(key)
+    if b is None:
+        b = _boards[key] = _Board(key)
+    if channel is not None:
+        b.channel = channel
+    return b
+
+def queue(bot, *, phash: Iterable[str] = (), dhash: Iterable[str] = (), tphash: Iterable[str] = (),
+          channel=None) -> Tuple[int, Dict[str, int]]:
+    """Queue hashes for the board; returns ``(newly queued, totals incl. pending)``."""
+    global _bot
+    _bot = bot
+    b = _board(channel)
+    if channel is None and not b.known["phash"] and phash_db.S.loaded:
+        b.known["phash"] = set(phash_db.board_lists()[0])
+    added = 0
+    for kind, hs in zip(_KINDS, (phash, dhash, tphash)):
+        pend, known = b.pending[kind], b.known[kind]
+        seen = set(pend)
+        for h in hs or ():
+            h = str(h or "").strip()
+            if h and h not in known and h not in seen:
+                pend.append(h); seen.add(h); added += 1
+    _stats["queued"] += added
+    if added:
+        _schedule(b)
+    return added, b.totals()
+
+def _schedule(b: _Board, delay: Optional[float] = None) -> None:
+    if b.task is not None and not b.task.done():
+        if b.n_pending() < FLUSH_THRESHOLD:
+            return
+        b.task.cancel()     # threshold reached: replace the long wait with an early flush
+    if delay is None:
+        if b.n_pending() >= FLUSH_THRESHOLD:
+            delay = FLUSH_DELAY
+        else:
+            delay = max(FLUSH_DELAY, b.last_edit + MIN_INTERVAL - time.monotonic())
+    b.task = asyncio.ensure_future(_flush_later(b, delay))
+
+async def _flush_later(b: _Board, delay: float) -> None:
+    try:
+        await asyncio.sleep(delay)
+    except asyncio.CancelledError:
+        return
+    if b.task is asyncio.current_task():
+        b.task = None
+    await flush(b.channel, board=b)
+
+async def _find_message(b: _Board):
+    bot = _bot
+    if b.key == 0:
+        st = await phash_db.get(bot)
+        if not (st.channel_id and st.message_id):
+            return None, None
+        ch = bot.get_channel(st.channel_id) or await bot.fetch_channel(st.channel_id)
+        return ch, await ch.fetch_message(st.message_id)
+    ch = b.channel
+    if b.message_id:
+        try:
+            return ch, await ch.fetch_message(b.message_id)
+        except Exception:
+            b.message_id = 0
+    me = getattr(getattr(bot, "user", None), "id", None)
+    async for m in ch.history(limit=50):
+        if m.author.id == me and MARKER in (m.content or ""):
+            return ch, m
+    return ch, None
+
+def _retry_after(e, attempt: int) -> Optional[float]:
+    status = getattr(e, "status", None)
+    if status != 429 and not (isinstance(status, int) and status >= 500):
+        return None
+    ra = getattr(e, "retry_after", None)
+    try: ra = float(ra) if ra is not None else None
+    except Exception: ra = None
+    return max(ra or 0.0, 2.0 * (2 ** attempt))
+
+def _read(msg) -> Tuple[Dict[str, List[str]], dict, Optional[str]]:
+    """``(lists per kind, extra keys, prefix)`` of the current board message."""
+    if msg is None:
+        return {k: [] for k in _KINDS}, {}, None
+    content = msg.content or ""
+    obj = phash_db.parse_board_obj(content)
+    P, D, T = phash_db.parse_board(content)
+    i = content.find("```json")
+    extra = {k: v for k, v in obj.items() if k not in _KINDS and k != "items"}
+    return {"phash": P, "dhash": D, "tphash": T}, extra, (content[:i] if i >= 0 else None)
+
+async def _edit(b: _Board, ch, msg, text: str):
+    """Edit (or create) the board message, retrying 429 / 5xx; returns the message or None.
+
+    Raises ``_Permanent`` for any other 4xx (retrying the same edit cannot succeed).
+    """
+    for attempt in range(RETRY_MAX):
+        try:
+            if msg is not None:
+                if text != (msg.content or ""):
+                    await msg.edit(content=text)
+            else:
+                msg = await ch.send(text)
+            return msg
+        except Exception as e:
+            wait = _retry_after(e, attempt)
+            status = getattr(e, "status", None)
+            if wait is None and isinstance(status, int) and 400 <= status < 500:
+                log.warning("[phash-board-writer] edit rejected board=%s (HTTP %s): %r", b.key, status, e)
+                raise _Permanent(str(e))
+            if wait is None or attempt + 1 >= RETRY_MAX:
+                log.warning("[phash-board-writer] edit failed board=%s: %r", b.key, e)
+                return None
+            _stats["retries"] += 1
+            log.info("[phash-board-writer] rate limited, retry in %.1fs", wait)
+            await asyncio.sleep(wait)
+    return None
+
+def _committed(b: _Board, ch, msg, text: str, cur: Dict[str, List[str]]) -> None:
+    b.message_id = int(msg.id)
+    for kind in _KINDS:
+        b.known[kind] = set(cur[kind])
+    if msg.id == phash_db.S.message_id:
+        phash_db.apply_content(text, channel_id=ch.id, message_id=msg.id)
+
+async def _write(b: _Board, pending: Dict[str, List[str]]) -> bool:
+    ch, msg = await _find_message(b)
+    if ch is None:
+        log.debug("[phash-board-writer] board %s not located; keeping pending hashes", b.key)
+        return False
+    cur, extra, prefix = _read(msg)
+    fresh: Dict[str, List[str]] = {}
+    for kind in _KINDS:
+        have = set(cur[kind])
+        new = [h for h in pending[kind] if h not in have]
+        radii = phash_db.parse_radii(extra) if kind == "phash" else {}
+        if radii and new:
+            # already inside a compacted representative's radius: don't re-grow the board
+            idx = PhashIndex(radii)
+            new = [h for h in new if not phash_compact.covered(h, idx, radii)]
+        fresh[kind] = new
+    text, overflow = _fit(cur, fresh, prefix, extra)
+    if any(overflow.values()):
+        b.park(overflow, f"board message full at {MAX_CHARS} chars; compact it to make room")
+    msg = await _edit(b, ch, msg, text)
+    if msg is None:
+        return False
+    _committed(b, ch, msg, text, cur)
+    return True
+
+async def rewrite(bot, transform: Callable[[Dict[str, List[str]], dict], Tuple[Dict[str, List[str]], dict]],
+                  *, channel=None) -> bool:
+    """Replace board content: ``transform(lists, extra) -> (lists, extra)`` runs on the fresh message.
+
+    Holds the board lock, so queued additions land before or after, never
+    in between; used by compaction / eviction.
+    """
+    global _bot
+    _bot = bot
+    b = _board(channel)
+    async with b.lock:
+        ch, msg = await _find_message(b)
+        if ch is None or msg is None:
+            return False
+        cur, extra, prefix = _read(msg)
+        cur, extra = transform(cur, extra)
+        text = render(cur.get("phash"), cur.get("dhash"), cur.get("tphash"), prefix, extra)
+        if len(text) > MAX_CHARS and len(text) > len(msg.content or ""):
+            log.warning("[phash-board-writer] rewrite board=%s refused: %d chars > %d", b.key, len(text), MAX_CHARS)
+            _stats["failed"] += 1
+            return False
+        try:
+            msg = await _edit(b, ch, msg, text)
+        except _Permanent:
+            msg = None
+        if msg is None:
+            _stats["failed"] += 1
+            return False
+        b.last_edit = time.monotonic(); b.edits += 1; _stats["edits"] += 1
+        _committed(b, ch, msg, text, {k: list(cur.get(k) or []) for k in _KINDS})
+        if any(b.parked.values()):
+            b.unpark()     # compaction may have made room for what was parked
+    if b.n_pending():
+        _schedule(b)
+    return True
+
+async def flush(channel=None, *, board: Optional[_Board] = None, force: bool = False) -> bool:
+    """Write pending hashes now. Without ``force`` the minimum interval still applies.
+
+    True once nothing is left to retry: written, or parked (board full / edit
+    rejected with a non-retryable 4xx). False keeps them pending (429 / 5xx).
+    """
+    b = board or _board(channel)
+    if not b.n_pending():
+        return True
+    async with b.lock:
+        wait = b.last_edit + MIN_INTERVAL - time.monotonic()
+        if not force and wait > 0 and b.n_pending() < FLUSH_THRESHOLD:
+            _schedule(b, wait)
+            return False
+        taken = {k: list(v) for k, v in b.pending.items()}
+        b.pending = {k: [] for k in _KINDS}
+        permanent = False
+        parked0 = _stats["parked"]
+        try:
+            ok = await _write(b, taken)
+        except _Permanent as e:
+            # e.g. 400 / 403: the same edit would fail again, so park the batch instead of requeueing it
+            b.park(taken, f"edit rejected: {e}")
+            ok, permanent = True, True
+        except Exception as e:
+            log.warning("[phash-board-writer] flush error board=%s: %r", b.key, e)
+            ok = False
+        if permanent:
+            _stats["failed"] += 1
+            b.last_edit = time.monotonic()
+        elif ok:
+            b.last_edit = time.monotonic(); b.edits += 1; _stats["edits"] += 1
+            log.info("[phash-board-writer] board=%s +%d hash(es) in one edit",
+                     b.key, sum(len(v) for v in taken.values()) - (_stats["parked"] - parked0))
+        else:
+            _stats["failed"] += 1
+            for k in _KINDS:   # 429 / 5xx / board not found: put back in front of anything queued meanwhile
+                rest = [h for h in b.pending[k] if h not in set(taken[k])]
+                b.pending[k] = taken[k] + rest
+            b.last_edit = time.monotonic()
+    if b.n_pending():
+        _schedule(b)
+    return ok
+
+async def flush_all(force: bool = True) -> None:
+    for b in list(_boards.values()):
+        await flush(b.channel, board=b, force=force)
+
+def stats() -> dict:
+    return dict(_stats, boards={b.key: {"pending": b.n_pending(), "edits": b.edits,
+                                        "parked": sum(len(v) for v in b.parked.values())} for b in _boards.values()},
+                min_interval=MIN_INTERVAL, flush_threshold=FLUSH_THRESHOLD, max_chars=MAX_CHARS)
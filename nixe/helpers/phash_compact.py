@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+phash_compact — fold near-duplicate board hashes into radius-tagged representatives.
+
+Augmentation and multi-frame hashing register many hashes a few bits apart.
+``compact`` clusters them greedily: the highest-scored hash not yet taken
+becomes a representative and absorbs every remaining hash ``h`` with
+``dist(rep, h) + radius(h) <= PHASH_COMPACT_RADIUS``. The representative keeps
+the largest such sum as its own radius, so by the triangle inequality anything
+within ``R`` of a dropped member is within ``R + radius(rep)`` of the
+representative and nothing that matched before stops matching
+(``phash_db.match_radius``).
+
+If more than ``max_items`` clusters remain, the lowest-scored ones are evicted.
+The default score is cluster size, then recency; ``phash_compactify`` passes
+``hit_stats.STATS.score`` so hashes that still fire are kept (LRU-2/LFU) and
+become the representatives of their clusters.
+
+ENV:
+- PHASH_COMPACT_RADIUS : max bits a representative may cover, default 4
+"""
+from __future__ import annotations
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from nixe.helpers.phash_index import PhashIndex, to_hex, to_int
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+RADIUS = max(0, min(7, _env_int("PHASH_COMPACT_RADIUS", 4)))
+
+Cluster = Tuple[str, int, List[str]]   # (representative, radius, absorbed members)
+
+def cluster(hashes: Sequence[str], radii: Optional[Dict[str, int]] = None, radius: int = RADIUS,
+            score: Optional[Callable[[str], Any]] = None) -> List[Cluster]:
+    """Greedy leader clustering; leaders are taken in ``score`` order (default: board order)."""
+    radii = radii or {}
+    vals: Dict[int, str] = {}
+    for h in hashes:
+        v = to_int(h)
+        if v is not None and v not in vals:
+            vals[v] = to_hex(v)
+    order = list(vals)
+    if score is not None:
+        order.sort(key=lambda v: score(vals[v]), reverse=True)   # stable: ties keep board order
+    idx = PhashIndex(order)
+    out: List[Cluster] = []
+    for v in order:
+        if v not in idx:
+            continue
+        h = vals[v]
+        r = radii.get(h, 0)
+        idx.discard(v)
+        members: List[str] = []
+        for m, d in idx.query(v, radius):
+            mh = vals[m]
+            reach = d + radii.get(mh, 0)
+            if reach <= radius:
+                idx.discard(m)
+                members.append(mh)
+                r = max(r, reach)
+        out.append((h, r, members))
+    return out
+
+def compact(hashes: Sequence[str], radii: Optional[Dict[str, int]] = None, *, radius: int = RADIUS,
+            max_items: int = 0, score: Optional[Callable[[str], Any]] = None) -> dict:
+    """Compacted board lists: ``{"hashes", "radii", "merged", "evicted", "absorbed", "before", "after"}``.
+
+    ``hashes`` keeps board order of the representatives; ``radii`` only lists
+    representatives with a non-zero radius; ``merged`` maps representatives to
+    the hashes they absorbed.
+    """
+    hashes = [str(h).strip().lower() for h in hashes]
+    pos = {h: i for i, h in enumerate(hashes)}
+    cl = cluster(hashes, radii, radius, score)
+    evicted: List[str] = []
+    if max_items and len(cl) > max_items:
+        key = (lambda c: (score(c[0]), len(c[2]), pos.get(c[0], 0))) if score is not None \
+            else (lambda c: (len(c[2]), pos.get(c[0], 0)))
+        ranked = sorted(cl, key=key, reverse=True)
+        keep = {c[0] for c in ranked[:max_items]}
+        evicted = [c[0] for c in cl if c[0] not in keep]
+        cl = [c for c in cl if c[0] in keep]
+    cl.sort(key=lambda c: pos.get(c[0], 0))
+    return {
+        "hashes": [c[0] for c in cl],
+        "radii": {c[0]: c[1] for c in cl if c[1]},
+        "merged": {c[0]: c[2] for c in cl if c[2]},
+        "absorbed": sum(len(c[2]) for c in cl),
+        "evicted": evicted,
+        "before": len(hashes),
+        "after": len(cl),
+    }
+
+def covered(h: str, index: PhashIndex, radii: Dict[str, int]) -> bool:
+    """True if ``h`` lies inside the radius of an existing representative in ``index``."""
+    if not radii:
+        return False
+    top = max(radii.values())
+    for v, d in index.query(h, top):
+        if d <= radii.get(to_hex(v), 0):
+            return True
+    return False
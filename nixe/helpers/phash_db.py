@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+phash_db — in-memory view of the pHash DB board message.
+
+The board is located and parsed once, then kept in memory. It is refreshed when
+the board message is edited (``a00_phash_db_cache_overlay`` forwards
+``on_raw_message_edit``) or when ``PHASH_DB_CACHE_TTL`` expires. Every change to
+the hash set bumps ``S.version``; dependent indexes call ``sync_index`` to apply
+only the added/removed hashes since the version they last saw.
+
+A compacted board (see ``phash_compact``) also carries ``phash_r``: the radius
+each representative covers; matchers use ``match_radius``.
+
+The board is one Discord message (2000 chars), so it only holds the upright
+pHashes. Registration-time extras (augmented pHash variants, dHashes, tile
+tokens from a12/a13) live in a local file instead (``add_local``) and are
+merged into ``S`` behind the board's own hashes, so every matcher sees them.
+The file is a local cache: if it is lost, a13 rebuilds it once its backfill
+cursor is reset.
+
+Board lookup order:
+1) runtime ids from ``state_runtime.get_phash_ids()`` (thread + message id)
+2) newest ```json board with a ``phash`` array in LOG_CHANNEL_ID
+   (or a ``nixe-only`` channel of the guild), scanning PHASH_LOG_SCAN_LIMIT msgs
+
+ENV:
+- PHASH_DB_CACHE_TTL : seconds before a background re-fetch, default 300
+- PHASH_LOCAL_PATH   : local registration extras, default data/phash_local.json
+- PHASH_LOCAL_MAX    : entries kept per kind in that file (oldest dropped), default 50000
+"""
+from __future__ import annotations
+import os, re, json, time, asyncio, logging
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from nixe.state_runtime import get_phash_ids
+
+log = logging.getLogger(__name__)
+
+HEX16 = re.compile(r"^[0-9a-f]{16}$", re.I)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+TTL_SEC = max(5, _env_int("PHASH_DB_CACHE_TTL", 300))
+LOCAL_PATH = os.getenv("PHASH_LOCAL_PATH", "data/phash_local.json")
+LOCAL_MAX = max(100, _env_int("PHASH_LOCAL_MAX", 50000))
+_DIFF_KEEP = 64
+
+class _S:
+    loaded = False
+    channel_id = 0
+    message_id = 0
+    phash: Tuple[str, ...] = ()
+    dhash: Tuple[str, ...] = ()
+    tphash: Tuple[str, ...] = ()
+    radius: Dict[str, int] = {}      # compacted representative -> cluster radius (phash_compact)
+    max_radius = 0
+    version = 0
+    loaded_at = 0.0
+    diffs: Deque[Tuple[int, frozenset, frozenset]] = deque(maxlen=_DIFF_KEEP)
+S = _S()
+
+_lock: Optional[asyncio.Lock] = None
+
+def _get_lock() -> asyncio.Lock:
+    global _lock
+    if _lock is None:
+        _lock = asyncio.Lock()
+    return _lock
+
+def _clean(arr, key: str = "hash") -> List[str]:
+    out: List[str] = []
+    for it in arr or []:
+        if isinstance(it, dict):
+            it = it.get(key)
+        s = str(it or "").strip().lower()
+        if s and s not in out:
+            out.append(s)
+    return out
+
+def parse_board_obj(content: str) -> dict:
+    """The raw JSON object of a board message body ({} if there is none)."""
+    s = content or ""
+    start = s.find("```json")
+    i = s.find("{", start if start >= 0 else 0)
+    end = s.find("```", i) if start >= 0 else -1
+    j = s.rfind("}", i, end if end > 0 else len(s))
+    if i < 0 or j <= i:
+        return {}
+    try:
+        obj = json.loads(s[i:j + 1])
+    except Exception:
+        return {}
+    return obj if isinstance(obj, dict) else {}
+
+def parse_radii(obj: dict, key: str = "phash_r") -> Dict[str, int]:
+    """``{representative: radius}`` written by phash_compact (missing = 0)."""
+    out: Dict[str, int] = {}
+    for h, r in (obj.get(key) or {}).items() if isinstance(obj.get(key), dict) else ():
+        try: out[str(h).strip().lower()] = max(0, int(r))
+        except Exception: pass
+    return out
+
+def parse_board(content: str) -> Tuple[List[str], List[str], List[str]]:
+    """Return ``(phash, dhash, tphash)`` lists from a board message body."""
+    obj = parse_board_obj(content)
+    if not obj:
+        return [], [], []
+    return _lists(obj)
+
+def _lists(obj: dict) -> Tuple[List[str], List[str], List[str]]:
+    P = [h for h in _clean(obj.get("phash") or obj.get("items")) if HEX16.match(h)]
+    D = _clean(obj.get("dhash"))
+    T = _clean(obj.get("tphash"))
+    return P, D, T
+
+_local: Optional[Dict[str, List[str]]] = None
+_board_lists: Tuple[List[str], List[str], List[str]] = ([], [], [])
+
+def _load_local() -> Dict[str, List[str]]:
+    global _local
+    if _local is None:
+        _local = {"phash": [], "dhash": [], "tphash": []}
+        try:
+            with open(LOCAL_PATH, "r", encoding="utf-8") as f:
+                obj = json.load(f)
+            P, D, T = _lists(obj) if isinstance(obj, dict) else ([], [], [])
+            _local.update(phash=P, dhash=D, tphash=T)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning("[phash-db] local extras unreadable (%s): %r", LOCAL_PATH, e)
+    return _local
+
+def _save_local() -> None:
+    try:
+        os.makedirs(os.path.dirname(LOCAL_PATH) or ".", exist_ok=True)
+        tmp = LOCAL_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_local, f, separators=(",", ":"))
+        os.replace(tmp, LOCAL_PATH)
+    except Exception as e:
+        log.warning("[phash-db] local extras not saved: %r", e)
+
+def _merge(board: List[str], local: List[str]) -> Tuple[str, ...]:
+    seen = set(board)
+    return tuple(board) + tuple(h for h in local if h not in seen and not seen.add(h))
+
+def _publish(P: List[str], D: List[str], T: List[str]) -> bool:
+    """Board lists + local extras -> ``S``; returns True if the pHash set changed."""
+    loc = _load_local()
+    phash = _merge(P, loc["phash"])
+    old, new = set(S.phash), set(phash)
+    changed = old != new
+    if changed:
+        S.version += 1
+        S.diffs.append((S.version, frozenset(new - old), frozenset(old - new)))
+    S.phash, S.dhash, S.tphash = phash, _merge(D, loc["dhash"]), _merge(T, loc["tphash"])
+    return changed
+
+def board_lists() -> Tuple[List[str], List[str], List[str]]:
+    """``(phash, dhash, tphash)`` as stored on the board message, without local extras."""
+    return _board_lists
+
+def add_local(*, phash: Iterable[str] = (), dhash: Iterable[str] = (), tphash: Iterable[str] = ()) -> int:
+    """Keep registration extras out of the board message; returns how many were new."""
+    global _board_lists
+    loc = _load_local()
+    added = 0
+    for kind, hs in (("phash", phash), ("dhash", dhash), ("tphash", tphash)):
+        have = set(loc[kind])
+        for h in hs or ():
+            h = str(h or "").strip().lower()
+            if h and h not in have and (kind != "phash" or HEX16.match(h)):
+                loc[kind].append(h); have.add(h); added += 1
+        del loc[kind][:-LOCAL_MAX]
+    if added:
+        _save_local()
+        if S.loaded:
+            _publish(*_board_lists)
+    return added
+
+def apply_content(content: str, *, channel_id: int = 0, message_id: int = 0) -> bool:
+    """Replace the cached board with ``content``. Returns True if the pHash set changed."""
+    global _board_lists
+    obj = parse_board_obj(content)
+    P, D, T = _lists(obj) if obj else ([], [], [])
+    S.radius = parse_radii(obj)
+    S.max_radius = max(S.radius.values(), default=0)
+    _board_lists = (P, D, T)
+    changed = _publish(P, D, T)
+    if channel_id: S.channel_id = int(channel_id)
+    if message_id: S.message_id = int(message_id)
+    S.loaded, S.loaded_at = True, time.monotonic()
+    return changed
+
+def invalidate() -> None:
+    """Force the next ``get`` to re-fetch the board."""
+    S.loaded_at = 0.0
+
+def diff_since(version: int) -> Optional[Tuple[Set[str], Set[str]]]:
+    """``(added, removed)`` since ``version``, or None if too old to replay."""
+    if version == S.version:
+        return set(), set()
+    if not S.diffs or S.diffs[0][0] > version + 1:
+        return None
+    added: Set[str] = set(); removed: Set[str] = set()
+    for ver, a, r in S.diffs:
+        if ver <= version: continue
+        added -= r; removed -= a
+        added |= a; removed |= r
+    return added, removed
+
+def match_radius(h: str, dist: int, radius: int) -> bool:
+    """True if a hit ``dist`` bits from board hash ``h`` counts at ``radius``.
+
+    A compacted representative stands for members up to ``S.radius[h]`` bits
+    away, so it matches out to ``radius + S.radius[h]``; query the index with
+    ``radius + S.max_radius`` and filter with this.
+    """
+    return dist <= radius + S.radius.get(h, 0)
+
+def sync_index(index, version: int) -> int:
+    """Bring a ``PhashIndex`` (anything with add/discard/clear) up to date; returns the new version."""
+    if version == S.version:
+        return version
+    d = diff_since(version)
+    if d is None:
+        index.clear()
+        for h in S.phash: index.add(h)
+    else:
+        added, removed = d
+        for h in removed: index.discard(h)
+        for h in added: index.add(h)
+    return S.version
+
+async def _fetch_by_id(bot, channel_id: int, message_id: int):
+    if not (channel_id and message_id):
+        return None
+    try:
+        ch = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+        return await ch.fetch_message(message_id)
+    except Exception as e:
+        log.debug("[phash-db] fetch %s/%s failed: %r", channel_id, message_id, e)
+        return None
+
+async def _scan_log_channel(bot, guild=None):
+    try:
+        from nixe.config.self_learning_cfg import LOG_CHANNEL_ID, PHASH_LOG_SCAN_LIMIT
+    except Exception:
+        LOG_CHANNEL_ID, PHASH_LOG_SCAN_LIMIT = 0, 200
+    ch = None
+    if LOG_CHANNEL_ID:
+        ch = (guild.get_channel(LOG_CHANNEL_ID) if guild else None) or bot.get_channel(LOG_CHANNEL_ID)
+    if ch is None and guild is not None:
+        for c in getattr(guild, "text_channels", []):
+            if (c.name or "").lower() == "nixe-only":
+                ch = c; break
+    if ch is None or not hasattr(ch, "history"):
+        return None
+    try:
+        async for m in ch.history(limit=PHASH_LOG_SCAN_LIMIT):
+            if "```json" in (m.content or "") and parse_board(m.content)[0]:
+                return m
+    except Exception as e:
+        log.debug("[phash-db] scan failed: %r", e)
+    return None
+
+async def _locate(bot, guild=None):
+    if S.message_id:
+        msg = await _fetch_by_id(bot, S.channel_id, S.message_id)
+        if msg: return msg
+    tid, mid = get_phash_ids()
+    msg = await _fetch_by_id(bot, tid, mid)
+    if msg: return msg
+    return await _scan_log_channel(bot, guild)
+
+async def get(bot, guild=None, *, force: bool = False) -> _S:
+    """Return the cached board state, loading or refreshing it when stale."""
+    fresh = S.loaded and (time.monotonic() - S.loaded_at) < TTL_SEC
+    if fresh and not force:
+        return S
+    async with _get_lock():
+        if not force and S.loaded and (time.monotonic() - S.loaded_at) < TTL_SEC:
+            return S
+        msg = await _locate(bot, guild)
+        if msg is None:
+            # keep serving what we have; retry after another TTL
+            S.loaded_at = time.monotonic()
+            S.loaded = True
+            return S
+        changed = apply_content(msg.content or "", channel_id=msg.channel.id, message_id=msg.id)
+        log.info("[phash-db] loaded board msg=%s phash=%d v=%d%s",
+                 msg.id, len(S.phash), S.version, " (changed)" if changed else "")
+        return S
+
+def on_raw_message_edit(payload) -> bool:
+    """Refresh from a gateway edit of the board message. Returns True if it was the board."""
+    mid = int(getattr(payload, "message_id", 0) or 0)
+    if not mid:
+        return False
+    if not S.message_id:
+        tid, bmid = get_phash_ids()
+        if mid != int(bmid or 0):
+            return False
+    elif mid != S.message_id:
+        return False
+    data = getattr(payload, "data", None) or {}
+    content = data.get("content") if isinstance(data, dict) else None
+    if content is None:
+        cached = getattr(payload, "cached_message", None)
+        content = getattr(cached, "content", None)
+    if content is None:
+        invalidate()
+        return True
+    apply_content(content, channel_id=int(getattr(payload, "channel_id", 0) or 0), message_id=mid)
+    log.debug("[phash-db] board edited -> phash=%d v=%d", len(S.phash), S.version)
+    return True
+
+def on_raw_message_delete(payload) -> None:
+    if S.message_id and int(getattr(payload, "message_id", 0) or 0) == S.message_id:
+        S.message_id = 0
+        invalidate()
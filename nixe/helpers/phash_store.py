@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+phash_store — file-backed 64-bit hash set shared by the web and bot processes.
+
+Layout for a store at ``<path>``:
+- ``<path>``          snapshot: 8-byte magic + N little-endian uint64, read via mmap
+- ``<path>.journal``  append-only uint64 records added since the last compaction
+- ``<path>.lock``     flock target serialising writers/compaction across processes
+
+``add`` appends 8 bytes to the journal (O(1), no rewrite) and membership is a
+set lookup. Other processes pick up new records by tailing the journal from the
+offset they last read; a compaction (snapshot replaced, journal truncated) is
+detected by the snapshot's inode/size/mtime and triggers a full reload. Once the
+journal holds PHASH_STORE_COMPACT_EVERY records it is folded into the snapshot.
+
+A legacy JSON list file can be given; it is imported once when the binary store
+does not exist yet.
+
+ENV:
+- PHASH_STORE_COMPACT_EVERY : journal records before compaction, default 1024
+"""
+from __future__ import annotations
+import os, re, json, mmap, struct, logging, threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Union
+try:
+    import numpy as np
+except Exception:
+    np = None
+try:
+    import fcntl
+except Exception:
+    fcntl = None
+
+from nixe.helpers.phash_index import to_int, to_hex
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"NXPHS001"
+_REC = 8
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+COMPACT_EVERY = max(16, _env_int("PHASH_STORE_COMPACT_EVERY", 1024))
+HEX16 = re.compile(r"^[0-9a-f]{16}$", re.I)
+
+def _legacy_hashes(obj) -> List[str]:
+    """Hashes from the JSON shapes used so far: list, {"phash": [...]}, {"hashes": [...]}, {hash: meta}."""
+    if isinstance(obj, dict):
+        for k in ("phash", "hashes", "items"):
+            if isinstance(obj.get(k), list):
+                obj = obj[k]; break
+        else:
+            return [k for k in obj if HEX16.match(str(k))]
+    out = []
+    for it in obj if isinstance(obj, list) else []:
+        if isinstance(it, dict): it = it.get("hash")
+        it = str(it or "").strip()
+        if HEX16.match(it): out.append(it)
+    return out
+
+def _unpack(buf) -> List[int]:
+    n = len(buf) // _REC
+    if not n:
+        return []
+    if np is not None:
+        return np.frombuffer(buf, dtype="<u8", count=n).tolist()
+    return [v for (v,) in struct.iter_unpack("<Q", bytes(buf[: n * _REC]))]
+
+class PhashStore:
+    """Insertion-ordered set of uint64 hashes persisted as snapshot + journal."""
+
+    def __init__(self, path: Union[str, os.PathLike], legacy_json: Optional[Union[str, os.PathLike]] = None,
+                 compact_every: int = COMPACT_EVERY):
+        self.path = os.fspath(path)
+        self.journal = self.path + ".journal"
+        self.lock_path = self.path + ".lock"
+        self.compact_every = max(1, int(compact_every))
+        self._order: List[int] = []
+        self._set = set()
+        self._snap_sig = None
+        self._jpos = 0
+        self._tlock = threading.RLock()
+        self._loaded = False
+        self._legacy = os.fspath(legacy_json) if legacy_json else None
+
+    # ------------------------------------------------------------ locking
+
+    @contextmanager
+    def _flock(self, exclusive: bool):
+        with self._tlock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if fcntl is None:
+                yield; return
+            with open(self.lock_path, "a+b") as fh:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------ reading
+
+    def _sig(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def _read_snapshot(self) -> List[int]:
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size <= len(MAGIC):
+                    return []
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if mm[: len(MAGIC)] != MAGIC:
+                        log.warning("[phash-store] %s: bad header, ignoring snapshot", self.path)
+                        return []
+                    return _unpack(memoryview(mm)[len(MAGIC):])
+        except FileNotFoundError:
+            return []
+
+    def _tail_journal(self) -> None:
+        try:
+            with open(self.journal, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self._jpos:        # truncated by a compaction we have not seen yet
+                    self._snap_sig = None
+                    return
+                end = size - (size % _REC)   # ignore a torn trailing record
+                if end <= self._jpos:
+                    return
+                f.seek(self._jpos)
+                buf = f.read(end - self._jpos)
+        except FileNotFoundError:
+            return
+        for v in _unpack(buf):
+            if v not in self._set:
+                self._set.add(v); self._order.append(v)
+        self._jpos += len(buf) - (len(buf) % _REC)
+
+    def _refresh_locked(self) -> None:
+        sig = self._sig()
+        if sig != self._snap_sig or not self._loaded:
+            vals = self._read_snapshot()
+            self._order, self._set = [], set()
+            for v in vals:
+                if v not in self._set:
+                    self._set.add(v); self._order.append(v)
+            self._snap_sig, self._jpos, self._loaded = sig, 0, True
+        self._tail_journal()
+        if self._snap_sig is None and self._sig() is not None:
+            self._refresh_locked()
+
+    def refresh(self) -> None:
+        """Pick up records written by other processes since the last call."""
+        with self._flock(False):
+            self._refresh_locked()
+        if self._legacy and not self._order:
+            self._import_legacy()
+
+    def _import_legacy(self) -> None:
+        path, self._legacy = self._legacy, None
+        if self._sig() is not None or os.path.exists(self.journal) or not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                hs = _legacy_hashes(json.load(f))
+        except Exception as e:
+            log.warning("[phash-store] legacy import %s failed: %r", path, e)
+            return
+        n = len(self.add_many(hs, compact=False))
+        self.compact()
+        log.info("[phash-store] imported %d hash(es) from %s", n, path)
+
+    # ------------------------------------------------------------ API
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._order)
+
+    def __contains__(self, h) -> bool:
+        v = to_int(h)
+        if v is None:
+            return False
+        self.refresh()
+        return v in self._set
+
+    def values(self) -> List[int]:
+        self.refresh()
+        return list(self._order)
+
+    def hexes(self) -> List[str]:
+        return [to_hex(v) for v in self.values()]
+
+    def array(self):
+        """Hashes as a ``uint64`` numpy array (for vectorised distance scans)."""
+        return np.fromiter(self.values(), dtype=np.uint64)
+
+    def add(self, h) -> bool:
+        return bool(self.add_many([h]))
+
+    def add_many(self, hashes: Iterable, *, compact: bool = True) -> List[int]:
+        """Append unseen hashes; returns the ones actually added."""
+        if self._legacy:
+            self.refresh()
+        vals = [v for v in (to_int(h) for h in hashes) if v is not None]
+        if not vals:
+            return []
+        added: List[int] = []
+        with self._flock(True):
+            self._refresh_locked()
+            for v in vals:
+                if v not in self._set:
+                    self._set.add(v); self._order.append(v); added.append(v)
+            if added:
+                blob = struct.pack("<%dQ" % len(added), *added)
+                with open(self.journal, "ab") as f:
+                    f.write(blob); f.flush()
+                    os.fsync(f.fileno())
+                self._jpos += len(blob)
+            due = compact and self._jpos // _REC >= self.compact_every
+        if due:
+            self.compact()
+        return added
+
+    def compact(self) -> None:
+        """Fold the journal into a fresh snapshot (atomic replace) and truncate it."""
+        with self._flock(True):
+            self._refresh_locked()
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(MAGIC)
+                if self._order:
+                    if np is not None:
+                        f.write(np.asarray(self._order, dtype="<u8").tobytes())
+                    else:
+                        f.write(struct.pack("<%dQ" % len(self._order), *self._order))
+                f.flush(); os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            with open(self.journal, "wb"):
+                pass
+            self._snap_sig, self._jpos = self._sig(), 0
@@ -1,17 +1,25 @@
-
 from __future__ import annotations
 from PIL import Image
 import io
-def dhash_bytes(image_bytes: bytes) -> int:
+from nixe.helpers import np_hash
+from nixe.helpers.image_context import ImageContext
+def dhash_bytes(image_bytes, resample=Image.LANCZOS) -> int:
+    """``image_bytes`` is raw bytes or an ImageContext; ``resample=None`` = Pillow default."""
     try:
-        img = Image.open(io.BytesIO(image_bytes)).convert("L").resize((9,8), Image.LANCZOS)
+        arr = ImageContext.of(image_bytes).gray_array((9,8), resample)
     except Exception:
         return 0
-    bits = 0
-    for y in range(8):
-        for x in range(8):
-            a = img.getpixel((x, y)); b = img.getpixel((x+1, y))
-            bits = (bits << 1) | (1 if a > b else 0)
-    return bits
+    return np_hash.dhash_u64(arr, greater=True)
+def dhash_dihedral_bytes(image_bytes, resample=Image.LANCZOS) -> list:
+    """``dhash_bytes`` of the 8 flips/rotations, upright first; built from the 9x8 and 8x9 views only."""
+    import numpy as np
+    try:
+        ctx = ImageContext.of(image_bytes)
+        a, b = ctx.gray_array((9,8), resample), ctx.gray_array((8,9), resample)
+    except Exception:
+        return []
+    # a rotated upload's 9x8 view is the rotated 8x9 view of the upright one
+    views = [a, a[:, ::-1], a[::-1, :], a[::-1, ::-1], b.T, np.rot90(b, -1), np.rot90(b, 1), b[::-1, ::-1].T]
+    return [int(v) for v in np_hash.dhash_batch(np.stack(views), greater=True)]
 def hamming(a: int, b: int) -> int:
     return ((a ^ b) & ((1<<64)-1)).bit_count()
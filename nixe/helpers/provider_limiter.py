@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+provider_limiter — process-wide rate limit and concurrency governor for LLM calls.
+
+One ``Limiter`` per provider/model key (``"gemini:gemini-2.5-flash"``), shared by
+every guard, so the lucky-pull and phishing guards draw from the same free-tier
+quota instead of each stampeding it. ``gemini_client`` acquires a slot around
+every ``generateContent`` request.
+
+A slot needs, in order:
+- no active 429 penalty (``penalize`` sets one from Retry-After / retryDelay,
+  else LPG_GEM_BACKOFF_MS),
+- a token from the bucket (LPG_GEM_MAX_RPM per minute, burst of
+  LPG_GEM_MAX_CONCURRENCY) and LPG_GEM_COOLDOWN_SEC since the previous start,
+- a free concurrency slot (LPG_GEM_MAX_CONCURRENCY).
+
+Waiting is bounded by the caller's deadline: if a slot cannot be had in time
+``RateLimited`` is raised immediately (the wait would be wasted), which callers
+treat like a provider timeout. Queue waits are recorded; ``stats()`` reports
+counts and p50/p90/max wait per key, plus p50/p90 request latency
+(``observe``) which ``hedge`` uses to time speculative fallbacks.
+
+ENV (defaults from a00_lpg_rate_limit_overlay):
+- LPG_GEM_MAX_RPM          : requests per minute per model, default 6 (0 = unlimited)
+- LPG_GEM_MAX_CONCURRENCY  : in-flight requests per model, default 1
+- LPG_GEM_COOLDOWN_SEC     : min gap between request starts, default 2 (clamped to 60, with a warning)
+- LPG_GEM_BACKOFF_MS       : 429 penalty when the reply has no retry hint, default 8000
+- LPG_GEM_RETRY_ON_429     : retry once after the penalty if the deadline allows, default 1
+"""
+from __future__ import annotations
+import os, time, asyncio, logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+def _env_float(key: str, default: float) -> float:
+    try: return float(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+MAX_COOLDOWN = 60.0
+
+class RateLimited(RuntimeError):
+    """No slot within the caller's deadline (bucket empty, 429 penalty or all slots busy)."""
+
+def retry_on_429() -> bool:
+    return os.getenv("LPG_GEM_RETRY_ON_429", "1") == "1"
+
+def _pct(vals, q: float) -> float:
+    if not vals:
+        return 0.0
+    s = sorted(vals)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+class Limiter:
+    """Token bucket + min spacing + concurrency cap + 429 penalty for one key."""
+
+    def __init__(self, key: str, *, rpm: Optional[float] = None, concurrency: Optional[int] = None,
+                 cooldown: Optional[float] = None, backoff: Optional[float] = None):
+        self.key = key
+        self.rpm = max(0.0, _env_float("LPG_GEM_MAX_RPM", 6) if rpm is None else float(rpm))
+        self.concurrency = max(1, int(_env_float("LPG_GEM_MAX_CONCURRENCY", 1) if concurrency is None else concurrency))
+        self.cooldown = max(0.0, _env_float("LPG_GEM_COOLDOWN_SEC", 2) if cooldown is None else float(cooldown))
+        if self.cooldown > MAX_COOLDOWN:
+            # a start gap of minutes silently turns every guard into "deferred"
+            log.warning("[llm-limit] %s cooldown %.0fs clamped to %.0fs (LPG_GEM_COOLDOWN_SEC is a gap between "
+                        "request starts, not a 429 penalty)", key, self.cooldown, MAX_COOLDOWN)
+            self.cooldown = MAX_COOLDOWN
+        self.backoff = max(0.0, (_env_float("LPG_GEM_BACKOFF_MS", 8000) / 1000.0) if backoff is None else float(backoff))
+        self.capacity = float(self.concurrency)
+        self._tokens = self.capacity
+        self._refill_at = time.monotonic()
+        self._last_start = 0.0
+        self._blocked_until = 0.0
+        self._inflight = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._cond_loop = None
+        self.waits: Deque[float] = deque(maxlen=256)
+        self.latencies: Deque[float] = deque(maxlen=256)    # request time of successful calls (no queue wait)
+        self.counts = {"acquired": 0, "rejected": 0, "throttled_429": 0}
+
+    def _get_cond(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._cond_loop is not loop:
+            self._cond = asyncio.Condition(); self._cond_loop = loop
+        return self._cond
+
+    def _refill(self, now: float) -> None:
+        if self.rpm <= 0:
+            self._tokens = self.capacity
+        else:
+            self._tokens = min(self.capacity, self._tokens + (now - self._refill_at) * self.rpm / 60.0)
+        self._refill_at = now
+
+    def _ready_in(self, now: float) -> float:
+        """Seconds until a start is allowed by penalty, bucket and spacing (0 = now)."""
+        self._refill(now)
+        wait = max(0.0, self._blocked_until - now, self._last_start + self.cooldown - now)
+        if self._tokens < 1.0:
+            wait = max(wait, (1.0 - self._tokens) * 60.0 / self.rpm)
+        return wait
+
+    def penalize(self, seconds: Optional[float] = None) -> float:
+        """Block new starts for ``seconds`` (Retry-After) or the default backoff; returns the penalty."""
+        sec = self.backoff if seconds is None else max(0.0, float(seconds))
+        self._blocked_until = max(self._blocked_until, time.monotonic() + sec)
+        self.counts["throttled_429"] += 1
+        log.warning("[llm-limit] %s throttled, backing off %.1fs", self.key, sec)
+        return sec
+
+    def observe(self, seconds: float) -> None:
+        """Record the provider latency of one successful request (hedging uses the p90)."""
+        self.latencies.append(max(0.0, float(seconds)))
+
+    def latency(self, q: float = 0.9, min_samples: int = 1) -> Optional[float]:
+        """``q``-quantile of recent request latency, None with fewer than ``min_samples`` samples."""
+        lat = list(self.latencies)
+        return _pct(lat, q) if len(lat) >= max(1, min_samples) else None
+
+    def idle(self) -> bool:
+        """True if a request could start right now without queueing (spare budget for a hedge)."""
+        return self._inflight < self.concurrency and self._ready_in(time.monotonic()) <= 0
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None):
+        """Hold one request slot; ``deadline`` is a ``time.monotonic()`` value."""
+        cond = self._get_cond()
+        t0 = time.monotonic()
+        async with cond:
+            while True:
+                now = time.monotonic()
+                ready = self._ready_in(now)
+                if ready <= 0 and self._inflight < self.concurrency:
+                    break
+                left = (deadline - now) if deadline is not None else None
+                if left is not None and (left <= 0 or (self._inflight < self.concurrency and ready > left)):
+                    self.counts["rejected"] += 1
+                    raise RateLimited(f"{self.key}: no slot within deadline (ready in {ready:.1f}s)")
+                step = ready if self._inflight < self.concurrency else None
+                if left is not None:
+                    step = left if step is None else min(step, left)
+                try:
+                    await asyncio.wait_for(cond.wait(), timeout=step)
+                except asyncio.TimeoutError:
+                    pass
+            self._tokens -= 1.0
+            self._inflight += 1
+            self._last_start = time.monotonic()
+        self.waits.append(self._last_start - t0)
+        self.counts["acquired"] += 1
+        try:
+            yield
+        finally:
+            async with cond:
+                self._inflight -= 1
+                cond.notify_all()
+
+    def stats(self) -> dict:
+        w = list(self.waits); lat = list(self.latencies)
+        return dict(self.counts, inflight=self._inflight, tokens=round(self._tokens, 2),
+                    blocked_for=round(max(0.0, self._blocked_until - time.monotonic()), 1),
+                    wait_p50=round(_pct(w, 0.5), 3), wait_p90=round(_pct(w, 0.9), 3),
+                    wait_max=round(max(w, default=0.0), 3),
+                    lat_p50=round(_pct(lat, 0.5), 3), lat_p90=round(_pct(lat, 0.9), 3))
+
+_limiters: Dict[str, Limiter] = {}
+
+def get(key: str) -> Limiter:
+    lim = _limiters.get(key)
+    if lim is None:
+        lim = _limiters[key] = Limiter(key)
+        log.info("[llm-limit] %s rpm=%s conc=%d cooldown=%.1fs", key, lim.rpm or "inf", lim.concurrency, lim.cooldown)
+    return lim
+
+def stats() -> dict:
+    return {k: v.stats() for k, v in _limiters.items()}
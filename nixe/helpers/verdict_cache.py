@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+verdict_cache — LLM verdicts shared between near-duplicate images.
+
+``content_cache.verdict`` only helps when a repost is byte-identical. Raid
+reposts are usually re-encoded, resized or recompressed by the client, so the
+sha256 differs while the pHash moves by a few bits. Here a verdict is stored
+under the image pHash(es), per namespace ``(task, model)``, and found again by
+exact key first, then by Hamming distance <= VERDICT_CACHE_RADIUS on every
+image of the request (same image count, same order).
+
+``cached(images, task, model, compute)`` is the whole API for guards:
+- pHashes come from ``content_cache.hashed(..., "phash:1", ...)``, so they are
+  shared with phash_match_guard / a15 and never recomputed for the same bytes;
+- a miss goes through ``content_cache.verdict`` (exact-bytes cache + coalescing)
+  and concurrent misses on near-identical images wait for the first call;
+- ``store_if(result)`` keeps provider errors out, TTL is ``LPG_GEM_CACHE_TTL_SEC``.
+
+Moderator overrides (whitelist thread → ``lpg_whitelist_ingestor``) call
+``invalidate(phashes, digest)`` so the overridden image and its near copies are
+re-judged instead of replaying the old verdict. ``stats()`` reports exact/near
+hits, misses and entries per namespace.
+
+ENV:
+- VERDICT_CACHE_RADIUS    : max pHash bit distance for a near hit, default 6 (0 = exact only)
+- VERDICT_CACHE_MAX_ITEMS : entries per (task, model), default 4096
+"""
+from __future__ import annotations
+import os, time, asyncio, logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+from nixe.helpers import content_cache, img_hashing
+from nixe.helpers.phash_index import _popcount64, hamming, to_int
+
+log = logging.getLogger(__name__)
+
+def _env_int(key: str, default: int) -> int:
+    try: return int(os.getenv(key, str(default)) or default)
+    except Exception: return default
+
+RADIUS = max(0, _env_int("VERDICT_CACHE_RADIUS", 6))
+MAX_ITEMS = max(16, _env_int("VERDICT_CACHE_MAX_ITEMS", 4096))
+
+Key = Tuple[int, ...]
+_MISSING = object()
+
+class _Space:
+    """Verdicts of one (task, model): LRU of pHash tuple -> [value, expires_at]."""
+
+    def __init__(self):
+        self.items: "OrderedDict[Key, list]" = OrderedDict()
+        self.pending: Dict[Key, asyncio.Future] = {}
+        self._arr = None          # (uint64 first hashes, keys) rebuilt lazily
+
+    def _index(self):
+        if self._arr is None:
+            keys = list(self.items)
+            firsts = [k[0] for k in keys]
+            self._arr = (np.fromiter(firsts, dtype=np.uint64, count=len(firsts)) if np is not None else firsts, keys)
+        return self._arr
+
+    def _near(self, key: Key, radius: int, keys: Iterable[Key]) -> Optional[Key]:
+        best, best_d = None, radius + 1
+        for k in keys:
+            if len(k) != len(key):
+                continue
+            d = max(hamming(a, b) for a, b in zip(k, key))
+            if d < best_d:
+                best, best_d = k, d
+        return best
+
+    def find(self, key: Key, radius: int) -> Tuple[Optional[Key], bool]:
+        """``(stored key, exact?)`` of the closest live entry within ``radius``."""
+        if key in self.items:
+            return key, True
+        if radius <= 0 or not self.items:
+            return None, False
+        firsts, keys = self._index()
+        if np is not None:
+            d = _popcount64(firsts ^ np.uint64(key[0]))
+            cand = [keys[i] for i in np.nonzero(d <= radius)[0]]
+        else:
+            cand = [k for k, f in zip(keys, firsts) if hamming(f, key[0]) <= radius]
+        return self._near(key, radius, cand), False
+
+    def get(self, k: Key):
+        rec = self.items.get(k)
+        if rec is None:
+            return _MISSING
+        if rec[1] < time.time():
+            self.drop(k)
+            return _MISSING
+        self.items.move_to_end(k)
+        return rec[0]
+
+    def put(self, k: Key, value: Any, ttl: float) -> None:
+        if k not in self.items:
+            self._arr = None
+        self.items[k] = [value, time.time() + ttl]
+        self.items.move_to_end(k)
+        while len(self.items) > MAX_ITEMS:
+            self.items.popitem(last=False)
+            self._arr = None
+
+    def drop(self, k: Key) -> None:
+        if self.items.pop(k, None) is not None:
+            self._arr = None
+
+_spaces: Dict[Tuple[str, str], _Space] = {}
+_stats = {"exact_hits": 0, "near_hits": 0, "misses": 0, "coalesced": 0, "unhashable": 0, "invalidated": 0}
+
+def _space(task: str, model: str) -> _Space:
+    s = _spaces.get((task, model))
+    if s is None:
+        s = _spaces[(task, model)] = _Space()
+    return s
+
+async def phash_key(images: Sequence[bytes], atts: Optional[Sequence] = None) -> Optional[Key]:
+    """First-frame pHash of every image (cached per content digest); None if any image fails."""
+    out: List[int] = []
+    for i, data in enumerate(images):
+        att = atts[i] if atts and i < len(atts) else None
+        try:
+            hs = await content_cache.hashed(data, "phash:1", img_hashing.phash_list_from_bytes, max_frames=1, att=att)
+        except Exception:
+            hs = None
+        v = to_int(hs[0]) if hs else None
+        if v is None:
+            return None
+        out.append(v)
+    return tuple(out) or None
+
+async def cached(images: Union[bytes, Sequence[bytes]], task: str, model: str,
+                 compute: Callable[[], Awaitable[Any]], *, store_if: Optional[Callable[[Any], bool]] = None,
+                 atts: Optional[Sequence] = None, radius: Optional[int] = None) -> Any:
+    """Verdict of ``compute()`` for ``images``, reused for near-duplicates within the TTL."""
+    if isinstance(images, (bytes, bytearray)):
+        images = [bytes(images)]
+    # drop empty buffers together with their attachments so digests stay keyed to the right att id
+    pairs = [(b, a) for b, a in zip(images, list(atts or ()) + [None] * len(images)) if b]
+    images = [b for b, _a in pairs]
+    atts = [a for _b, a in pairs] if atts else None
+    ttl = content_cache.verdict_ttl()
+    if ttl <= 0 or not images:
+        return await compute()
+    r = RADIUS if radius is None else max(0, int(radius))
+    key = await phash_key(images, atts)
+    ck = content_cache.digest(images[0], atts[0] if atts else None)
+    if len(images) > 1:
+        ck = content_cache.digest(b"".join(content_cache.digest(b).encode() for b in images))
+    name = f"{task}:{model}"
+    sp = _space(task, model)
+    if key is None:
+        _stats["unhashable"] += 1
+        return await content_cache.verdict(ck, name, compute, store_if=store_if)
+
+    k, exact = sp.find(key, r)
+    if k is not None:
+        v = sp.get(k)
+        if v is not _MISSING:
+            _stats["exact_hits" if exact else "near_hits"] += 1
+            return v
+    pk = key if key in sp.pending else sp._near(key, r, list(sp.pending))
+    if pk is not None:
+        _stats["coalesced"] += 1
+        try:
+            return await asyncio.shield(sp.pending[pk])
+        except Exception:
+            pass      # the first caller failed; try ourselves
+
+    _stats["misses"] += 1
+    fut = asyncio.get_running_loop().create_future()
+    sp.pending[key] = fut
+    try:
+        result = await content_cache.verdict(ck, name, compute, store_if=store_if)
+    except BaseException as e:
+        if isinstance(e, Exception):
+            fut.set_exception(e); fut.exception()
+        else:
+            fut.cancel()
+        raise
+    finally:
+        sp.pending.pop(key, None)
+    if store_if is None or store_if(result):
+        sp.put(key, result, ttl)
+    if not fut.done(): fut.set_result(result)
+    return result
+
+def invalidate(phashes: Iterable[Union[str, int]] = (), digest: Optional[str] = None,
+               task: Optional[str] = None, radius: Optional[int] = None) -> int:
+    """Forget verdicts for images within ``radius`` of ``phashes`` (and the exact digest); returns entries dropped."""
+    r = RADIUS if radius is None else max(0, int(radius))
+    qs = [v for v in (to_int(h) for h in phashes) if v is not None]
+    n = 0
+    for (t, _m), sp in _spaces.items():
+        if task is not None and t != task:
+            continue
+        drop = [k for k in sp.items if any(hamming(x, q) <= r for x in k for q in qs)]
+        for k in drop:
+            sp.drop(k)
+        n += len(drop)
+    if digest:
+        for (t, m) in list(_spaces):
+            if task is None or t == task:
+                content_cache.forget(digest, f"verdict:{t}:{m}")
+    _stats["invalidated"] += n
+    if n:
+        log.info("[verdict-cache] invalidated %d verdict(s) near %d hash(es)", n, len(qs))
+    return n
+
+def clear(task: Optional[str] = None) -> None:
+    for (t, m) in list(_spaces):
+        if task is None or t == task:
+            _spaces.pop((t, m), None)
+
+def stats() -> dict:
+    hits = _stats["exact_hits"] + _stats["near_hits"]
+    total = hits + _stats["misses"]
+    return dict(_stats, radius=RADIUS, hit_rate=round(hits / total, 4) if total else 0.0,
+                spaces={f"{t}:{m}": len(sp.items) for (t, m), sp in _spaces.items()})
@@ -31,6 +31,8 @@ async def on_ready():
 
 async def main():
     async with bot:
+        from nixe.helpers import gemini_client
+        gemini_client.bind_loop()
         for ext in ["nixe.cogs.image_phish_guard","nixe.cogs.link_phish_guard"]:
             try:
                 await bot.load_extension(ext)
@@ -0,0 +1,100 @@
+# tools/train_lucky_model.py
+# Train the offline lucky-pull model (nixe.helpers.lucky_model) from our own labels.
+#
+# Usage:
+#   python tools/train_lucky_model.py                       # samples + prototypes, publish new version
+#   python tools/train_lucky_model.py --pos shots/lucky --neg shots/chat --dry-run
+#
+# Sources:
+#   - LPG_MODEL_SAMPLES (data/lpg_samples.jsonl): whitelist-thread overrides and
+#     confident provider verdicts recorded by the bot (features only)
+#   - --pos DIR (default data/gacha_phash/prototypes) / --neg DIR image folders
+# Output: LPG_MODEL_DIR/lucky_lr_vNNN.npz + current.json (the bot reloads it live).
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np  # noqa: E402
+from nixe.helpers import lucky_model as LM  # noqa: E402
+
+IMG_EXT = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp")
+
+def build_args():
+    p = argparse.ArgumentParser(description="Train the local lucky-pull classifier (NumPy logistic regression).")
+    p.add_argument("--samples", default=LM.samples_path(), help="labeled feature rows (JSONL)")
+    p.add_argument("--pos", action="append", default=None,
+                   help="folder of lucky-pull screenshots (repeatable; default data/gacha_phash/prototypes)")
+    p.add_argument("--neg", action="append", default=[], help="folder of ordinary images (repeatable)")
+    p.add_argument("--l2", type=float, default=1.0, help="L2 regularisation, default 1.0")
+    p.add_argument("--holdout", type=float, default=0.2, help="validation fraction, default 0.2")
+    p.add_argument("--target-precision", type=float, default=0.98,
+                   help="precision required on each side of the decision band, default 0.98")
+    p.add_argument("--min-per-class", type=int, default=20, help="refuse to train below this, default 20")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--dry-run", action="store_true", help="train and report, do not publish")
+    return p.parse_args()
+
+def _folder_rows(dirs, label):
+    X, y = [], []
+    for d in dirs:
+        if not os.path.isdir(d):
+            continue
+        for fn in sorted(os.listdir(d)):
+            if not fn.lower().endswith(IMG_EXT):
+                continue
+            x = LM.features_from_file(os.path.join(d, fn))
+            if x is None:
+                print(f"[skip] {fn}: undecodable")
+                continue
+            X.append(x); y.append(label)
+    return X, y
+
+def main():
+    args = build_args()
+    X, y, counts = LM.load_samples(args.samples)
+    pos_dirs = args.pos if args.pos is not None else ["data/gacha_phash/prototypes"]
+    for dirs, label, name in ((pos_dirs, 1, "pos_dir"), (args.neg, 0, "neg_dir")):
+        fx, fy = _folder_rows(dirs, label)
+        X += fx; y += fy
+        if fx: counts[name] = len(fx)
+    y_arr = np.asarray(y)
+    n_pos, n_neg = int((y_arr == 1).sum()), int((y_arr == 0).sum())
+    print(f"samples: {len(y)} (pos={n_pos} neg={n_neg}) by source {counts}")
+    if min(n_pos, n_neg) < args.min_per_class:
+        raise SystemExit(f"need >= {args.min_per_class} samples per class; collect more labels first.")
+
+    X_arr = np.asarray(X, dtype=np.float64)
+    rng = np.random.default_rng(args.seed)
+    idx = rng.permutation(len(y_arr))
+    n_val = max(1, int(len(idx) * args.holdout))
+    val, tr = idx[:n_val], idx[n_val:]
+
+    w, b, mean, std = LM.fit(X_arr[tr], y_arr[tr], l2=args.l2)
+    probe = LM.Model(w, b, mean, std, 0.0, 1.0)
+    pv = probe.prob(X_arr[val])
+    low, high = LM.pick_band(pv, y_arr[val], args.target_precision)
+    acc = float(((pv >= 0.5) == (y_arr[val] == 1)).mean())
+    decided = (pv >= high) | (pv <= low)
+    coverage = float(decided.mean())
+    band_acc = float(((pv[decided] >= high) == (y_arr[val][decided] == 1)).mean()) if decided.any() else 0.0
+    print(f"holdout n={len(val)} acc@0.5={acc:.3f} band=[{low}, {high}] coverage={coverage:.1%} band_acc={band_acc:.3f}")
+
+    # final model on everything, band from the holdout
+    w, b, mean, std = LM.fit(X_arr, y_arr, l2=args.l2)
+    m = LM.Model(w, b, mean, std, low, high, {
+        "trained_at": int(time.time()), "n": len(y), "n_pos": n_pos, "n_neg": n_neg, "sources": counts,
+        "holdout": {"acc": round(acc, 4), "coverage": round(coverage, 4), "band_acc": round(band_acc, 4)},
+        "l2": args.l2, "features": LM.FEATURE_NAMES,
+    })
+    t = time.perf_counter()
+    for _ in range(1000):
+        m.prob(X_arr[:1])
+    print(f"score latency: {(time.perf_counter() - t) * 1000:.1f} us per call (feature extraction excluded)")
+    if args.dry_run:
+        print("[dry-run] not published")
+        return
+    v = LM.next_version()
+    fn = LM.publish(m, v)
+    print(f"[OK] published {fn} (version {v}) -> {os.path.join(LM.model_dir(), 'current.json')}")
+
+if __name__ == "__main__":
+    main()